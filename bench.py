@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""离线基准测试：在本机启动假频道页、假订阅和假节点农场，测量整条流水线及两个测试脚本的吞吐
+
+    python bench.py --sizes 1000,10000,100000
+
+全部流量只在回环地址上流动，不需要访问 Telegram、订阅站点或 httpbin；相同的 --seed 产生相同的节点集合。
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+from loguru import logger
+
+import main
+from dedup import DedupIndex
+from metrics import REGISTRY
+from output import save_proxies
+from parsers import parse_line
+from prober import raise_nofile_limit
+from proxy_to_http import ProxyToHTTP
+from test_proxies import ProxyTester
+
+# 测试脚本访问的目标地址，假节点收到后直接应答，不会真正解析或外连
+TARGET = 'http://bench.invalid'
+
+
+def vmess_line(host, port, rng):
+    config = {'v': '2', 'ps': f'vmess-{host}-{port}', 'add': host, 'port': str(port),
+              'id': '%08x-0000-4000-8000-%012x' % (rng.getrandbits(32), rng.getrandbits(48)),
+              'aid': '0', 'net': rng.choice(('tcp', 'ws')), 'type': 'none', 'host': '', 'path': '/', 'tls': ''}
+    return 'vmess://' + base64.b64encode(json.dumps(config).encode()).decode()
+
+
+def ss_line(host, port, rng):
+    userinfo = base64.urlsafe_b64encode(f'aes-128-gcm:pw{rng.getrandbits(32):x}'.encode()).decode().rstrip('=')
+    return f'ss://{userinfo}@{host}:{port}#ss-{host}-{port}'
+
+
+def trojan_line(host, port, rng):
+    return f'trojan://pw{rng.getrandbits(32):x}@{host}:{port}?sni=bench.invalid#trojan-{host}-{port}'
+
+
+LINE_BUILDERS = {'vmess': vmess_line, 'ss': ss_line, 'trojan': trojan_line}
+
+
+class NodeFarm:
+    """假节点农场：一组本地TCP监听端口，按节点注入延迟、拒绝连接或卡住不响应
+
+    监听在 0.0.0.0 上，所以 127.x.y.z 的任意回环地址都能连到，少量端口即可组成上万个不同的 host:port 端点。
+    每个可用端点像一个HTTP代理一样应答，延迟由端点地址确定性地算出，多次运行结果一致。
+    TCP握手由内核完成，无法注入握手延迟：延迟只体现在HTTP层，TCP探测只区分可达与拒绝。
+    """
+
+    def __init__(self, ports=200, latency=(5, 50), drop_rate=0.2, stall_rate=0.1, stall_seconds=2):
+        self.port_count = ports
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.ports = []
+        self.stall_ports = []
+        self.closed_ports = []
+        self.servers = []
+
+    async def start(self):
+        for _ in range(self.port_count):
+            server = await asyncio.start_server(self.handle, '0.0.0.0', 0, backlog=1024)
+            self.servers.append(server)
+            self.ports.append(server.sockets[0].getsockname()[1])
+            server = await asyncio.start_server(self.stall, '0.0.0.0', 0, backlog=1024)
+            self.servers.append(server)
+            self.stall_ports.append(server.sockets[0].getsockname()[1])
+        # 绑定后立即关闭的端口，连接会被拒绝
+        sockets = [socket.socket() for _ in range(self.port_count)]
+        for sock in sockets:
+            sock.bind(('127.0.0.1', 0))
+            self.closed_ports.append(sock.getsockname()[1])
+        for sock in sockets:
+            sock.close()
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    def endpoints(self, count, rng):
+        """生成 count 个互不相同的端点 [(host, port)]，按比例混入拒绝连接和卡住的节点"""
+        result = []
+        for i in range(count):
+            slot = i // self.port_count + 1
+            host = f'127.{(slot >> 16) & 255}.{(slot >> 8) & 255}.{slot & 255}'
+            roll = rng.random()
+            # 三类端口数量相同，同一个 host 下每类端口各用一次，端点互不重复
+            if roll < self.drop_rate:
+                port = self.closed_ports[i % self.port_count]
+            elif roll < self.drop_rate + self.stall_rate:
+                port = self.stall_ports[i % self.port_count]
+            else:
+                port = self.ports[i % self.port_count]
+            result.append((host, port))
+        return result
+
+    def delay(self, host, port):
+        digest = hashlib.blake2b(f'{host}:{port}'.encode(), digest_size=2).digest()
+        low, high = self.latency
+        return (low + (high - low) * int.from_bytes(digest, 'big') / 65535) / 1000
+
+    async def handle(self, reader, writer):
+        """极简HTTP代理：每个请求等待该端点的延迟后返回固定内容，支持长连接"""
+        host, port = writer.get_extra_info('sockname')[:2]
+        delay = self.delay(host, port)
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+                parts = request_line.split()
+                if len(parts) != 3 or parts[0] == 'CONNECT':
+                    writer.write(b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    break
+                await asyncio.sleep(delay)
+                if parts[1].endswith('/baidu'):
+                    body = '<html><title>百度一下</title>baidu</html>'.encode()
+                    content_type = b'text/html; charset=utf-8'
+                else:
+                    body = json.dumps({'origin': host, 'ip': host}).encode()
+                    content_type = b'application/json'
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: ' + content_type +
+                             b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stall(self, reader, writer):
+        """接受连接但不应答，stall_seconds 后断开"""
+        asyncio.get_running_loop().call_later(self.stall_seconds, writer.close)
+
+
+class FakeSources:
+    """假频道页与订阅服务：频道页 /s/<频道> 列出订阅链接，订阅 /sub/<编号> 按比例输出Base64或明文"""
+
+    def __init__(self, channels=10, per_sub=500, overlap=0.1, base64_rate=0.5):
+        self.channels = channels
+        self.per_sub = per_sub
+        self.overlap = overlap
+        self.base64_rate = base64_rate
+        self.pages = {}
+        self.subs = {}
+        self.runner = None
+        self.port = None
+
+    def sub_count(self, size):
+        return max(1, -(-size // self.per_sub))
+
+    def load(self, lines, seed):
+        """把节点链接分配到各个订阅，相邻订阅之间有 overlap 比例的重复节点"""
+        rng = random.Random(seed)
+        self.subs.clear()
+        self.pages.clear()
+        count = self.sub_count(len(lines))
+        for k in range(count):
+            chunk = lines[k * self.per_sub:(k + 1) * self.per_sub]
+            extra = lines[(k + 1) * self.per_sub:][:int(len(chunk) * self.overlap)]
+            text = '\n'.join(chunk + extra) + '\n'
+            if rng.random() < self.base64_rate:
+                text = base64.b64encode(text.encode()).decode()
+            self.subs[str(k)] = text.encode()
+        for c in range(self.channels):
+            links = ''.join(f'<a href="http://127.0.0.1:{self.port}/sub/{k}">sub {k}</a>\n'
+                            for k in range(c, count, self.channels))
+            self.pages[f'bench{c}'] = f'<html><body>{links}</body></html>'.encode()
+
+    @property
+    def channel_urls(self):
+        return [f'http://127.0.0.1:{self.port}/s/bench{c}' for c in range(self.channels)]
+
+    async def page(self, request):
+        return web.Response(body=self.pages[request.match_info['name']], content_type='text/html')
+
+    async def sub(self, request):
+        return web.Response(body=self.subs[request.match_info['k']], content_type='text/plain')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/s/{name}', self.page)
+        app.router.add_get('/sub/{k}', self.sub)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def serve_fakes(conn, farm, sources):
+    """子进程入口：运行节点农场和假订阅服务，按父进程发来的 (lines, seed) 重新装载订阅内容
+
+    假服务放在独立进程中，不与被测代码争抢GIL和事件循环，测出的才是被测代码自身的吞吐。
+    """
+    async def run():
+        await farm.start()
+        await sources.start()
+        conn.send((farm.ports, farm.stall_ports, farm.closed_ports, sources.port))
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, conn.recv)
+            if message is None:
+                break
+            sources.load(*message)
+            conn.send(True)
+        await sources.stop()
+        await farm.stop()
+
+    raise_nofile_limit(65536)
+    asyncio.run(run())
+
+
+def run_pipeline(channel_urls, target_count):
+    """按 main.py 的顺序跑抓取→解析去重→DNS→Top-K探测，返回统计"""
+    main.dedup_index = DedupIndex()
+    start = time.perf_counter()
+    parsed = asyncio.run(main.collect(channel_urls))
+    collect_s = time.perf_counter() - start
+    candidates = main.dedup_index.representatives()
+    results, top = asyncio.run(main.test_connectivity(candidates, target_count=target_count))
+    elapsed = time.perf_counter() - start
+    snapshot = REGISTRY.snapshot()
+    stages = {key.split('=', 1)[1]: value['sum'] for key, value in snapshot.get('collect_stage_seconds', {}).items()}
+    decode_s = snapshot.get('collect_decode_seconds_total', {}).get('total', 0)
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'collect_s': round(collect_s, 2),
+        'dns_s': stages.get('dns'),
+        'probe_s': stages.get('probe'),
+        'decode_s': round(decode_s, 3),
+        'parsed': parsed,
+        'unique': len(main.dedup_index),
+        'endpoints': len(candidates),
+        'alive': sum(rtt is not None for _, rtt in results),
+        'top': len(top),
+        'bytes': sum(snapshot.get('collect_fetch_bytes_total', {}).values()),
+        'parse_rate': round(parsed / decode_s) if decode_s else None,
+        'nodes_per_s': round(parsed / elapsed) if elapsed else None,
+    }
+
+
+def run_tester(path, workers):
+    tester = ProxyTester(path, rate_interval=0)
+    tester.test_urls = [f'{TARGET}/ip']
+    tester.baidu_url = f'{TARGET}/baidu'
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = tester.test_all_proxies_concurrent(max_test=sys.maxsize, max_workers=workers,
+                                                    report_file='proxy_test_report.json')
+    return {'elapsed_s': report['elapsed_s'], 'tested': report['tested'], 'working': report['working'],
+            'nodes_per_s': round(report['tested'] / report['elapsed_s']) if report['elapsed_s'] else None}
+
+
+def run_converter(path, workers):
+    converter = ProxyToHTTP(path)
+    converter.test_urls = [f'{TARGET}/ip']
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        converter.convert_all_to_http(max_workers=workers, max_test=sys.maxsize)
+    elapsed = time.perf_counter() - start
+    working = 0
+    if os.path.exists('http_proxies.json'):
+        with open('http_proxies.json', encoding='utf-8') as f:
+            working = json.load(f)['count']
+        os.remove('http_proxies.json')
+    return {'elapsed_s': round(elapsed, 2), 'working': working}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='离线基准测试（假频道/订阅/节点农场）')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='节点规模，逗号分隔')
+    parser.add_argument('--only', default='pipeline,tester,converter', help='要测的部分：pipeline,tester,converter')
+    parser.add_argument('--mix', default='vmess:0.4,ss:0.3,trojan:0.3', help='协议比例')
+    parser.add_argument('--per-sub', type=int, default=500, help='每个订阅的节点数')
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--overlap', type=float, default=0.1, help='相邻订阅之间重复节点的比例')
+    parser.add_argument('--base64-rate', type=float, default=0.5, help='Base64编码订阅的比例')
+    parser.add_argument('--ports', type=int, default=200, help='节点农场监听端口数')
+    parser.add_argument('--latency', default='5,50', help='HTTP层注入延迟范围(毫秒)')
+    parser.add_argument('--drop-rate', type=float, default=0.2, help='拒绝连接的节点比例')
+    parser.add_argument('--stall-rate', type=float, default=0.1, help='接受连接但不应答的节点比例')
+    parser.add_argument('--stall-seconds', type=float, default=2)
+    parser.add_argument('--workers', type=int, default=32, help='两个测试脚本的线程数')
+    parser.add_argument('--target-count', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='把结果另存为JSON')
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    raise_nofile_limit(65536)
+
+    mix = [(name, float(weight)) for name, weight in (item.split(':') for item in args.mix.split(','))]
+    farm = NodeFarm(args.ports, latency=tuple(map(float, args.latency.split(','))), drop_rate=args.drop_rate,
+                    stall_rate=args.stall_rate, stall_seconds=args.stall_seconds)
+    sources = FakeSources(args.channels, args.per_sub, args.overlap, args.base64_rate)
+
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve_fakes, args=(child_conn, farm, sources), daemon=True)
+    process.start()
+    farm.ports, farm.stall_ports, farm.closed_ports, sources.port = conn.recv()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    os.chdir(workdir)  # 抓取缓存、健康库和报告都写在临时目录，每个规模都是冷启动
+    report = {}
+    for size in map(int, args.sizes.split(',')):
+        rng = random.Random(args.seed)
+        names, weights = zip(*mix)
+        lines = [LINE_BUILDERS[rng.choices(names, weights)[0]](host, port, rng)
+                 for host, port in farm.endpoints(size, rng)]
+        conn.send((lines, args.seed))
+        conn.recv()
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        REGISTRY.reset()
+        result = report[size] = {}
+        print(f'== {size} 个节点，{sources.sub_count(size)} 个订阅，{sources.channels} 个频道 ==')
+
+        if 'pipeline' in args.only:
+            result['pipeline'] = run_pipeline(sources.channel_urls, args.target_count)
+            print('  pipeline  ', result['pipeline'])
+        if 'tester' in args.only or 'converter' in args.only:
+            save_proxies('bench_proxies.json', [parse_line(line) for line in lines])
+        if 'tester' in args.only:
+            result['tester'] = run_tester('bench_proxies.json', args.workers)
+            print('  tester    ', result['tester'])
+        if 'converter' in args.only:
+            result['converter'] = run_converter('bench_proxies.json', args.workers)
+            print('  converter ', result['converter'])
+
+    conn.send(None)
+    process.join()
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
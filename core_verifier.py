@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import aiohttp
+from loguru import logger
+
+from exporters import TEST_URL, v2ray_outbound
+
+
+def build_core_config(batch, base_port):
+    """一个核心进程承载一批节点：每个节点一个本地HTTP入站，按入站tag路由到对应出站
+
+    返回 (config, [(proxy, 本地端口)])，核心不支持的节点不会出现在结果中。
+    """
+    inbounds, outbounds, rules, ports = [], [], [], []
+    for i, proxy in enumerate(batch):
+        outbound = v2ray_outbound(proxy, f'out-{i}')
+        if outbound is None:
+            continue
+        port = base_port + i
+        inbounds.append({'tag': f'in-{i}', 'listen': '127.0.0.1', 'port': port, 'protocol': 'http'})
+        outbounds.append(outbound)
+        rules.append({'type': 'field', 'inboundTag': [f'in-{i}'], 'outboundTag': f'out-{i}'})
+        ports.append((proxy, port))
+    config = {
+        'log': {'loglevel': 'none'},
+        'inbounds': inbounds,
+        'outbounds': outbounds,
+        'routing': {'rules': rules}
+    }
+    return config, ports
+
+
+class CoreVerifier:
+    """通过本地 xray 核心进程池做真实的协议握手验证
+
+    每个核心进程一次加载一整批节点（batch_size 个出站），对每个节点经其本地入站
+    发起一次完整的HTTP请求；多个核心并行处理不同批次，吞吐来自批处理而不是每节点一个进程。
+    """
+
+    def __init__(self, core_path=None, pool_size=4, batch_size=200, base_port=20000,
+                 test_url=TEST_URL, timeout=10, concurrency=64):
+        self.core_path = core_path or shutil.which('xray') or shutil.which('v2ray')
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.base_port = base_port
+        self.test_url = test_url
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    @property
+    def available(self):
+        return bool(self.core_path)
+
+    async def start_core(self, config):
+        """写出临时配置并启动核心，返回 (进程, 配置文件路径)；启动失败时删除临时配置"""
+        fd, path = tempfile.mkstemp(prefix='core-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f)
+            process = await asyncio.create_subprocess_exec(self.core_path, 'run', '-c', path,
+                                                           stdout=asyncio.subprocess.DEVNULL,
+                                                           stderr=asyncio.subprocess.DEVNULL)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return process, path
+
+    async def wait_ready(self, port, deadline=5, process=None):
+        """等待核心开始监听；核心进程已经退出（如拒绝了配置）时立即返回 False"""
+        end = time.monotonic() + deadline
+        while time.monotonic() < end:
+            if process is not None and process.returncode is not None:
+                return False
+            try:
+                _, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.close()
+                return True
+            except OSError:
+                await asyncio.sleep(0.1)
+        return False
+
+    async def request_through(self, session, port):
+        """经本地入站发起一次完整请求，成功返回耗时(毫秒)"""
+        start = time.perf_counter()
+        try:
+            async with session.get(self.test_url, proxy=f'http://127.0.0.1:{port}') as resp:
+                await resp.read()
+                if resp.status in (200, 204):
+                    return (time.perf_counter() - start) * 1000
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        return None
+
+    async def verify_batch(self, batch, base_port):
+        config, ports = build_core_config(batch, base_port)
+        if not ports:
+            return []
+        process, path = await self.start_core(config)
+        try:
+            if not await self.wait_ready(ports[0][1], process=process):
+                logger.warning(f'代理核心启动失败（退出码 {process.returncode}），跳过本批节点')
+                return []
+            sem = asyncio.Semaphore(self.concurrency)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async def run(proxy, port):
+                    async with sem:
+                        return proxy, await self.request_through(session, port)
+                return await asyncio.gather(*(run(proxy, port) for proxy, port in ports))
+        finally:
+            try:
+                if process.returncode is None:
+                    try:
+                        process.terminate()
+                    except ProcessLookupError:
+                        pass  # 检查之后、发信号之前进程已经退出
+                await process.wait()
+            finally:
+                os.remove(path)
+
+    async def verify(self, proxies):
+        """验证所有节点，返回 [(proxy, rtt)]，核心不支持的协议不在结果中"""
+        batches = [proxies[i:i + self.batch_size] for i in range(0, len(proxies), self.batch_size)]
+        slots = asyncio.Queue()
+        for slot in range(self.pool_size):
+            slots.put_nowait(slot)
+
+        async def run(batch):
+            slot = await slots.get()
+            try:
+                return await self.verify_batch(batch, self.base_port + slot * self.batch_size)
+            finally:
+                slots.put_nowait(slot)
+
+        results = []
+        for batch_results in await asyncio.gather(*(run(batch) for batch in batches)):
+            results.extend(batch_results)
+        ok = sum(rtt is not None for _, rtt in results)
+        logger.info(f'核心验证 {len(results)} 个节点，{ok} 个可以真正转发流量')
+        return results
@@ -0,0 +1,385 @@
+import asyncio
+import heapq
+import time
+from functools import partial
+from loguru import logger
+
+from fetcher import AsyncFetcher
+from fetch_cache import FetchCache
+from stream_parse import StreamDecoder
+from parsers import parse_line, parse_clash_proxy
+from parse_pool import default_pool
+from dedup import DedupIndex
+from resolver import DNSCache
+from prober import TCPProber, raise_nofile_limit
+from health_db import HealthDB
+from source_scores import SourceScores, source_yields
+from output import save_proxies
+from exporters import EXPORT_DIR, export_all
+from delta import DeltaWriter
+from geoip import cap_per_asn, load_geoip, region_filter
+from query_api import PoolIndex, QueryAPI
+from settings import channel_urls
+from metrics import STAGE_SECONDS, QUEUE_DEPTH, ALIVE, record_probe, record_source_yields
+
+# 清理不再出现的订阅、节点以及过期的健康记录与抓取缓存的间隔(秒)
+PRUNE_INTERVAL = 600
+
+
+class CollectorDaemon:
+    """常驻采集服务：频道抓取、订阅刷新、解析去重、连通性探测作为独立阶段各自按节奏运行
+
+    阶段之间用有界队列连接，下游处理不过来时上游会在 put 上等待（背压）；
+    可用节点池一有变化，就由发布阶段原子地写出结果文件。
+    频道不再列出的订阅、订阅不再包含的节点超过 stale_after 秒后被移除，不再刷新、探测和发布。
+    频道和订阅都按来源评分（source_scores.py）分配抓取：每轮频道按评分抽样、最多 channel_budget 个，
+    订阅的刷新间隔按评分拉长，产出低的来源抓取得更少；复测时产出高的来源的端点优先。
+    用 from_settings 创建时，配置文件重新加载后节奏、worker数、超时等参数在运行中直接生效。
+    """
+
+    def __init__(self, channels, output_file, extract_links, channel_interval=300, sub_interval=600, probe_interval=60,
+                 publish_interval=5, sub_workers=16, probe_workers=500, queue_size=10000,
+                 target_count=50, probe_timeout=5, export_formats=(), export_dir=EXPORT_DIR, delta_dir=None, api_port=0,
+                 fetch_options=None, geoip=None):
+        self.channels = channels
+        self.output_file = output_file
+        self.extract_links = extract_links  # handler(频道URL, 页面文本) -> {'urls': [...], 'nodes': [...]}
+        self.channel_interval = channel_interval
+        self.sub_interval = sub_interval
+        self.probe_interval = probe_interval
+        self.publish_interval = publish_interval
+        self.sub_workers = sub_workers
+        self.probe_workers = probe_workers
+        self.target_count = target_count
+        self.export_formats = export_formats
+        self.export_dir = export_dir
+        self.deltas = DeltaWriter(delta_dir) if delta_dir else None
+        self.api_port = api_port
+        self.index = PoolIndex()  # 所有可用节点的查询索引，随探测结果增量维护
+        self.fetch_options = fetch_options or {'max_in_flight': 64, 'per_host': 4, 'timeout': 10}
+        self.fetcher = None
+        self.settings = None
+        self.workers = {'sub': {}, 'probe': {}}  # 类型 -> {编号: task}
+        self.geoip = geoip      # 离线IP库（geoip.GeoIP），None 表示不查询地区
+        self.allowed = None     # 地区筛选谓词 allowed(geo)，None 表示不筛选
+        self.max_per_asn = 0
+        self.stale_after = 86400
+        self.health_max_age = 7 * 86400
+        self.cache_max_age = 3 * 86400
+
+        self.sub_queue = asyncio.Queue(maxsize=queue_size)
+        self.record_queue = asyncio.Queue(maxsize=queue_size)
+        self.probe_queue = asyncio.Queue(maxsize=queue_size)
+
+        self.cache = FetchCache()
+        self.pool = default_pool()
+        self.decoder_factory = partial(StreamDecoder, parse_line, parse_clash_proxy)
+        self.health_db = HealthDB()
+        self.scores = SourceScores()
+        self.dedup_index = DedupIndex()
+        self.dns = DNSCache()
+        self.prober = TCPProber(concurrency=probe_workers, timeout=probe_timeout)
+
+        self.sub_due = {}       # 订阅URL -> 下次刷新时间
+        self.sub_listed = {}    # 订阅URL -> 最近一次被频道列出的时间
+        self.queued = set()     # 已在探测队列中的端点
+        self.alive = {}         # 端点 -> 最近一次探测的延迟(毫秒)
+        self.checked = {}       # 端点 -> 最近一次验证通过的时间
+        self.new_endpoints = []  # 等待批量写入健康数据库的新端点
+        self.channel_budget = None  # 每轮最多抓取的频道数，None 表示不限
+        self.crawled = {}       # 上次更新评分以来抓取过的频道/订阅 -> 来源类型
+        self.channel_links = {}  # 频道URL -> 最近一次抓取时列出的订阅URL，频道的产出包含这些订阅的产出
+        self.unseen = set()     # 上次更新评分以来首次出现（健康数据库中没有记录）的端点
+        self.geo = {}           # 端点 -> 最近一次解析到的IP在IP库中的信息
+        self.pending_results = []
+        self.dirty = False
+
+    @classmethod
+    def from_settings(cls, settings, extract_links):
+        """按配置（settings.Settings）创建常驻服务，配置重新加载时自动调整运行参数"""
+        config = settings.config
+        fetch, output = config['fetch'], config['output']
+        service = cls(channel_urls(config['tgchannel']), output['file'], extract_links,
+                      queue_size=config['daemon']['queue_size'], export_formats=output['formats'],
+                      delta_dir=output['delta_dir'] or None, api_port=output['api_port'],
+                      fetch_options={key: fetch[key] for key in ('max_in_flight', 'per_host', 'timeout', 'attempts')},
+                      geoip=load_geoip(config['geo']['database']))
+        service.settings = settings
+        service.configure(config)
+        settings.on_change(service.configure)
+        return service
+
+    def configure(self, config, changed=None):
+        """应用配置中可以在运行中调整的部分：频道列表、各阶段节奏、worker数、超时、DNS缓存、复测间隔与地区筛选"""
+        daemon, probe, dns, health, geo = config['daemon'], config['probe'], config['dns'], config['health'], config['geo']
+        self.channels = channel_urls(config['tgchannel'])
+        self.channel_interval = daemon['channel_interval']
+        self.channel_budget = config['fetch']['channel_budget']
+        self.sub_interval = daemon['sub_interval']
+        self.probe_interval = daemon['probe_interval']
+        self.publish_interval = daemon['publish_interval']
+        self.sub_workers = daemon['sub_workers']
+        self.probe_workers = daemon['probe_workers']
+        self.target_count = probe['target_count']
+        self.export_formats = config['output']['formats']
+        self.export_dir = config['output']['export_dir']
+        self.prober.timeout = probe['timeout']
+        self.dns.ttl, self.dns.negative_ttl, self.dns.timeout = dns['ttl'], dns['negative_ttl'], dns['timeout']
+        self.health_db.good_interval = health['good_interval']
+        self.health_db.base_backoff = health['base_backoff']
+        self.health_db.max_backoff = health['max_backoff']
+        self.health_max_age = health['max_age']
+        self.cache_max_age = config['fetch']['cache_max_age']
+        self.stale_after = daemon['stale_after']
+        self.allowed = region_filter(geo['countries'], geo['exclude_countries'], geo['exclude_hosting'])
+        self.max_per_asn = geo['max_per_asn']
+        fetch = config['fetch']
+        self.fetch_options.update(timeout=fetch['timeout'], attempts=fetch['attempts'])
+        if self.fetcher:
+            self.fetcher.timeout, self.fetcher.attempts = fetch['timeout'], fetch['attempts']
+            self.scale_workers()
+        self.dirty = True  # 目标数量或导出格式可能变化，下一轮重新发布
+
+    def scale_workers(self):
+        """按 sub_workers/probe_workers 增减worker：缺少的立即启动，多出的处理完手头的任务后退出"""
+        raise_nofile_limit(self.probe_workers + 256)
+        for kind, count, worker in (('sub', self.sub_workers, self.sub_worker),
+                                    ('probe', self.probe_workers, self.probe_worker)):
+            tasks = self.workers[kind]
+            for number in [number for number, task in tasks.items() if task.done()]:
+                task = tasks.pop(number)
+                if not task.cancelled() and task.exception():
+                    logger.opt(exception=task.exception()).error(f'{kind} worker #{number} 异常退出')
+            for number in range(count):
+                if number not in tasks:
+                    tasks[number] = asyncio.ensure_future(worker(number))
+
+    async def channel_loop(self, fetcher):
+        """按 channel_interval 抓取按评分选出的频道，新出现的订阅链接立即进入刷新计划，消息里直接贴出的节点直接进入去重"""
+        while True:
+            with STAGE_SECONDS.time(stage='channels'):
+                # 抓取期间配置可能被重新加载
+                channels = self.scores.plan(self.channels, budget=self.channel_budget)
+                pages = await fetcher.fetch_all(channels, self.extract_links, method='POST')
+            new_urls = 0
+            now = time.time()
+            for channel_url, links in zip(channels, pages):
+                self.crawled[channel_url] = 'channel'  # 抓取失败的频道按没有产出计分
+                if not isinstance(links, dict):
+                    continue
+                self.channel_links[channel_url] = links['urls']
+                for proxy in links['nodes']:
+                    await self.record_queue.put((proxy, channel_url))
+                for url in links['urls']:
+                    self.sub_listed[url] = now
+                    if url not in self.sub_due:
+                        self.sub_due[url] = 0
+                        new_urls += 1
+            logger.info(f'频道抓取完成（{len(channels)}/{len(self.channels)} 个），'
+                        f'新增订阅链接 {new_urls} 个，共 {len(self.sub_due)} 个')
+            await asyncio.sleep(self.channel_interval)
+
+    async def sub_scheduler(self):
+        """把到期的订阅放入下载队列，每个订阅按 sub_interval 和来源评分决定的间隔刷新
+
+        间隔不超过 stale_after 的一半，产出再低的订阅也会在其节点被清理之前再刷新一次。
+        """
+        while True:
+            now = time.time()
+            for url, due in list(self.sub_due.items()):
+                if due <= now:
+                    self.sub_due[url] = now + self.scores.crawl_interval(url, self.sub_interval, self.stale_after / 2, now)
+                    await self.sub_queue.put(url)
+            await asyncio.sleep(1)
+
+    async def sub_worker(self, number):
+        while number < self.sub_workers:
+            url = await self.sub_queue.get()
+            await self.fetcher.stream(url, self.decoder_factory, lambda proxy: self.record_queue.put((proxy, url)))
+            self.crawled[url] = 'subscription'
+
+    async def dedup_loop(self):
+        """解析结果去重，新出现的端点立即进入探测队列"""
+        while True:
+            proxy, url = await self.record_queue.get()
+            if not self.dedup_index.add(proxy, url) or proxy.transport != 'tcp':
+                continue  # UDP（QUIC）节点无法用TCP探测，不参与探测和发布
+            if self.dedup_index.representative(proxy.endpoint) is proxy:
+                # 健康数据库的写入攒到发布阶段批量提交，不在事件循环里逐条提交
+                self.new_endpoints.append(proxy)
+                await self.enqueue_probe(proxy)
+            elif proxy.endpoint in self.alive:
+                self.index.update(proxy, self.alive[proxy.endpoint], self.checked.get(proxy.endpoint))
+
+    async def enqueue_probe(self, proxy):
+        if proxy.endpoint not in self.queued:
+            self.queued.add(proxy.endpoint)
+            await self.probe_queue.put(proxy)
+
+    async def reprobe_loop(self):
+        """按健康数据库的计划定期复测已知端点"""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            representatives = self.dedup_index.representatives()
+            self.health_db.touch(representatives)
+            due, cached = self.health_db.schedule(representatives,
+                                                  priority=self.scores.endpoint_priority(self.dedup_index))
+            cached = [proxy for proxy in cached if proxy.endpoint not in self.alive]
+            checked = self.health_db.checked_at(cached) if cached else {}
+            for proxy in cached:
+                if proxy.endpoint not in self.alive:
+                    if self.geoip and proxy.endpoint not in self.geo:
+                        await self.locate(proxy)
+                    # 沿用历史结果的端点，验证时间是上一次实际探测的时间
+                    self.checked[proxy.endpoint] = checked.get(proxy.endpoint) or time.time()
+                    self.alive[proxy.endpoint] = proxy.rtt
+                    self.index_endpoint(proxy.endpoint, proxy.rtt)
+                    self.dirty = True
+            for proxy in due:
+                await self.enqueue_probe(proxy)
+
+    async def probe_worker(self, number):
+        while number < self.probe_workers:
+            proxy = await self.probe_queue.get()
+            self.queued.discard(proxy.endpoint)
+            if proxy.endpoint not in self.dedup_index.endpoints:
+                continue  # 排队期间已被清理
+            ip = await self.dns.resolve(proxy.host)
+            if ip and self.geoip:
+                await self.locate(proxy, ip)
+                if self.allowed and not self.allowed(self.geo[proxy.endpoint]):
+                    # 地区不符合筛选条件的端点不探测，也不留在可用节点池中
+                    if self.alive.pop(proxy.endpoint, None) is not None:
+                        self.index_endpoint(proxy.endpoint, None)
+                        self.dirty = True
+                    continue
+            rtt = await self.prober.probe(ip, proxy.port) if ip else None
+            self.pending_results.append((proxy, rtt))
+            record_probe(rtt)
+            if rtt is not None:
+                self.checked[proxy.endpoint] = time.time()
+                self.alive[proxy.endpoint] = round(rtt, 1)
+                self.index_endpoint(proxy.endpoint, round(rtt, 1))
+                self.dirty = True
+            elif self.alive.pop(proxy.endpoint, None) is not None:
+                self.index_endpoint(proxy.endpoint, None)
+                self.dirty = True
+
+    async def locate(self, proxy, ip=None):
+        """查询端点当前IP的地区/ASN信息（未传入IP时先解析）"""
+        ip = ip or await self.dns.resolve(proxy.host)
+        self.geo[proxy.endpoint] = self.geoip.lookup(ip) if ip else None
+
+    def index_endpoint(self, endpoint, rtt):
+        """把端点的探测结果同步到查询索引：可用时更新该端点下的所有节点（附带地区信息），不可用时移除"""
+        for digest in self.dedup_index.endpoints.get(endpoint, ()):
+            proxy = self.dedup_index.nodes[digest]
+            if proxy.transport != 'tcp':
+                continue
+            if rtt is None:
+                self.index.remove(proxy)
+            else:
+                proxy.geo = self.geo.get(endpoint)
+                self.index.update(proxy, rtt, self.checked.get(endpoint))
+
+    async def publish_loop(self):
+        """批量写入探测结果，可用节点池有变化时原子地发布结果文件"""
+        while True:
+            await asyncio.sleep(self.publish_interval)
+            self.scale_workers()
+            QUEUE_DEPTH.set(self.sub_queue.qsize(), queue='subscription')
+            QUEUE_DEPTH.set(self.record_queue.qsize(), queue='record')
+            QUEUE_DEPTH.set(self.probe_queue.qsize(), queue='probe')
+            ALIVE.set(len(self.alive))
+            if self.new_endpoints:
+                new_endpoints, self.new_endpoints = self.new_endpoints, []
+                known = self.health_db.checked_at(new_endpoints)
+                self.unseen.update(proxy.endpoint for proxy in new_endpoints if proxy.endpoint not in known)
+                self.health_db.touch(new_endpoints)
+            if self.pending_results:
+                results, self.pending_results = self.pending_results, []
+                self.health_db.record(results)
+            if not self.dirty:
+                continue
+            self.dirty = False
+            with STAGE_SECONDS.time(stage='publish'):
+                alive = self.alive.items()
+                if self.allowed:
+                    # 筛选条件可能刚被修改，已在池中的端点也按当前条件过滤
+                    alive = [(endpoint, rtt) for endpoint, rtt in alive if self.allowed(self.geo.get(endpoint))]
+                top = heapq.nsmallest(self.target_count, alive, key=lambda item: item[1])
+                working = sorted(self.dedup_index.expand(dict(top)), key=lambda proxy: proxy.rtt)
+                working = cap_per_asn(working, self.max_per_asn)
+                save_proxies(self.output_file, working)
+                if self.export_formats:
+                    export_all(working, self.export_dir, self.export_formats)
+                if self.deltas:
+                    self.deltas.publish(working)
+                record_source_yields(self.dedup_index, self.alive)
+            logger.info(f'已发布 {len(working)} 个可用代理（存活端点 {len(self.alive)} 个，'
+                        f'队列 订阅{self.sub_queue.qsize()}/解析{self.record_queue.qsize()}/探测{self.probe_queue.qsize()}）')
+
+    def prune(self, now=None):
+        """更新来源评分；移除长时间没有再被频道列出的订阅和没有再出现在任何订阅中的节点，并清理过期的健康记录与抓取缓存"""
+        now = now or time.time()
+        if self.crawled:
+            crawled, self.crawled = self.crawled, {}
+            unseen, self.unseen = self.unseen, set()
+            self.scores.update(crawled, source_yields(self.dedup_index, unseen, set(self.alive), self.channel_links), now)
+        self.scores.prune(now=now)
+        for channel in [channel for channel in self.channel_links if channel not in self.channels]:
+            del self.channel_links[channel]  # 已从配置中移除的频道
+        cutoff = now - self.stale_after
+        stale_urls = [url for url, listed in self.sub_listed.items() if listed < cutoff]
+        for url in stale_urls:
+            del self.sub_listed[url]
+            self.sub_due.pop(url, None)
+        removed = self.dedup_index.evict(cutoff)
+        gone = set()
+        for proxy in removed:
+            self.index.remove(proxy)
+            if proxy.endpoint not in self.dedup_index.endpoints:
+                gone.add(proxy.endpoint)
+        for endpoint in gone:
+            self.geo.pop(endpoint, None)
+            self.checked.pop(endpoint, None)
+            if self.alive.pop(endpoint, None) is not None:
+                self.dirty = True
+        self.health_db.prune(self.health_max_age, now)
+        self.cache.prune(self.cache_max_age)
+        if stale_urls or removed:
+            logger.info(f'已移除不再出现的订阅 {len(stale_urls)} 个、节点 {len(removed)} 个（端点 {len(gone)} 个）')
+
+    async def prune_loop(self):
+        while True:
+            await asyncio.sleep(PRUNE_INTERVAL)
+            self.prune()
+
+    async def run(self):
+        api = None
+        try:
+            async with AsyncFetcher(**self.fetch_options, cache=self.cache, pool=self.pool) as fetcher:
+                self.fetcher = fetcher
+                if self.api_port:
+                    api = QueryAPI(self.index)
+                    await api.start(self.api_port)
+                self.scale_workers()
+                await asyncio.gather(
+                    self.channel_loop(fetcher),
+                    self.sub_scheduler(),
+                    self.dedup_loop(),
+                    self.reprobe_loop(),
+                    self.publish_loop(),
+                    self.prune_loop(),
+                    *([self.settings.watch()] if self.settings else []),
+                )
+        finally:
+            if api:
+                await api.close()
+            if self.pool:
+                self.pool.close()
+            if self.geoip:
+                self.geoip.close()
+            self.health_db.close()
+            self.scores.close()
+            self.cache.close()
@@ -0,0 +1,111 @@
+import hashlib
+import ipaddress
+import time
+
+# 身份中大小写不敏感的字段（UUID）
+CASE_INSENSITIVE = ('id',)
+
+
+def normalize_host(host):
+    """规范化主机名：小写、去掉IPv6方括号和结尾的点，IP字面量转为标准写法"""
+    host = host.strip().strip('[]').rstrip('.').lower()
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        try:
+            return host.encode('idna').decode('ascii')
+        except UnicodeError:
+            return host
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return str(ip)
+
+
+def identity_digest(proxy):
+    """把节点身份哈希为8字节摘要，作为去重集合的紧凑键"""
+    return hashlib.blake2b(repr(proxy.identity).encode('utf-8'), digest_size=8).digest()
+
+
+class DedupIndex:
+    """按节点完整身份去重（协议、规范化地址、端口及 uuid/密码/传输/路径/sni 等）
+
+    同一中继端口后的不同节点都会保留；同时记录每个节点来自哪些订阅、最近一次出现的时间，
+    并按 host:port 分组，测试阶段每个端点只需探测一次。常驻运行时用 evict 清理不再出现的节点。
+    TCP探测只代表TCP节点：基于UDP（QUIC）的节点不参与探测，也不会得到同一端点的TCP探测结果。
+    """
+
+    def __init__(self):
+        self.nodes = {}       # 摘要 -> 节点
+        self.sources = {}     # 摘要 -> 来源编号集合
+        self.seen = {}        # 摘要 -> 最近一次出现的时间
+        self.endpoints = {}   # host:port -> [摘要]
+        self.source_ids = {}  # 来源URL -> 编号
+        self.source_urls = []
+
+    def add(self, proxy, source=None):
+        """加入一个节点，返回它是否是新节点"""
+        proxy.host = normalize_host(proxy.host)
+        for field in CASE_INSENSITIVE:
+            if hasattr(proxy, field):
+                setattr(proxy, field, getattr(proxy, field).lower())
+        proxy.reset_identity()  # 规范化之前可能已经按原始字段缓存过身份
+        digest = identity_digest(proxy)
+        self.seen[digest] = time.time()
+        is_new = digest not in self.nodes
+        if is_new:
+            self.nodes[digest] = proxy
+            self.sources[digest] = set()
+            self.endpoints.setdefault(proxy.endpoint, []).append(digest)
+        if source is not None:
+            source_id = self.source_ids.get(source)
+            if source_id is None:
+                source_id = self.source_ids[source] = len(self.source_urls)
+                self.source_urls.append(source)
+            self.sources[digest].add(source_id)
+        return is_new
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def evict(self, before):
+        """删除 before 之后再没有出现过的节点，返回被删除的节点"""
+        removed = []
+        for digest in [digest for digest, seen in self.seen.items() if seen < before]:
+            proxy = self.nodes.pop(digest)
+            del self.seen[digest], self.sources[digest]
+            digests = self.endpoints[proxy.endpoint]
+            digests.remove(digest)
+            if not digests:
+                del self.endpoints[proxy.endpoint]
+            removed.append(proxy)
+        return removed
+
+    def sources_of(self, proxy):
+        """返回包含该节点的订阅URL列表"""
+        ids = self.sources.get(identity_digest(proxy), ())
+        return [self.source_urls[i] for i in sorted(ids)]
+
+    def representative(self, endpoint):
+        """端点下第一个基于TCP的节点，用于连通性探测；只有UDP节点时返回 None"""
+        for digest in self.endpoints.get(endpoint, ()):
+            proxy = self.nodes[digest]
+            if proxy.transport == 'tcp':
+                return proxy
+        return None
+
+    def representatives(self):
+        """每个 host:port 端点取一个基于TCP的节点，用于连通性探测"""
+        proxies = (self.representative(endpoint) for endpoint in self.endpoints)
+        return [proxy for proxy in proxies if proxy is not None]
+
+    def expand(self, endpoint_rtts):
+        """把端点的探测结果 {host:port: rtt} 展开到该端点下的所有TCP节点"""
+        proxies = []
+        for endpoint, rtt in endpoint_rtts.items():
+            for digest in self.endpoints.get(endpoint, ()):
+                proxy = self.nodes[digest]
+                if proxy.transport != 'tcp':
+                    continue
+                proxy.rtt = rtt
+                proxies.append(proxy)
+        return proxies
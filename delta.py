@@ -0,0 +1,204 @@
+import json
+import os
+import time
+
+import requests
+from loguru import logger
+
+from dedup import identity_digest
+from models import from_dict
+from output import atomic_write
+
+# 增量输出目录：index.json + snapshot-<序号>.json + delta-<序号>.json
+DELTA_DIR = 'deltas'
+INDEX_FILE = 'index.json'
+
+
+def snapshot_name(seq):
+    return f'snapshot-{seq:08d}.json'
+
+
+def delta_name(seq):
+    return f'delta-{seq:08d}.json'
+
+
+def node_key(proxy):
+    """节点在增量中的稳定键：身份摘要的十六进制形式，与名称、延迟无关"""
+    return identity_digest(proxy).hex()
+
+
+def apply_delta(nodes, delta):
+    """把一个增量应用到 {键: 节点字典} 上（原地修改）"""
+    for key in delta['removed']:
+        nodes.pop(key, None)
+    for key, node in delta['added'].items():
+        nodes[key] = node
+    for key, rtt in delta['changed'].items():
+        if key in nodes:
+            nodes[key]['rtt'] = rtt
+    for key, node in delta.get('updated', {}).items():  # 旧版增量没有 updated
+        if key in nodes:
+            nodes[key] = node
+    return nodes
+
+
+def without_rtt(node):
+    return {field: value for field, value in node.items() if field != 'rtt'}
+
+
+class DeltaWriter:
+    """把每次发布的可用节点池写成带序号的增量，并定期写出完整快照
+
+    每次发布与上一次相比，只记录新增、移除、延迟变化超过 rtt_tolerance 毫秒（changed，只含延迟）
+    和名称、地区等其他字段有变化（updated，完整的节点字典）的节点，
+    序号单调递增（跨运行保持，从 index.json 续上）；每 snapshot_every 个序号写一次完整快照，
+    只保留最近 keep_snapshots 个快照及其之后的增量。index.json 最后原子写入，
+    读取方看到某个序号时，它依赖的快照和增量文件一定已经存在。
+    """
+
+    def __init__(self, directory=DELTA_DIR, snapshot_every=50, keep_snapshots=2, rtt_tolerance=20):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.keep_snapshots = keep_snapshots
+        self.rtt_tolerance = rtt_tolerance
+        os.makedirs(directory, exist_ok=True)
+        # 从已有的快照和增量还原上一次发布的节点池，保证增量能接续
+        reader = DeltaReader(directory)
+        self.index = reader.load_index()
+        self.nodes = reader.sync()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, data):
+        atomic_write(self.path(name), json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+
+    def diff(self, nodes):
+        added = {key: node for key, node in nodes.items() if key not in self.nodes}
+        removed = [key for key in self.nodes if key not in nodes]
+        changed, updated = {}, {}
+        for key, node in nodes.items():
+            old = self.nodes.get(key)
+            if old is None:
+                continue
+            if without_rtt(node) != without_rtt(old):
+                updated[key] = node
+                continue
+            rtt, old_rtt = node.get('rtt'), old.get('rtt')
+            if rtt != old_rtt and (rtt is None or old_rtt is None or abs(rtt - old_rtt) >= self.rtt_tolerance):
+                changed[key] = rtt
+        return added, removed, changed, updated
+
+    def publish(self, proxies):
+        """记录一次发布，返回新的序号；与上一次相比没有变化时不写文件，返回 None"""
+        nodes = {node_key(proxy): proxy.to_dict() for proxy in proxies}
+        added, removed, changed, updated = self.diff(nodes)
+        seq = self.index['seq']
+        if seq and not (added or removed or changed or updated):
+            return None
+        seq += 1
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.write(delta_name(seq), {'seq': seq, 'base': seq - 1, 'time': now, 'added': added,
+                                     'removed': removed, 'changed': changed, 'updated': updated})
+        # 延迟的小幅变化不进入增量，本地副本保留旧值，与读取方看到的内容一致
+        for key, node in nodes.items():
+            if key not in added and key not in changed and key not in updated:
+                node.pop('rtt', None)
+                if self.nodes[key].get('rtt') is not None:
+                    node['rtt'] = self.nodes[key]['rtt']
+        self.nodes = nodes
+
+        snapshots = self.index['snapshots']
+        if not snapshots or seq - snapshots[-1] >= self.snapshot_every:
+            self.write(snapshot_name(seq), {'seq': seq, 'time': now, 'nodes': nodes})
+            snapshots = snapshots + [seq]
+        snapshots = snapshots[-self.keep_snapshots:]
+        self.index = {'seq': seq, 'time': now, 'count': len(nodes), 'snapshots': snapshots,
+                      'deltas': [s for s in self.index['deltas'] if s >= snapshots[0]] + [seq]}
+        self.write(INDEX_FILE, self.index)
+        self.prune()
+        logger.info(f'增量 #{seq}: 新增 {len(added)}，移除 {len(removed)}，延迟变化 {len(changed)}，'
+                    f'信息变化 {len(updated)}，当前 {len(nodes)} 个节点')
+        return seq
+
+    def prune(self):
+        """删除序号早于最旧的保留快照的快照和增量，index.json 已不再引用它们"""
+        first = self.index['snapshots'][0]
+        for name in os.listdir(self.directory):
+            prefix, _, rest = name.partition('-')
+            number = rest[:-len('.json')]
+            if prefix in ('snapshot', 'delta') and rest.endswith('.json') and number.isdigit():
+                if int(number) < first:
+                    os.remove(self.path(name))
+
+
+class DeltaReader:
+    """增量的读取方：把本地副本从已知序号同步到最新
+
+    source 为本地目录，或托管了发布方 deltas 目录的 HTTP(S) 地址（该目录不在仓库中，需要自行托管）；
+    本地副本落后太多、所需增量已被清理时，自动改为从最近的快照重建。
+    传入 state_file 时同步结果（序号与节点）持久化到该文件，下次从上次的序号继续。
+    """
+
+    def __init__(self, source=DELTA_DIR, state_file=None, timeout=30):
+        self.source = source
+        self.state_file = state_file
+        self.timeout = timeout
+        self.seq = 0
+        self.nodes = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            self.seq, self.nodes = state['seq'], state['nodes']
+
+    def load(self, name):
+        if self.source.startswith(('http://', 'https://')):
+            response = requests.get(f'{self.source.rstrip("/")}/{name}', timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        with open(os.path.join(self.source, name), encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_index(self):
+        """读取 index.json
+
+        找不到 index.json 时，已有本地副本则保留副本不变；没有副本时，本地目录视为还没有发布过（空），
+        远程地址则抛出异常：多半是地址配置错误，不能当作空的节点池。
+        """
+        try:
+            return self.load(INDEX_FILE)
+        except FileNotFoundError:
+            remote = False
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            remote = True
+        if self.seq:
+            logger.warning(f'{self.source} 中没有 {INDEX_FILE}，保留本地副本（序号 {self.seq}）')
+            return {'seq': self.seq, 'snapshots': [], 'deltas': []}
+        if remote:
+            raise FileNotFoundError(f'{self.source} 中没有 {INDEX_FILE}，请检查增量地址')
+        return {'seq': 0, 'snapshots': [], 'deltas': []}
+
+    def sync(self):
+        """同步到最新序号，返回 {键: 节点字典}"""
+        index = self.load_index()
+        if index['seq'] == self.seq:
+            return self.nodes
+        if self.seq > index['seq'] or self.seq + 1 not in index['deltas']:
+            # 本地副本比发布方还新（发布方被重置）或缺少接续的增量：从最近的快照重建
+            base = index['snapshots'][-1]
+            snapshot = self.load(snapshot_name(base))
+            self.seq, self.nodes = snapshot['seq'], snapshot['nodes']
+        for seq in range(self.seq + 1, index['seq'] + 1):
+            delta = self.load(delta_name(seq))
+            apply_delta(self.nodes, delta)
+            self.seq = seq
+        if self.state_file:
+            atomic_write(self.state_file, json.dumps({'seq': self.seq, 'nodes': self.nodes}, ensure_ascii=False))
+        return self.nodes
+
+    def proxies(self):
+        """当前副本中的节点，按延迟排序后还原为记录"""
+        nodes = sorted(self.nodes.values(), key=lambda node: node.get('rtt') or float('inf'))
+        return [proxy for proxy in map(from_dict, nodes) if proxy]
@@ -0,0 +1,350 @@
+import base64
+import json
+import os
+from urllib.parse import quote, urlencode
+
+import yaml
+from loguru import logger
+
+from output import atomic_write
+
+# 端到端测试地址，返回204且内容极小；也用作各客户端自动选择分组的测速地址
+TEST_URL = 'http://www.gstatic.com/generate_204'
+
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Clash 配置中的分组名称（与仓库中原有 clash_config.yaml 保持一致）
+SELECT_GROUP = '🚀 节点选择'
+AUTO_GROUP = '♻️ 自动选择'
+DIRECT_GROUP = '🎯 全球直连'
+
+
+def unique_names(proxies):
+    """为每个节点生成唯一的显示名称：空名称用 协议-地址:端口 代替，重名的依次加序号"""
+    seen = {}
+    names = []
+    for proxy in proxies:
+        name = (proxy.name or '').strip() or f'{proxy.type}-{proxy.endpoint}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name} {seen[name]}'
+            while name in seen:
+                name += '_'
+        seen[name] = 1
+        names.append(name)
+    return names
+
+
+def url_host(host):
+    return f'[{host}]' if ':' in host else host
+
+
+def b64encode_text(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def share_query(**params):
+    return urlencode({key: value for key, value in params.items() if value}, quote_via=quote)
+
+
+def share_link(proxy, name):
+    """生成节点的分享链接（parsers 中各 scheme 解析器的逆过程），不支持的协议返回 None"""
+    address = f'{url_host(proxy.host)}:{proxy.port}'
+    fragment = quote(name, safe='')
+    if proxy.type == 'vmess':
+        config = {'v': '2', 'ps': name, 'add': proxy.host, 'port': str(proxy.port), 'id': proxy.id,
+                  'aid': str(proxy.aid), 'net': proxy.net, 'type': 'none', 'host': proxy.host_header,
+                  'path': proxy.path, 'tls': proxy.tls}
+        return 'vmess://' + base64.b64encode(json.dumps(config, ensure_ascii=False).encode('utf-8')).decode('ascii')
+    if proxy.type == 'ss':
+        return f'ss://{b64encode_text(f"{proxy.method}:{proxy.password}")}@{address}#{fragment}'
+    if proxy.type == 'ssr':
+        params = share_query(obfsparam=b64encode_text(proxy.obfs_param), protoparam=b64encode_text(proxy.protocol_param),
+                             remarks=b64encode_text(name))
+        body = f'{url_host(proxy.host)}:{proxy.port}:{proxy.protocol}:{proxy.method}:{proxy.obfs}:' \
+               f'{b64encode_text(proxy.password)}/?{params}'
+        return 'ssr://' + b64encode_text(body)
+    if proxy.type == 'trojan':
+        query = share_query(sni=proxy.sni, type=proxy.net if proxy.net != 'tcp' else '', path=proxy.path)
+        return f'trojan://{quote(proxy.password, safe="")}@{address}?{query}#{fragment}'
+    if proxy.type == 'vless':
+        query = share_query(type=proxy.net, security=proxy.tls, sni=proxy.sni, host=proxy.host_header,
+                            path=proxy.path, flow=proxy.flow)
+        return f'vless://{quote(proxy.id, safe="")}@{address}?{query}#{fragment}'
+    if proxy.type == 'hysteria2':
+        query = share_query(sni=proxy.sni, obfs=proxy.obfs, **{'obfs-password': proxy.obfs_password},
+                            insecure='1' if proxy.insecure else '')
+        return f'hysteria2://{quote(proxy.password, safe="")}@{address}?{query}#{fragment}'
+    if proxy.type == 'tuic':
+        query = share_query(sni=proxy.sni, congestion_control=proxy.congestion_control, alpn=proxy.alpn)
+        return f'tuic://{quote(proxy.id, safe="")}:{quote(proxy.password, safe="")}@{address}?{query}#{fragment}'
+    return None
+
+
+def clash_transport(proxy):
+    """Clash 的传输方式字段（network 与对应的 *-opts）"""
+    net = getattr(proxy, 'net', 'tcp') or 'tcp'
+    path = getattr(proxy, 'path', '')
+    host_header = getattr(proxy, 'host_header', '')
+    if net == 'ws':
+        return {'network': 'ws', 'ws-opts': {'path': path or '/', 'headers': {'Host': host_header} if host_header else {}}}
+    if net == 'grpc':
+        return {'network': 'grpc', 'grpc-opts': {'grpc-service-name': path}}
+    if net in ('h2', 'http'):
+        return {'network': 'h2', 'h2-opts': {'path': path or '/', 'host': [host_header] if host_header else []}}
+    return {}
+
+
+def clash_proxy(proxy, name):
+    """把节点转换为 Clash proxies 条目（parsers 中 clash_* 转换器的逆过程），不支持的协议返回 None"""
+    item = {'name': name, 'type': proxy.type, 'server': proxy.host, 'port': proxy.port}
+    if proxy.type == 'vmess':
+        item.update({'uuid': proxy.id, 'alterId': proxy.aid, 'cipher': 'auto', 'tls': bool(proxy.tls),
+                     'skip-cert-verify': True})
+        if proxy.tls and proxy.host_header:
+            item['servername'] = proxy.host_header
+        item.update(clash_transport(proxy))
+    elif proxy.type == 'vless':
+        if proxy.tls == 'reality':
+            return None  # 没有保存 reality 公钥，无法生成可用配置
+        item.update({'uuid': proxy.id, 'tls': bool(proxy.tls), 'skip-cert-verify': True})
+        if proxy.sni:
+            item['servername'] = proxy.sni
+        if proxy.flow:
+            item['flow'] = proxy.flow
+        item.update(clash_transport(proxy))
+    elif proxy.type == 'ss':
+        item.update({'cipher': proxy.method, 'password': proxy.password})
+    elif proxy.type == 'ssr':
+        item.update({'cipher': proxy.method, 'password': proxy.password, 'protocol': proxy.protocol,
+                     'protocol-param': proxy.protocol_param, 'obfs': proxy.obfs, 'obfs-param': proxy.obfs_param})
+    elif proxy.type == 'trojan':
+        item.update({'password': proxy.password, 'skip-cert-verify': True})
+        if proxy.sni:
+            item['sni'] = proxy.sni
+        item.update(clash_transport(proxy))
+    elif proxy.type == 'hysteria2':
+        item.update({'password': proxy.password, 'skip-cert-verify': proxy.insecure})
+        if proxy.sni:
+            item['sni'] = proxy.sni
+        if proxy.obfs:
+            item.update({'obfs': proxy.obfs, 'obfs-password': proxy.obfs_password})
+    elif proxy.type == 'tuic':
+        item.update({'uuid': proxy.id, 'password': proxy.password, 'skip-cert-verify': True})
+        if proxy.sni:
+            item['sni'] = proxy.sni
+        if proxy.congestion_control:
+            item['congestion-controller'] = proxy.congestion_control
+        if proxy.alpn:
+            item['alpn'] = proxy.alpn.split(',')
+    else:
+        return None
+    return item
+
+
+def singbox_tls(proxy, server_name=None, alpn=''):
+    tls = {'enabled': True, 'server_name': server_name or proxy.host, 'insecure': True}
+    if alpn:
+        tls['alpn'] = alpn.split(',')
+    return tls
+
+
+def singbox_transport(proxy):
+    net = getattr(proxy, 'net', 'tcp') or 'tcp'
+    path = getattr(proxy, 'path', '')
+    host_header = getattr(proxy, 'host_header', '')
+    if net == 'ws':
+        return {'type': 'ws', 'path': path or '/', 'headers': {'Host': host_header} if host_header else {}}
+    if net == 'grpc':
+        return {'type': 'grpc', 'service_name': path}
+    if net in ('h2', 'http'):
+        return {'type': 'http', 'path': path or '/', 'host': [host_header] if host_header else []}
+    return None
+
+
+def singbox_outbound(proxy, tag):
+    """把节点转换为 sing-box 的 outbound，sing-box 不支持的协议（ssr）返回 None"""
+    outbound = {'type': proxy.type, 'tag': tag, 'server': proxy.host, 'server_port': proxy.port}
+    if proxy.type == 'vmess':
+        outbound.update({'uuid': proxy.id, 'alter_id': proxy.aid, 'security': 'auto'})
+        if proxy.tls:
+            outbound['tls'] = singbox_tls(proxy, proxy.host_header)
+    elif proxy.type == 'vless':
+        if proxy.tls == 'reality':
+            return None
+        outbound['uuid'] = proxy.id
+        if proxy.flow:
+            outbound['flow'] = proxy.flow
+        if proxy.tls:
+            outbound['tls'] = singbox_tls(proxy, proxy.sni or proxy.host_header)
+    elif proxy.type == 'ss':
+        outbound.update({'type': 'shadowsocks', 'method': proxy.method, 'password': proxy.password})
+    elif proxy.type == 'trojan':
+        outbound.update({'password': proxy.password, 'tls': singbox_tls(proxy, proxy.sni)})
+    elif proxy.type == 'hysteria2':
+        outbound.update({'password': proxy.password, 'tls': singbox_tls(proxy, proxy.sni)})
+        if proxy.obfs:
+            outbound['obfs'] = {'type': proxy.obfs, 'password': proxy.obfs_password}
+    elif proxy.type == 'tuic':
+        outbound.update({'uuid': proxy.id, 'password': proxy.password,
+                         'tls': singbox_tls(proxy, proxy.sni, proxy.alpn)})
+        if proxy.congestion_control:
+            outbound['congestion_control'] = proxy.congestion_control
+    else:
+        return None
+    transport = singbox_transport(proxy) if proxy.type in ('vmess', 'vless', 'trojan') else None
+    if transport:
+        outbound['transport'] = transport
+    return outbound
+
+
+def stream_settings(proxy, tls=None):
+    """生成 xray 的 streamSettings（传输方式 + TLS）"""
+    net = getattr(proxy, 'net', 'tcp') or 'tcp'
+    path = getattr(proxy, 'path', '')
+    host_header = getattr(proxy, 'host_header', '')
+    tls = tls if tls is not None else getattr(proxy, 'tls', '')
+    settings = {'network': net, 'security': 'tls' if tls else 'none'}
+    if tls:
+        settings['tlsSettings'] = {'serverName': getattr(proxy, 'sni', '') or host_header or proxy.host,
+                                   'allowInsecure': True}
+    if net == 'ws':
+        settings['wsSettings'] = {'path': path or '/', 'headers': {'Host': host_header} if host_header else {}}
+    elif net == 'grpc':
+        settings['grpcSettings'] = {'serviceName': path}
+    elif net in ('h2', 'http'):
+        settings['network'] = 'http'
+        settings['httpSettings'] = {'path': path or '/', 'host': [host_header] if host_header else []}
+    return settings
+
+
+def v2ray_outbound(proxy, tag):
+    """把节点转换为 xray/v2ray 的 outbound，核心不支持的协议返回 None"""
+    if proxy.type == 'vmess':
+        return {'tag': tag, 'protocol': 'vmess',
+                'settings': {'vnext': [{'address': proxy.host, 'port': proxy.port,
+                                        'users': [{'id': proxy.id, 'alterId': proxy.aid, 'security': 'auto'}]}]},
+                'streamSettings': stream_settings(proxy)}
+    if proxy.type == 'vless':
+        if proxy.tls == 'reality':
+            return None
+        return {'tag': tag, 'protocol': 'vless',
+                'settings': {'vnext': [{'address': proxy.host, 'port': proxy.port,
+                                        'users': [{'id': proxy.id, 'encryption': 'none', 'flow': proxy.flow}]}]},
+                'streamSettings': stream_settings(proxy)}
+    if proxy.type == 'ss':
+        return {'tag': tag, 'protocol': 'shadowsocks',
+                'settings': {'servers': [{'address': proxy.host, 'port': proxy.port,
+                                          'method': proxy.method, 'password': proxy.password}]}}
+    if proxy.type == 'trojan':
+        return {'tag': tag, 'protocol': 'trojan',
+                'settings': {'servers': [{'address': proxy.host, 'port': proxy.port, 'password': proxy.password}]},
+                'streamSettings': stream_settings(proxy, tls='tls')}
+    return None
+
+
+def render_clash(items):
+    names = [item['name'] for item in items]
+    config = {
+        'port': 7890,
+        'socks-port': 7891,
+        'allow-lan': True,
+        'mode': 'rule',
+        'log-level': 'info',
+        'external-controller': '127.0.0.1:9090',
+        'proxies': items,
+        'proxy-groups': [
+            {'name': SELECT_GROUP, 'type': 'select', 'proxies': [AUTO_GROUP, DIRECT_GROUP] + names},
+            {'name': AUTO_GROUP, 'type': 'url-test', 'url': TEST_URL, 'interval': 300,
+             'proxies': names or ['DIRECT']},
+            {'name': DIRECT_GROUP, 'type': 'select', 'proxies': ['DIRECT']},
+        ],
+        'rules': [
+            'DOMAIN-SUFFIX,local,DIRECT',
+            'IP-CIDR,127.0.0.0/8,DIRECT',
+            'IP-CIDR,172.16.0.0/12,DIRECT',
+            'IP-CIDR,192.168.0.0/16,DIRECT',
+            'IP-CIDR,10.0.0.0/8,DIRECT',
+            f'GEOIP,CN,{DIRECT_GROUP}',
+            f'MATCH,{SELECT_GROUP}',
+        ],
+    }
+    return yaml.dump(config, Dumper=YAML_DUMPER, allow_unicode=True, sort_keys=False)
+
+
+def render_singbox(outbounds):
+    tags = [outbound['tag'] for outbound in outbounds]
+    config = {
+        'log': {'level': 'warn'},
+        'inbounds': [{'type': 'mixed', 'tag': 'mixed-in', 'listen': '127.0.0.1', 'listen_port': 7890}],
+        'outbounds': [
+            {'type': 'selector', 'tag': 'proxy', 'outbounds': ['auto'] + tags + ['direct'], 'default': 'auto'},
+            {'type': 'urltest', 'tag': 'auto', 'outbounds': tags or ['direct'], 'url': TEST_URL, 'interval': '5m'},
+            *outbounds,
+            {'type': 'direct', 'tag': 'direct'},
+        ],
+        'route': {'rules': [{'ip_is_private': True, 'outbound': 'direct'}], 'final': 'proxy'},
+    }
+    return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+def render_v2ray(outbounds):
+    """多出站配置：所有节点挂在同一个负载均衡器下，由 observatory 测速后选择延迟最低的节点"""
+    config = {
+        'log': {'loglevel': 'warning'},
+        'inbounds': [
+            {'tag': 'socks', 'port': 1080, 'protocol': 'socks', 'settings': {'auth': 'noauth', 'udp': True}},
+            {'tag': 'http', 'port': 8080, 'protocol': 'http'},
+        ],
+        'outbounds': outbounds + [{'tag': 'direct', 'protocol': 'freedom'}],
+        'observatory': {'subjectSelector': ['proxy-'], 'probeURL': TEST_URL, 'probeInterval': '5m'},
+        'routing': {
+            'balancers': [{'tag': 'balancer', 'selector': ['proxy-'], 'strategy': {'type': 'leastPing'}}],
+            'rules': [
+                {'type': 'field', 'ip': ['geoip:private'], 'outboundTag': 'direct'},
+                {'type': 'field', 'network': 'tcp,udp', 'balancerTag': 'balancer'},
+            ],
+        },
+    }
+    return json.dumps(config, ensure_ascii=False, indent=2)
+
+
+def render_base64(links):
+    return base64.b64encode('\n'.join(links).encode('utf-8')).decode('ascii')
+
+
+# 默认导出目录：不放在仓库根目录，避免覆盖仓库里的示例配置
+EXPORT_DIR = 'exports'
+
+# 导出格式：格式名 -> (默认文件名, 单个节点的转换函数, 整份文件的渲染函数)
+EXPORTERS = {
+    'clash': ('clash_config.yaml', clash_proxy, render_clash),
+    'singbox': ('singbox_config.json', singbox_outbound, render_singbox),
+    'v2ray': ('v2ray_config.json', lambda proxy, name: v2ray_outbound(proxy, 'proxy-' + name), render_v2ray),
+    'base64': ('subscription.txt', share_link, render_base64),
+}
+
+
+def export_all(proxies, directory=EXPORT_DIR, formats=None):
+    """把可用节点一次性导出为多种客户端格式，返回 {格式名: 文件路径}
+
+    只遍历一遍内存中的节点记录，同时生成每种格式的条目，再分别渲染并原子写入，
+    读取方不会读到写了一半的文件，也不需要重新加载解析 collected_proxies.json。
+    """
+    formats = list(formats or EXPORTERS)
+    os.makedirs(directory, exist_ok=True)
+    converters = [(fmt, EXPORTERS[fmt][1]) for fmt in formats]
+    entries = {fmt: [] for fmt in formats}
+    for proxy, name in zip(proxies, unique_names(proxies)):
+        for fmt, convert in converters:
+            entry = convert(proxy, name)
+            if entry is not None:
+                entries[fmt].append(entry)
+    written = {}
+    for fmt in formats:
+        filename, _, render = EXPORTERS[fmt]
+        path = os.path.join(directory, filename)
+        atomic_write(path, render(entries[fmt]))
+        written[fmt] = path
+    logger.info('已导出 ' + '，'.join(f'{written[fmt]}({len(entries[fmt])})' for fmt in formats))
+    return written
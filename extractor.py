@@ -0,0 +1,102 @@
+import html
+import re
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from parsers import PARSERS, parse_line
+from metrics import EXTRACTED_LINKS
+
+# 一次扫描同时找出 http(s) 链接和直接贴在消息里的节点链接；前面不能紧跟字母数字，避免把 xss:// 之类截成 ss://
+# 链接只取可打印ASCII（不含引号、尖括号、反斜杠和反引号），紧跟在链接后的中文标点不会被带进来
+LINK_PATTERN = re.compile(
+    r'(?<![A-Za-z0-9])(?P<scheme>https?|' + '|'.join(sorted(map(re.escape, PARSERS), key=len, reverse=True)) +
+    r')://[\x21\x23-\x26\x28-\x3b\x3d\x3f-\x5b\x5d-\x5f\x61-\x7e]+', re.IGNORECASE)
+# 链接末尾常见的标点，来自正文而不是链接本身
+TRAILING = '.,;:!?)]}>\'"'
+
+# 不可能是订阅的站点：Telegram 自身及其CDN、常见的社交/视频/搜索站点
+DENY_HOSTS = (
+    't.me', 'telegram.me', 'telegram.org', 'telegram.dog', 'telesco.pe', 'telegra.ph', 'cdn-telegram.org',
+    'google.com', 'googleapis.com', 'gstatic.com', 'youtube.com', 'youtu.be', 'twitter.com', 'x.com',
+    'instagram.com', 'facebook.com', 'w3.org', 'apple.com', 'microsoft.com', 'wikipedia.org',
+)
+# 静态资源后缀
+ASSET_SUFFIXES = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.css', '.js', '.mp4', '.webm',
+                  '.woff', '.woff2', '.ttf', '.apk', '.exe', '.zip', '.rar', '.pdf')
+# 订阅链接的常见特征（路径或查询参数中）
+SUBSCRIPTION_HINTS = re.compile(r'sub|clash|token=|/link/|/api/v1/client|v2ray|proxies|node|\.ya?ml$|\.txt$|/raw/',
+                                re.IGNORECASE)
+
+
+def host_denied(host, deny_hosts):
+    return any(host == denied or host.endswith('.' + denied) for denied in deny_hosts)
+
+
+def classify(url, deny_hosts=DENY_HOSTS):
+    """把候选链接分为 'subscription'（有订阅特征）、'unknown'（无特征但可能是订阅）或拒绝原因"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+    except ValueError:
+        return 'invalid'
+    if not host or '.' not in host and host != 'localhost':
+        return 'invalid'
+    if host_denied(host, deny_hosts):
+        return 'denied'
+    path = parts.path.lower()
+    if path.endswith(ASSET_SUFFIXES):
+        return 'asset'
+    if SUBSCRIPTION_HINTS.search(path) or SUBSCRIPTION_HINTS.search(parts.query):
+        return 'subscription'
+    if path in ('', '/') and not parts.query:
+        return 'homepage'
+    return 'unknown'
+
+
+class LinkExtractor:
+    """频道页链接提取：预编译的单次扫描，筛掉不可能是订阅的链接，并收集消息里直接贴出的节点
+
+    每个频道记录提取统计（候选订阅数、节点数、各拒绝原因的数量），用于判断哪些频道有产出。
+    """
+
+    KEEP = ('subscription', 'unknown')
+
+    def __init__(self, deny_hosts=DENY_HOSTS):
+        self.deny_hosts = tuple(deny_hosts)
+        self.stats = {}  # 频道URL -> 统计
+
+    def extract(self, channel_url, text):
+        """返回 {'urls': [候选订阅链接], 'nodes': [proxy]}"""
+        urls, nodes = {}, {}
+        stats = self.stats[channel_url] = {'links': 0, 'subscriptions': 0, 'nodes': 0, 'rejected': {}}
+        for match in LINK_PATTERN.finditer(text):
+            link = match.group(0).rstrip(TRAILING)
+            if '&' in link:
+                link = html.unescape(link)
+            if link in urls or link in nodes:
+                continue
+            stats['links'] += 1
+            if match.group('scheme').lower() in ('http', 'https'):
+                kind = classify(link, self.deny_hosts)
+                if kind in self.KEEP:
+                    urls[link] = None
+                else:
+                    urls[link] = kind  # 记下已判定的链接，同页重复出现时不再重复统计
+                    stats['rejected'][kind] = stats['rejected'].get(kind, 0) + 1
+                    EXTRACTED_LINKS.inc(result=kind)
+            else:
+                proxy = parse_line(link)
+                nodes[link] = proxy
+                if proxy is None:
+                    stats['rejected']['bad_node'] = stats['rejected'].get('bad_node', 0) + 1
+                    EXTRACTED_LINKS.inc(result='bad_node')
+        result = {'urls': [url for url, rejected in urls.items() if rejected is None],
+                  'nodes': [proxy for proxy in nodes.values() if proxy]}
+        stats['subscriptions'] = len(result['urls'])
+        stats['nodes'] = len(result['nodes'])
+        EXTRACTED_LINKS.inc(stats['subscriptions'], result='subscription')
+        EXTRACTED_LINKS.inc(stats['nodes'], result='node')
+        logger.info(f"{channel_url}\t获取成功：候选订阅 {stats['subscriptions']} 个，节点 {stats['nodes']} 个，"
+                    f"丢弃链接 {sum(stats['rejected'].values())} 个")
+        return result
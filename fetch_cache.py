@@ -0,0 +1,148 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+from models import object_hook, to_json
+
+# 抓取缓存：按URL保存 ETag / Last-Modified / 内容哈希以及上次的解析结果
+CACHE_FILE = 'fetch_cache.db'
+# 订阅的解析结果分段保存，每段的记录数；流式读取时内存中最多只有一段
+PART_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetch_cache (
+    url           TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    digest        TEXT,
+    result        TEXT NOT NULL,
+    updated       REAL NOT NULL
+)
+"""
+
+# 流式订阅的解析结果：fetch_cache.result 中记下 {"gen": 本次写入编号, "count": 记录数}，记录按段存放在这里
+PARTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fetch_parts (
+    url     TEXT NOT NULL,
+    gen     INTEGER NOT NULL,
+    part    INTEGER NOT NULL,
+    records TEXT NOT NULL,
+    PRIMARY KEY (url, gen, part)
+)
+"""
+
+
+def new_digest():
+    """内容哈希对象，流式读取时逐块 update"""
+    return hashlib.sha1()
+
+
+class RecordWriter:
+    """边解析边写入一份订阅的结果，每满 PART_SIZE 条写一段；FetchCache.put_stream 之前对读取方不可见"""
+
+    def __init__(self, conn, url, gen):
+        self.conn = conn
+        self.url = url
+        self.gen = gen
+        self.part = 0
+        self.count = 0
+        self.records = []
+
+    def add(self, record):
+        self.records.append(record)
+        self.count += 1
+        if len(self.records) >= PART_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.conn.execute('INSERT OR REPLACE INTO fetch_parts VALUES (?, ?, ?, ?)',
+                              (self.url, self.gen, self.part, json.dumps(self.records, ensure_ascii=False, default=to_json)))
+            self.part += 1
+            self.records = []
+
+
+class FetchCache:
+    """条件请求缓存：内容未变化时直接复用上次的解析结果，跳过解码和解析"""
+
+    def __init__(self, path=CACHE_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(SCHEMA)
+        self.conn.execute(PARTS_SCHEMA)
+        self.conn.commit()
+        self.generation = time.time_ns()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, url):
+        """返回 (etag, last_modified, digest, result)，没有缓存时返回 None"""
+        row = self.conn.execute('SELECT etag, last_modified, digest, result FROM fetch_cache WHERE url = ?',
+                                (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3], object_hook=object_hook)
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry:
+            etag, last_modified = entry[0], entry[1]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def put(self, url, etag, last_modified, digest, result):
+        self.conn.execute('INSERT OR REPLACE INTO fetch_cache VALUES (?, ?, ?, ?, ?, ?)',
+                          (url, etag, last_modified, digest, json.dumps(result, ensure_ascii=False, default=to_json), time.time()))
+        self.conn.commit()
+
+    def writer(self, url):
+        """开始写入 url 的一份新的解析结果"""
+        self.generation += 1
+        return RecordWriter(self.conn, url, self.generation)
+
+    def put_stream(self, url, etag, last_modified, digest, writer):
+        """写入完成：切换到新的解析结果并删除旧的分段"""
+        writer.flush()
+        self.put(url, etag, last_modified, digest, {'gen': writer.gen, 'count': writer.count})
+        self.conn.execute('DELETE FROM fetch_parts WHERE url = ? AND gen != ?', (url, writer.gen))
+        self.conn.commit()
+
+    def discard(self, writer):
+        """放弃写到一半的解析结果（抓取失败或重试）"""
+        if writer.part:
+            self.conn.execute('DELETE FROM fetch_parts WHERE url = ? AND gen = ?', (writer.url, writer.gen))
+            self.conn.commit()
+
+    @staticmethod
+    def count(entry):
+        result = entry[3]
+        return result['count'] if isinstance(result, dict) else len(result)
+
+    def records(self, url, entry):
+        """逐段读出缓存的解析结果（旧版缓存整份保存为列表）"""
+        result = entry[3]
+        if not isinstance(result, dict):
+            yield from result
+            return
+        for part in range(result['count'] // PART_SIZE + 1):
+            row = self.conn.execute('SELECT records FROM fetch_parts WHERE url = ? AND gen = ? AND part = ?',
+                                    (url, result['gen'], part)).fetchone()
+            if row is None:
+                return
+            yield from json.loads(row[0], object_hook=object_hook)
+
+    def touch(self, url):
+        self.conn.execute('UPDATE fetch_cache SET updated = ? WHERE url = ?', (time.time(), url))
+        self.conn.commit()
+
+    def prune(self, max_age=3 * 86400):
+        """删除长时间没有再被请求过的URL"""
+        self.conn.execute('DELETE FROM fetch_cache WHERE updated < ?', (time.time() - max_age,))
+        self.conn.execute('DELETE FROM fetch_parts WHERE url NOT IN (SELECT url FROM fetch_cache)')
+        self.conn.commit()
@@ -0,0 +1,237 @@
+import asyncio
+import inspect
+import time
+import aiohttp
+from loguru import logger
+
+from fetch_cache import new_digest
+from metrics import FETCH_SECONDS, FETCH_BYTES, FETCH_REQUESTS, DECODE_SECONDS, RECORDS
+
+# 默认请求头，与原先订阅抓取保持一致
+DEFAULT_HEADERS = {'User-Agent': 'ClashforWindows/0.18.1'}
+# 流式读取时每块的大小
+CHUNK_SIZE = 64 * 1024
+# 服务端暂时性错误，与连接错误一样退避后重试
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 30
+
+
+class RetryableStatus(Exception):
+    """可重试的HTTP状态码，delay 为服务端 Retry-After 要求的等待秒数"""
+
+    def __init__(self, status, delay=None):
+        super().__init__(status)
+        self.delay = delay
+
+
+def retry_after(resp):
+    value = resp.headers.get('Retry-After', '')
+    return min(float(value), MAX_RETRY_AFTER) if value.isdigit() else None
+
+
+async def emit(sink, record):
+    result = sink(record)
+    if inspect.isawaitable(result):
+        await result
+
+
+class AsyncFetcher:
+    """基于asyncio的抓取引擎：共享连接池，单host并发限制 + 全局并发上限
+
+    连接错误、超时以及 429/5xx 响应最多共尝试 attempts 次（含第一次请求），每次重试前按 backoff 指数退避
+    （429/503 带 Retry-After 时按其要求等待）。
+    """
+
+    def __init__(self, max_in_flight=64, per_host=4, timeout=10, attempts=2, headers=None, cache=None, pool=None,
+                 backoff=1.0):
+        self.max_in_flight = max_in_flight
+        self.per_host = per_host
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+        self.headers = headers or DEFAULT_HEADERS
+        self.cache = cache  # FetchCache，可选
+        self.pool = pool    # ParsePool，可选：较大的订阅交给工作进程解码
+        self.session = None
+
+    async def __aenter__(self):
+        # limit 为全局在途连接上限，limit_per_host 为单host上限，连接在请求间复用
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight,
+                                         limit_per_host=self.per_host,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             headers=self.headers,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def wait_retry(self, attempt, error):
+        delay = getattr(error, 'delay', None)
+        await asyncio.sleep(delay if delay is not None else self.backoff * 2 ** (attempt - 1))
+
+    @property
+    def request_timeout(self):
+        # 每次请求时读取，常驻模式下重新加载配置修改 timeout 后立即生效
+        return aiohttp.ClientTimeout(total=self.timeout)
+
+    async def fetch(self, url, handler, method='GET'):
+        """抓取单个URL，成功后立即把响应内容交给 handler(url, text) 处理并返回其结果
+
+        配置了缓存时发送条件请求：304 或内容哈希未变都直接返回上次的处理结果。
+        """
+        with FETCH_SECONDS.time(kind='page'):
+            entry = self.cache.get(url) if self.cache else None
+            headers = self.cache.conditional_headers(entry) if entry else None
+            for attempt in range(1, self.attempts + 1):
+                try:
+                    async with self.session.request(method, url, headers=headers, timeout=self.request_timeout) as resp:
+                        if resp.status == 304 and entry:
+                            FETCH_REQUESTS.inc(kind='page', result='not_modified')
+                            self.cache.touch(url)
+                            return entry[3]
+                        if resp.status in RETRY_STATUSES and attempt < self.attempts:
+                            raise RetryableStatus(resp.status, retry_after(resp))
+                        if resp.status != 200:
+                            FETCH_REQUESTS.inc(kind='page', result='http_error')
+                            return None
+                        body = await resp.read()
+                        etag = resp.headers.get('ETag')
+                        last_modified = resp.headers.get('Last-Modified')
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                    if attempt == self.attempts:
+                        FETCH_REQUESTS.inc(kind='page', result='error')
+                        logger.debug(f"抓取失败 {url}: {e!r}")
+                        return None
+                    await self.wait_retry(attempt, e)
+        FETCH_BYTES.inc(len(body), kind='page')
+
+        text = body.decode('utf-8', 'ignore')
+        if self.cache is None:
+            FETCH_REQUESTS.inc(kind='page', result='ok')
+            return handler(url, text)
+        digest = new_digest()
+        digest.update(body)
+        digest = digest.hexdigest()
+        if entry and entry[2] == digest:
+            FETCH_REQUESTS.inc(kind='page', result='unchanged')
+            self.cache.put(url, etag, last_modified, digest, entry[3])
+            return entry[3]
+        FETCH_REQUESTS.inc(kind='page', result='ok')
+        result = handler(url, text)
+        if result is not None:
+            self.cache.put(url, etag, last_modified, digest, result)
+        return result
+
+    async def stream(self, url, decoder_factory, sink, method='GET'):
+        """流式抓取：分块读取响应，边解码边把解析出的记录交给 sink(record)，不保留整份响应
+
+        decoder_factory() 返回带 feed(chunk)/close() 的增量解码器（见 stream_parse.StreamDecoder）。
+        sink 可以是协程函数（如有界队列的 put），下游处理不过来时读取会随之暂停，形成背压。
+        读到一半失败重试时，已经交给 sink 的前若干条不再重复产出；解析结果同时分段写入缓存。
+        配置了 pool 时，声明长度达到 pool.min_bytes 的订阅边读边分批交给工作进程解码；
+        没有声明长度的分块响应先在本进程解码，读到 min_bytes 后把解码器转交工作进程继续。
+        返回本次产出的记录数，失败返回 None。
+        """
+        entry = self.cache.get(url) if self.cache else None
+        headers = self.cache.conditional_headers(entry) if entry else None
+        start = time.perf_counter()
+        emitted = 0  # 已交给 sink 的记录数，跨重试保留
+        for attempt in range(1, self.attempts + 1):
+            writer = self.cache.writer(url) if self.cache else None
+            count = 0
+
+            async def deliver(decoded):
+                nonlocal count, emitted
+                for record in decoded:
+                    count += 1
+                    if writer:
+                        writer.add(record)
+                    if count > emitted:
+                        emitted = count
+                        await emit(sink, record)
+                        RECORDS.inc(type=record.type)
+
+            digest = new_digest()
+            try:
+                async with self.session.request(method, url, headers=headers, timeout=self.request_timeout) as resp:
+                    if resp.status == 304 and entry:
+                        FETCH_REQUESTS.inc(kind='subscription', result='not_modified')
+                        self.cache.touch(url)
+                        for i, record in enumerate(self.cache.records(url, entry)):
+                            if i >= emitted:
+                                await emit(sink, record)
+                        return self.cache.count(entry)
+                    if resp.status in RETRY_STATUSES and attempt < self.attempts:
+                        raise RetryableStatus(resp.status, retry_after(resp))
+                    if resp.status != 200:
+                        FETCH_REQUESTS.inc(kind='subscription', result='http_error')
+                        if writer:
+                            self.cache.discard(writer)
+                        return None
+                    decoder = decoder_factory()
+                    size = batch_size = 0
+                    batch = []
+                    decode_time = 0.0
+                    pooled = self.pool is not None and (resp.content_length or 0) >= self.pool.min_bytes
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        digest.update(chunk)
+                        if pooled:
+                            batch.append(chunk)
+                            batch_size += len(chunk)
+                            if batch_size >= self.pool.batch_bytes:
+                                decoder, decoded, cpu_time = await self.pool.decode(decoder, batch)
+                                batch, batch_size = [], 0
+                                decode_time += cpu_time
+                                await deliver(decoded)
+                            continue
+                        # 先取出本块的全部记录再交给 sink，解码耗时与下游等待分开统计
+                        mark = time.perf_counter()
+                        decoded = list(decoder.feed(chunk))
+                        decode_time += time.perf_counter() - mark
+                        await deliver(decoded)
+                        pooled = self.pool is not None and size >= self.pool.min_bytes
+                    if pooled:
+                        decoder, decoded, cpu_time = await self.pool.decode(decoder, batch, final=True)
+                        decode_time += cpu_time
+                    else:
+                        mark = time.perf_counter()
+                        decoded = list(decoder.close())
+                        decode_time += time.perf_counter() - mark
+                    await deliver(decoded)
+                    etag = resp.headers.get('ETag')
+                    last_modified = resp.headers.get('Last-Modified')
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatus) as e:
+                if writer:
+                    self.cache.discard(writer)
+                if attempt == self.attempts:
+                    FETCH_REQUESTS.inc(kind='subscription', result='error')
+                    logger.debug(f"抓取失败 {url}: {e!r}")
+                    return None
+                await self.wait_retry(attempt, e)
+        FETCH_SECONDS.observe(time.perf_counter() - start, kind='subscription')
+        FETCH_BYTES.inc(size, kind='subscription')
+        DECODE_SECONDS.inc(decode_time)
+
+        if self.cache is not None:
+            digest = digest.hexdigest()
+            FETCH_REQUESTS.inc(kind='subscription', result='unchanged' if entry and entry[2] == digest else 'ok')
+            self.cache.put_stream(url, etag, last_modified, digest, writer)
+        else:
+            FETCH_REQUESTS.inc(kind='subscription', result='ok')
+        return count
+
+    async def fetch_all(self, urls, handler, method='GET', on_done=None):
+        """并发抓取所有URL，结果按输入顺序返回"""
+        async def run(url):
+            try:
+                return await self.fetch(url, handler, method)
+            finally:
+                if on_done:
+                    on_done(url)
+
+        return await asyncio.gather(*(run(url) for url in urls))
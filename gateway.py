@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import base64
+import ipaddress
+import json
+import os
+import random
+import struct
+import time
+from urllib.parse import urlsplit, unquote
+
+from loguru import logger
+
+# 上游连接与握手的超时(秒)
+CONNECT_TIMEOUT = 8
+# 预热连接的最长空闲时间(秒)，超过后丢弃
+IDLE_TTL = 20
+# 上游列表中没有实测延迟时的初始延迟(毫秒)：所有上游权重相同，直到有流量经过后才按实际延迟区分
+DEFAULT_LATENCY = 1000.0
+
+
+class Upstream:
+    """上游代理：记录延迟EWMA、连续失败次数和熔断状态，并保留少量预热的空闲连接"""
+
+    __slots__ = ('url', 'scheme', 'host', 'port', 'username', 'password',
+                 'latency', 'failures', 'open_until', 'idle')
+
+    def __init__(self, url, latency=DEFAULT_LATENCY):
+        parts = urlsplit(url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.username = unquote(parts.username or '')
+        self.password = unquote(parts.password or '')
+        self.latency = latency
+        self.failures = 0
+        self.open_until = 0.0
+        self.idle = []    # [(reader, writer, 建立时间)]
+
+    @property
+    def healthy(self):
+        return self.open_until <= time.monotonic()
+
+
+class UpstreamPool:
+    """上游代理池：按延迟加权选择，失败熔断（指数退避），文件变化时自动重新加载
+
+    初始延迟取 http_proxies.json 中 proxy_to_http.py 实测的 latency_ms，之后按实际转发的建连耗时更新EWMA。
+    """
+
+    def __init__(self, path='http_proxies.json', failure_threshold=3, cooldown=30, alpha=0.3):
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.upstreams = {}
+        self.mtime = None
+
+    def reload(self):
+        """http_proxies.json 变化时重新加载，已有上游保留其统计信息；文件无效时继续使用当前的上游"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            entries = {p['proxy_url']: p for p in data.get('http_proxies', [])
+                       if p.get('proxy_url', '').startswith(('http://', 'socks5://'))}
+        except (OSError, ValueError, KeyError, AttributeError, TypeError) as e:
+            logger.error(f'加载上游代理失败，继续使用当前的 {len(self.upstreams)} 个: {e!r}')
+            self.mtime = mtime  # 文件再次变化时再重试
+            return
+        self.upstreams = {url: self.upstreams.get(url) or Upstream(url, entry.get('latency_ms') or DEFAULT_LATENCY)
+                          for url, entry in entries.items()}
+        self.mtime = mtime
+        logger.info(f'加载上游代理 {len(self.upstreams)} 个')
+
+    def choose(self, exclude=()):
+        """按 1/延迟 加权随机选择一个未熔断的上游；全部熔断时退回到最早恢复的那个"""
+        candidates = [up for up in self.upstreams.values() if up.url not in exclude]
+        healthy = [up for up in candidates if up.healthy]
+        if healthy:
+            return random.choices(healthy, weights=[1 / max(up.latency, 1) for up in healthy])[0]
+        if candidates:
+            return min(candidates, key=lambda up: up.open_until)
+        return None
+
+    def report_success(self, upstream, latency):
+        upstream.latency = self.alpha * latency + (1 - self.alpha) * upstream.latency
+        upstream.failures = 0
+        upstream.open_until = 0.0
+
+    def report_failure(self, upstream):
+        upstream.failures += 1
+        if upstream.failures >= self.failure_threshold:
+            backoff = self.cooldown * 2 ** min(upstream.failures - self.failure_threshold, 6)
+            upstream.open_until = time.monotonic() + backoff
+
+
+def socks5_address(host):
+    try:
+        ip = ipaddress.ip_address(host)
+        return (b'\x01' if ip.version == 4 else b'\x04') + ip.packed
+    except ValueError:
+        encoded = host.encode('idna')
+        return b'\x03' + bytes([len(encoded)]) + encoded
+
+
+class Gateway:
+    """本地HTTP/SOCKS5轮换网关：每个请求经池中的一个上游转发，失败时换一个上游透明重试"""
+
+    def __init__(self, pool, retries=3, warm_per_upstream=2, warm_top=20):
+        self.pool = pool
+        self.retries = retries
+        self.warm_per_upstream = warm_per_upstream
+        self.warm_top = warm_top
+
+    async def dial(self, upstream):
+        """取一条到上游的TCP连接：优先复用预热好的空闲连接"""
+        now = time.monotonic()
+        while upstream.idle:
+            reader, writer, created = upstream.idle.pop()
+            if now - created < IDLE_TTL and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return await asyncio.wait_for(asyncio.open_connection(upstream.host, upstream.port), CONNECT_TIMEOUT)
+
+    async def handshake(self, upstream, reader, writer, host, port):
+        """在上游连接上建立到 host:port 的隧道"""
+        if upstream.scheme == 'socks5':
+            auth = upstream.username or upstream.password
+            writer.write(b'\x05\x01' + (b'\x02' if auth else b'\x00'))
+            await writer.drain()
+            version, method = await reader.readexactly(2)
+            if method == 0x02:
+                user, pwd = upstream.username.encode(), upstream.password.encode()
+                writer.write(b'\x01' + bytes([len(user)]) + user + bytes([len(pwd)]) + pwd)
+                await writer.drain()
+                if (await reader.readexactly(2))[1] != 0:
+                    raise ConnectionError('socks5 认证失败')
+            elif method != 0x00:
+                raise ConnectionError('socks5 不支持的认证方式')
+            writer.write(b'\x05\x01\x00' + socks5_address(host) + struct.pack('!H', port))
+            await writer.drain()
+            head = await reader.readexactly(4)
+            if head[1] != 0:
+                raise ConnectionError(f'socks5 连接失败: {head[1]}')
+            skip = {1: 4, 4: 16}.get(head[3])
+            if skip is None:
+                skip = (await reader.readexactly(1))[0]
+            await reader.readexactly(skip + 2)
+        else:
+            request = f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n'
+            if upstream.username or upstream.password:
+                token = base64.b64encode(f'{upstream.username}:{upstream.password}'.encode()).decode()
+                request += f'Proxy-Authorization: Basic {token}\r\n'
+            writer.write((request + '\r\n').encode())
+            await writer.drain()
+            response = await reader.readuntil(b'\r\n\r\n')
+            status = response.split(b' ', 2)[1] if b' ' in response else b''
+            if status != b'200':
+                raise ConnectionError(f'CONNECT 失败: {response[:40]!r}')
+
+    async def open_tunnel(self, host, port):
+        """选一个上游建立隧道，失败时熔断计数并换一个上游重试"""
+        tried = set()
+        for _ in range(self.retries):
+            upstream = self.pool.choose(exclude=tried)
+            if upstream is None:
+                break
+            tried.add(upstream.url)
+            start = time.perf_counter()
+            writer = None
+            try:
+                reader, writer = await self.dial(upstream)
+                await asyncio.wait_for(self.handshake(upstream, reader, writer, host, port), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError, ConnectionError, IndexError) as e:
+                if writer:
+                    writer.close()
+                self.pool.report_failure(upstream)
+                logger.debug(f'上游 {upstream.url} 失败: {e!r}')
+                continue
+            self.pool.report_success(upstream, (time.perf_counter() - start) * 1000)
+            return reader, writer
+        raise ConnectionError(f'所有上游都无法连接 {host}:{port}')
+
+    async def pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def relay(self, client_reader, client_writer, up_reader, up_writer, first=b''):
+        if first:
+            up_writer.write(first)
+        await asyncio.gather(self.pipe(client_reader, up_writer), self.pipe(up_reader, client_writer))
+
+    async def handle_http(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            method, target, version = head.split(b'\r\n', 1)[0].decode('latin-1').split(' ', 2)
+            if method == 'CONNECT':
+                host, _, port = target.rpartition(':')
+                up_reader, up_writer = await self.open_tunnel(host.strip('[]'), int(port))
+                writer.write(f'{version} 200 Connection Established\r\n\r\n'.encode())
+                await writer.drain()
+                await self.relay(reader, writer, up_reader, up_writer)
+            else:
+                # 普通HTTP请求同样走隧道：改写为 origin-form 后发给目标站点
+                url = urlsplit(target)
+                if not url.hostname:
+                    # 只有 origin-form（如 GET / HTTP/1.1）的请求不是发给代理的，无从得知目标站点
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    await writer.drain()
+                    writer.close()
+                    return
+                path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+                # 隧道只通向这一个站点，去掉 keep-alive 相关头并要求请求结束后关闭连接
+                headers = [line for line in head.split(b'\r\n')[1:-2]
+                           if not line.lower().startswith((b'proxy-connection:', b'connection:'))]
+                up_reader, up_writer = await self.open_tunnel(url.hostname, url.port or 80)
+                request = b'\r\n'.join([f'{method} {path} {version}'.encode('latin-1')] + headers +
+                                        [b'Connection: close', b'', b''])
+                await self.relay(reader, writer, up_reader, up_writer, first=request)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, OSError) as e:
+            logger.debug(f'HTTP 请求失败: {e!r}')
+            try:
+                writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+            except OSError:
+                pass
+            writer.close()
+
+    async def handle_socks5(self, reader, writer):
+        try:
+            version, nmethods = await reader.readexactly(2)
+            methods = await reader.readexactly(nmethods)
+            if 0x00 not in methods:
+                # 网关只支持无认证，客户端没有提供该方式时按协议回复 0xFF 并断开
+                writer.write(b'\x05\xff')
+                await writer.drain()
+                writer.close()
+                return
+            writer.write(b'\x05\x00')
+            await writer.drain()
+            _, cmd, _, atyp = await reader.readexactly(4)
+            if atyp == 1:
+                host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+            elif atyp == 4:
+                host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+            else:
+                host = (await reader.readexactly((await reader.readexactly(1))[0])).decode('idna')
+            port = struct.unpack('!H', await reader.readexactly(2))[0]
+            if cmd != 1:
+                writer.write(b'\x05\x07\x00\x01' + bytes(6))
+                writer.close()
+                return
+            up_reader, up_writer = await self.open_tunnel(host, port)
+            writer.write(b'\x05\x00\x00\x01' + bytes(6))
+            await writer.drain()
+            await self.relay(reader, writer, up_reader, up_writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, OSError) as e:
+            logger.debug(f'SOCKS5 请求失败: {e!r}')
+            try:
+                writer.write(b'\x05\x01\x00\x01' + bytes(6))
+            except OSError:
+                pass
+            writer.close()
+
+    async def maintain(self, interval=5):
+        """定期重新加载上游列表，并为延迟最低的上游保持少量预热连接"""
+        while True:
+            self.pool.reload()
+            now = time.monotonic()
+            best = sorted((up for up in self.pool.upstreams.values() if up.healthy),
+                          key=lambda up: up.latency)[:self.warm_top]
+            for upstream in best:
+                upstream.idle = [conn for conn in upstream.idle if now - conn[2] < IDLE_TTL]
+                while len(upstream.idle) < self.warm_per_upstream:
+                    try:
+                        reader, writer = await asyncio.wait_for(
+                            asyncio.open_connection(upstream.host, upstream.port), CONNECT_TIMEOUT)
+                    except (OSError, asyncio.TimeoutError):
+                        self.pool.report_failure(upstream)
+                        break
+                    upstream.idle.append((reader, writer, time.monotonic()))
+            await asyncio.sleep(interval)
+
+    async def serve(self, host='127.0.0.1', http_port=8080, socks_port=1080):
+        self.pool.reload()
+        http_server = await asyncio.start_server(self.handle_http, host, http_port)
+        socks_server = await asyncio.start_server(self.handle_socks5, host, socks_port)
+        logger.info(f'网关已启动: HTTP {host}:{http_port}  SOCKS5 {host}:{socks_port}')
+        async with http_server, socks_server:
+            await asyncio.gather(http_server.serve_forever(), socks_server.serve_forever(), self.maintain())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地HTTP/SOCKS5轮换代理网关')
+    parser.add_argument('--pool', default='http_proxies.json', help='上游代理列表（proxy_to_http.py 的输出）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8080)
+    parser.add_argument('--socks-port', type=int, default=1080)
+    args = parser.parse_args()
+
+    gateway = Gateway(UpstreamPool(args.pool))
+    asyncio.run(gateway.serve(args.host, args.http_port, args.socks_port))
@@ -0,0 +1,287 @@
+import argparse
+import array
+import bisect
+import functools
+import gzip
+import mmap
+import os
+import re
+import socket
+import struct
+import sys
+
+from loguru import logger
+
+# 离线IP库：按起始地址排序的区间数组，mmap 后直接在文件上二分查找，不需要把库读进内存
+GEOIP_FILE = 'geoip.dat'
+
+MAGIC = b'CSGEOIP1'
+# 文件头：魔数、IPv4区间数、IPv6区间数、记录数、名称区字节数（小端）
+HEADER = struct.Struct('<8sIIII')
+# 记录：国家代码、标志位、保留、ASN、AS名称在名称区的偏移和长度
+RECORD = struct.Struct('<2sBxIIH')
+HOSTING = 1  # 标志位：数据中心/云主机网络
+
+# AS名称中出现这些词的网络视为数据中心（托管商、云厂商、CDN）
+HOSTING_KEYWORDS = re.compile(
+    r'\b(host|cloud|data ?-?cent(er|re)|server|vps|colocation|amazon|aws|google|microsoft|azure|'
+    r'digitalocean|linode|akamai|vultr|choopa|ovh|hetzner|contabo|leaseweb|m247|alibaba|aliyun|tencent|'
+    r'oracle|fastly|scaleway|upcloud|kamatera|ionos|godaddy|rackspace|psychz|quadranet|zenlayer|'
+    r'datacamp|g-?core|bandwagon|it7|dmit|racknerd|buyvm|frantech)',
+    re.IGNORECASE)
+
+
+def ip_key(ip):
+    """IP字面量转换为 (族, 键)：IPv4 为整数，IPv6 为16字节的网络字节序；无法识别时返回 (None, None)"""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        pass
+    try:
+        return 6, socket.inet_pton(socket.AF_INET6, ip)
+    except OSError:
+        return None, None
+
+
+class V6Starts:
+    """IPv6 区间起点的只读序列视图，供 bisect 在 mmap 上直接二分"""
+
+    def __init__(self, buffer, offset, count):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.offset + 16 * i
+        return self.buffer[start:start + 16]
+
+
+class GeoIP:
+    """离线 IP -> 国家/ASN/数据中心 查询
+
+    lookup 返回 {'country', 'asn', 'as_name', 'hosting'}（同一记录返回同一个字典，不要修改），库中没有记录的地址返回 None。
+    区间起点和记录都在 mmap 中，常驻内存只有实际访问到的页和最近用到的记录；查询为一次C层二分加一次记录解包。
+    """
+
+    def __init__(self, path=GEOIP_FILE):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, v4_count, v6_count, record_count, names_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} 不是 geoip 数据库文件')
+        offset = HEADER.size
+        self.v4_starts = self.uint32s(offset, v4_count)
+        self.v4_records = self.uint32s(offset + 4 * v4_count, v4_count)
+        offset += 8 * v4_count
+        self.v6_starts = V6Starts(self.mm, offset, v6_count)
+        self.v6_records = self.uint32s(offset + 16 * v6_count, v6_count)
+        self.records_offset = offset + 20 * v6_count
+        self.names_offset = self.records_offset + RECORD.size * record_count
+        self.record_count = record_count
+        self.record = functools.lru_cache(maxsize=8192)(self.decode_record)
+
+    def uint32s(self, offset, count):
+        view = memoryview(self.mm)[offset:offset + 4 * count]
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        values = array.array('I', view)  # 大端机器上只能读入内存再转换字节序
+        values.byteswap()
+        return values
+
+    def close(self):
+        for name in ('v4_starts', 'v4_records', 'v6_records'):
+            values = getattr(self, name)
+            if isinstance(values, memoryview):
+                values.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def decode_record(self, index):
+        if not index:
+            return None
+        country, flags, asn, name_offset, name_size = RECORD.unpack_from(self.mm, self.records_offset + RECORD.size * index)
+        start = self.names_offset + name_offset
+        return {'country': country.decode('ascii').strip(), 'asn': asn,
+                'as_name': self.mm[start:start + name_size].decode('utf-8', 'replace'),
+                'hosting': bool(flags & HOSTING)}
+
+    def lookup(self, ip):
+        family, key = ip_key(ip)
+        if family == 4:
+            i = bisect.bisect_right(self.v4_starts, key) - 1
+            return self.record(self.v4_records[i]) if i >= 0 else None
+        if family == 6:
+            i = bisect.bisect_right(self.v6_starts, key) - 1
+            return self.record(self.v6_records[i]) if i >= 0 else None
+        return None
+
+    def enrich(self, proxies, resolved):
+        """按DNS解析结果 {主机名: IP} 给节点附加 geo 信息，同一IP只查一次，返回查到信息的节点数"""
+        cache = {}
+        found = 0
+        for proxy in proxies:
+            ip = resolved.get(proxy.host)
+            if not ip:
+                continue
+            if ip not in cache:
+                cache[ip] = self.lookup(ip)
+            proxy.geo = cache[ip]
+            found += proxy.geo is not None
+        return found
+
+
+def load_geoip(path=GEOIP_FILE):
+    """打开离线库，文件不存在时返回 None（地理信息为可选功能）"""
+    if not path or not os.path.exists(path):
+        logger.info(f'未找到IP库 {path}，跳过地理信息（可用 python geoip.py build 生成）')
+        return None
+    return GeoIP(path)
+
+
+def region_filter(countries=(), exclude_countries=(), exclude_hosting=False):
+    """按地区/网络类型筛选的谓词 allowed(geo)，geo 为 lookup 的结果；没有任何条件时返回 None。
+    查不到信息的地址只在不限定国家时保留"""
+    countries = {code.upper() for code in countries}
+    exclude_countries = {code.upper() for code in exclude_countries}
+    if not (countries or exclude_countries or exclude_hosting):
+        return None
+
+    def allowed(geo):
+        if geo is None:
+            return not countries
+        if countries and geo['country'] not in countries or geo['country'] in exclude_countries:
+            return False
+        return not (exclude_hosting and geo['hosting'])
+    return allowed
+
+
+def cap_per_asn(proxies, limit):
+    """同一ASN最多保留 limit 个节点（按原顺序，即延迟从低到高），避免结果集中在同一个网络上"""
+    if not limit:
+        return list(proxies)
+    counts = {}
+    kept = []
+    for proxy in proxies:
+        asn = proxy.geo['asn'] if proxy.geo else None
+        if asn is not None:
+            if counts.get(asn, 0) >= limit:
+                continue
+            counts[asn] = counts.get(asn, 0) + 1
+        kept.append(proxy)
+    return kept
+
+
+def read_ranges(path):
+    """读取 iptoasn.com 格式的 TSV（ip2asn-v4/v6/combined.tsv[.gz]）：起始IP 结束IP ASN 国家 AS名称"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 5:
+                continue
+            family, start = ip_key(parts[0])
+            end_family, end = ip_key(parts[1])
+            if family is None or family != end_family or not parts[2].isdigit():
+                continue
+            yield family, start, end, int(parts[2]), parts[3], parts[4]
+
+
+def build_database(paths, output=GEOIP_FILE, hosting_asns=()):
+    """由 TSV 区间数据生成离线库；hosting_asns 为额外指定的数据中心 ASN"""
+    hosting_asns = set(hosting_asns)
+    records = {None: 0}       # (国家, 标志, ASN, 名称) -> 记录编号，0 表示未知
+    names = {}                # AS名称 -> (偏移, 长度)
+    name_blob = bytearray()
+    ranges = {4: [], 6: []}
+    for path in paths:
+        for family, start, end, asn, country, as_name in read_ranges(path):
+            if asn == 0:  # Not routed
+                continue
+            if as_name not in names:
+                encoded = as_name.encode('utf-8')[:65535]
+                names[as_name] = (len(name_blob), len(encoded))
+                name_blob += encoded
+            flags = HOSTING if asn in hosting_asns or HOSTING_KEYWORDS.search(as_name) else 0
+            key = (country if country != 'None' else '', flags, asn, as_name)
+            record = records.setdefault(key, len(records))
+            if family == 6:
+                start, end = int.from_bytes(start, 'big'), int.from_bytes(end, 'big')
+            ranges[family].append((start, end, record))
+
+    tables = {}
+    for family, items in ranges.items():
+        items.sort()
+        starts, ids = [], []
+        next_free = 0  # 上一个区间之后的第一个地址
+        for start, end, record in items:
+            start = max(start, next_free)  # 与前一区间重叠的部分以先出现的为准
+            if start > end:
+                continue
+            if start > next_free and (not ids or ids[-1] != 0):
+                starts.append(next_free)  # 区间之间的空隙标记为未知
+                ids.append(0)
+            if ids and ids[-1] == record and starts and start == next_free:
+                pass  # 与前一区间相邻且记录相同，合并
+            else:
+                starts.append(start)
+                ids.append(record)
+            next_free = end + 1
+        if ids and ids[-1] != 0 and next_free < 1 << (32 if family == 4 else 128):
+            starts.append(next_free)  # 最后一个区间之后同样为未知
+            ids.append(0)
+        tables[family] = (starts, ids)
+
+    v4_starts, v4_ids = tables[4]
+    v6_starts, v6_ids = tables[6]
+    with open(output + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(v4_starts), len(v6_starts), len(records), len(name_blob)))
+        for values in (v4_starts, v4_ids):
+            f.write(uint32_bytes(values))
+        f.write(b''.join(start.to_bytes(16, 'big') for start in v6_starts))
+        f.write(uint32_bytes(v6_ids))
+        f.write(RECORD.pack(b'  ', 0, 0, 0, 0))
+        for (country, flags, asn, as_name) in list(records)[1:]:
+            offset, size = names[as_name]
+            f.write(RECORD.pack(country.encode('ascii', 'replace')[:2].ljust(2), flags, asn, offset, size))
+        f.write(name_blob)
+    os.replace(output + '.tmp', output)
+    logger.info(f'已生成 {output}：IPv4区间 {len(v4_starts)}，IPv6区间 {len(v6_starts)}，记录 {len(records) - 1}')
+
+
+def uint32_bytes(values):
+    data = array.array('I', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='离线IP库：生成与查询')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='由 iptoasn.com 的 ip2asn-*.tsv(.gz) 生成IP库')
+    build.add_argument('sources', nargs='+')
+    build.add_argument('-o', '--output', default=GEOIP_FILE)
+    build.add_argument('--hosting-asns', help='额外的数据中心ASN列表文件，每行一个')
+    lookup = commands.add_parser('lookup', help='查询IP')
+    lookup.add_argument('ips', nargs='+')
+    lookup.add_argument('--db', default=GEOIP_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        asns = ()
+        if args.hosting_asns:
+            with open(args.hosting_asns, encoding='utf-8') as f:
+                asns = [int(line.strip().upper().lstrip('AS')) for line in f if line.strip().upper().lstrip('AS').isdigit()]
+        build_database(args.sources, args.output, asns)
+    else:
+        with GeoIP(args.db) as db:
+            for ip in args.ips:
+                print(ip, db.lookup(ip))
@@ -0,0 +1,118 @@
+import sqlite3
+import time
+
+# 节点健康数据库，跨多次运行保留每个 host:port 的历史
+DB_FILE = 'proxy_health.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    key          TEXT PRIMARY KEY,
+    first_seen   REAL NOT NULL,
+    last_seen    REAL NOT NULL,
+    last_checked REAL,
+    next_check   REAL NOT NULL DEFAULT 0,
+    success      INTEGER NOT NULL DEFAULT 0,
+    failure      INTEGER NOT NULL DEFAULT 0,
+    fail_streak  INTEGER NOT NULL DEFAULT 0,
+    latency_ewma REAL
+)
+"""
+
+
+def node_key(proxy):
+    return proxy.endpoint
+
+
+class HealthDB:
+    """按 host:port 记录首次/最近出现时间、成功失败次数和延迟EWMA，并据此安排探测优先级"""
+
+    def __init__(self, path=DB_FILE, good_interval=1800, base_backoff=240, max_backoff=86400, alpha=0.3):
+        self.good_interval = good_interval  # 已知可用节点的复测间隔(秒)
+        self.base_backoff = base_backoff    # 失败节点首次退避(秒)，之后每次翻倍
+        self.max_backoff = max_backoff
+        self.alpha = alpha                  # 延迟EWMA平滑系数
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def touch(self, proxies, now=None):
+        """记录本轮在订阅中出现过的节点"""
+        now = now or time.time()
+        self.conn.executemany(
+            'INSERT INTO nodes (key, first_seen, last_seen) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET last_seen = excluded.last_seen',
+            [(node_key(proxy), now, now) for proxy in proxies])
+        self.conn.commit()
+
+    def stats(self):
+        """返回 {key: (next_check, success, fail_streak, latency_ewma, last_checked)}，需要扫描整张表，只在排期时调用"""
+        rows = self.conn.execute('SELECT key, next_check, success, fail_streak, latency_ewma, last_checked FROM nodes')
+        return {row[0]: row[1:] for row in rows}
+
+    def checked_at(self, proxies):
+        """返回这些节点最近一次探测的时间 {key: last_checked}"""
+        keys = [node_key(proxy) for proxy in proxies]
+        checked = {}
+        for i in range(0, len(keys), 500):  # SQLite 单条语句的参数个数有上限
+            batch = keys[i:i + 500]
+            checked.update(self.conn.execute(
+                f'SELECT key, last_checked FROM nodes WHERE key IN ({",".join("?" * len(batch))})', batch))
+        return checked
+
+    def schedule(self, proxies, now=None, limit=None, priority=None):
+        """拆分为 (本轮需要探测的节点, 未到复测时间的已知可用节点)
+
+        需要探测的节点按优先级排序：从未测过的新节点在前，其次是已知可用节点和因不够快被 Top-K 放弃的节点，
+        最后是连续失败的节点（失败次数越少越靠前）；同一档内按 priority {端点: 分值} 从高到低。
+        """
+        now = now or time.time()
+        stats = self.stats()
+        priority = priority or {}
+        due, cached = [], []
+        for proxy in proxies:
+            key = node_key(proxy)
+            next_check, success, fail_streak, latency, last_checked = stats.get(key, (0, 0, 0, None, None))
+            if next_check <= now:
+                due.append((0 if last_checked is None else 1 + fail_streak,
+                            -priority.get(key, 0), next_check, proxy))
+            elif fail_streak == 0 and success:
+                proxy.rtt = round(latency, 1)
+                cached.append(proxy)
+        due.sort(key=lambda item: item[:3])
+        return [item[-1] for item in due[:limit]], cached
+
+    def record(self, results, now=None):
+        """写入探测结果 [(proxy, rtt)]，失败节点按连续失败次数指数退避
+
+        EWMA 和退避时间都在 UPDATE 中按行计算，只触及本次探测的节点，不需要先读出整张表。
+        """
+        now = now or time.time()
+        ok = [(now, now + self.good_interval, rtt, rtt, node_key(proxy)) for proxy, rtt in results if rtt is not None]
+        failed = [(now, now, node_key(proxy)) for proxy, rtt in results if rtt is None]
+        self.conn.executemany(
+            'UPDATE nodes SET last_checked = ?, next_check = ?, success = success + 1, fail_streak = 0, '
+            f'latency_ewma = CASE WHEN latency_ewma IS NULL THEN ? ELSE {self.alpha} * ? + {1 - self.alpha} * latency_ewma END '
+            'WHERE key = ?', ok)
+        # 退避 base_backoff * 2^fail_streak，上限 max_backoff（移位次数限制在30以内避免溢出）
+        self.conn.executemany(
+            'UPDATE nodes SET last_checked = ?, '
+            f'next_check = ? + MIN({self.max_backoff}, {self.base_backoff} * (1 << MIN(fail_streak, 30))), '
+            'failure = failure + 1, fail_streak = fail_streak + 1 WHERE key = ?', failed)
+        self.conn.commit()
+
+    def record_skipped(self, proxies, now=None):
+        """记录因不够快被 Top-K 提前放弃的节点：不算失败，但不再当作新节点，base_backoff 之后再测"""
+        now = now or time.time()
+        self.conn.executemany('UPDATE nodes SET last_checked = ?, next_check = ? WHERE key = ?',
+                              [(now, now + self.base_backoff, node_key(proxy)) for proxy in proxies])
+        self.conn.commit()
+
+    def prune(self, max_age=7 * 86400, now=None):
+        """删除长时间没有在任何订阅中出现的节点"""
+        now = now or time.time()
+        self.conn.execute('DELETE FROM nodes WHERE last_seen < ?', (now - max_age,))
+        self.conn.commit()
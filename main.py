@@ -1,49 +1,53 @@
-import re
-import os
-import yaml
-import threading
-import base64
-import requests
-import json
 import time
-import socket
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import asyncio
+from functools import partial
 from loguru import logger
 from tqdm import tqdm
-from retry import retry
 
 from pre_check import pre_check
-
-# 存储解析出的代理配置
-all_proxies = []
+from fetcher import AsyncFetcher
+from fetch_cache import FetchCache
+from stream_parse import StreamDecoder
+from parsers import parse_line, parse_clash_proxy
+from parse_pool import shared_pool
+from prober import TCPProber
+from health_db import HealthDB
+from dedup import DedupIndex
+from resolver import DNSCache
+from selector import TopKSelector
+from core_verifier import CoreVerifier
+from output import save_proxies
+from exporters import EXPORTERS, export_all
+from delta import DeltaWriter
+from geoip import cap_per_asn, load_geoip, region_filter
+from daemon import CollectorDaemon
+from settings import CONFIG_FILE, channel_urls, load_settings, validate
+from extractor import LinkExtractor
+from source_scores import SourceScores, source_yields
+from metrics import (STAGE_SECONDS, record_probe, record_source_yields, write_summary,
+                     start_http_server)
+
+# 当前配置（config.yaml 校验并补全默认值后的结果），直接调用 collect 等函数时使用默认值
+config = validate({})
+# 按节点完整身份去重后的代理配置
+dedup_index = DedupIndex()
 # 存储可用的代理 IP
 working_proxies = []
+# 频道页链接提取器，保留每个频道的提取统计
+extractor = LinkExtractor()
+# 本轮实际抓取过的来源 {URL: 'channel'/'subscription'}，以及每个频道列出的订阅
+crawled_sources = {}
+channel_links = {}
 
 @logger.catch
 def get_config():
-    with open('./config.yaml',encoding="UTF-8") as f:
-        data = yaml.load(f, Loader=yaml.FullLoader)
-    list_tg = data['tgchannel']
-    new_list = []
-    for url in list_tg:
-        a = url.split("/")[-1]
-        url = 'https://t.me/s/'+a
-        new_list.append(url)
-    return new_list
+    return channel_urls(config['tgchannel'])
 
 @logger.catch
-def get_channel_http(channel_url):
-    try:
-        with requests.post(channel_url) as resp:
-            data = resp.text
-        url_list = re.findall("https?://[-A-Za-z0-9+&@#/%?=~_|!:,.;]+[-A-Za-z0-9+&@#/%=~_|]", data)  # 使用正则表达式查找订阅链接并创建列表
-        logger.info(channel_url+'\t获取成功')
-    except Exception as e:
-        logger.warning(channel_url+'\t获取失败')
-        logger.error(channel_url+e)
-        url_list = []
-    finally:
-        return url_list
+def get_channel_http(channel_url, data):
+    # 单次扫描提取候选订阅链接和消息中直接贴出的节点，图片、Telegram自身等链接在这里就被丢弃
+    return extractor.extract(channel_url, data)
 
 # @logger.catch
 # def get_channel_http(channel_url):
@@ -64,223 +68,244 @@ def get_channel_http(channel_url):
 #     finally:
 #         return url_list
 
-def parse_vmess(vmess_url):
-    """解析vmess链接"""
-    try:
-        vmess_data = vmess_url.replace('vmess://', '')
-        decoded = base64.b64decode(vmess_data + '==').decode('utf-8')
-        config = json.loads(decoded)
-        return {
-            'type': 'vmess',
-            'host': config.get('add', ''),
-            'port': int(config.get('port', 0)),
-            'id': config.get('id', ''),
-            'aid': config.get('aid', 0),
-            'net': config.get('net', 'tcp'),
-            'path': config.get('path', ''),
-            'host_header': config.get('host', ''),
-            'tls': config.get('tls', ''),
-            'ps': config.get('ps', '')
-        }
-    except:
-        return None
-
-def parse_ss(ss_url):
-    """解析ss链接"""
-    try:
-        # ss://method:password@host:port#name
-        ss_data = ss_url.replace('ss://', '')
-        if '#' in ss_data:
-            ss_data, name = ss_data.split('#', 1)
-        else:
-            name = ''
-
-        if '@' in ss_data:
-            method_pass, host_port = ss_data.split('@', 1)
-            if ':' in host_port:
-                host, port = host_port.rsplit(':', 1)
-                if ':' in method_pass:
-                    method, password = method_pass.split(':', 1)
-                else:
-                    # Base64编码的method:password
-                    decoded = base64.b64decode(method_pass + '==').decode('utf-8')
-                    method, password = decoded.split(':', 1)
-
-                return {
-                    'type': 'ss',
-                    'host': host,
-                    'port': int(port),
-                    'method': method,
-                    'password': password,
-                    'name': name
-                }
-    except:
-        return None
-
-def parse_trojan(trojan_url):
-    """解析trojan链接"""
-    try:
-        # trojan://password@host:port#name
-        trojan_data = trojan_url.replace('trojan://', '')
-        if '#' in trojan_data:
-            trojan_data, name = trojan_data.split('#', 1)
-        else:
-            name = ''
-
-        if '@' in trojan_data:
-            password, host_port = trojan_data.split('@', 1)
-            if ':' in host_port:
-                host, port = host_port.rsplit(':', 1)
-                return {
-                    'type': 'trojan',
-                    'host': host,
-                    'port': int(port),
-                    'password': password,
-                    'name': name
-                }
-    except:
-        return None
-
+async def collect(list_tg, scores=None):
+    """抓取所有频道，每个频道一返回就立即并发下载其中的订阅链接
 
-@logger.catch
-def parse_subscription(url, bar):
-    """解析订阅链接获取代理列表"""
-    headers = {'User-Agent': 'ClashforWindows/0.18.1'}
-    with thread_max_num:
-        @retry(tries=2)
-        def start_check(url):
-            res = requests.get(url, headers=headers, timeout=10)
-            if res.status_code == 200:
-                content = res.text
-
-                # 尝试Base64解码
-                try:
-                    decoded = base64.b64decode(content + '==').decode('utf-8')
-                    content = decoded
-                except:
-                    pass
-
-                # 解析各种协议的代理
-                lines = content.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('vmess://'):
-                        proxy = parse_vmess(line)
-                        if proxy and proxy.get('host') and proxy.get('port'):
-                            all_proxies.append(proxy)
-                    elif line.startswith('ss://'):
-                        proxy = parse_ss(line)
-                        if proxy and proxy.get('host') and proxy.get('port'):
-                            all_proxies.append(proxy)
-                    elif line.startswith('trojan://'):
-                        proxy = parse_trojan(line)
-                        if proxy and proxy.get('host') and proxy.get('port'):
-                            all_proxies.append(proxy)
-
-        try:
-            start_check(url)
-        except Exception as e:
-            logger.debug(f"解析订阅失败 {url}: {e}")
-        bar.update(1)
-
-def test_proxy_connectivity(proxy):
-    """测试代理连通性"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        result = sock.connect_ex((proxy['host'], proxy['port']))
-        sock.close()
-        return result == 0
-    except:
-        return False
+    传入 scores（SourceScores）时，订阅按评分对应的抓取份额抽样下载，产出越低被抽中的概率越小。
+    """
+    seen = set()
+    skipped = 0
+    sub_tasks = []
+    bar = tqdm(total=0, desc='解析订阅：')
+
+    # 订阅和频道页都走条件请求缓存，内容未变化时直接复用上次的解析结果
+    cache = FetchCache()
+    fetch = config['fetch']
+    # 较大的订阅交给多进程解码，解析速度随CPU核数扩展；工作进程在多次 collect 之间复用
+    pool = shared_pool()
+    decoder_factory = partial(StreamDecoder, parse_line, parse_clash_proxy)
+    parsed_count = 0
+    async with AsyncFetcher(max_in_flight=fetch['max_in_flight'], per_host=fetch['per_host'], timeout=fetch['timeout'],
+                            attempts=fetch['attempts'], cache=cache, pool=pool) as fetcher:
+        async def fetch_sub(url):
+            nonlocal parsed_count
+            crawled_sources[url] = 'subscription'
+            # 订阅内容分块读取、增量解码，解析出的代理逐条流入去重，并记录来源订阅
+            count = await fetcher.stream(url, decoder_factory, lambda proxy: dedup_index.add(proxy, url))
+            parsed_count += count or 0
+            bar.update(1)
+
+        async def scrape(channel_url):
+            nonlocal parsed_count, skipped
+            crawled_sources[channel_url] = 'channel'
+            links = await fetcher.fetch(channel_url, get_channel_http, method='POST')
+            if links is None:
+                logger.warning(channel_url+'\t获取失败')
+                return
+            if isinstance(links, list):  # 旧版缓存只保存了链接列表
+                links = {'urls': links, 'nodes': []}
+            for proxy in links['nodes']:
+                dedup_index.add(proxy, channel_url)
+            parsed_count += len(links['nodes'])
+            channel_links[channel_url] = links['urls']
+            for url in links['urls']:
+                if url not in seen:
+                    seen.add(url)
+                    if scores and not scores.should_crawl(url):
+                        skipped += 1
+                        continue
+                    bar.total += 1
+                    bar.refresh()
+                    sub_tasks.append(asyncio.ensure_future(fetch_sub(url)))
+
+        await asyncio.gather(*(scrape(channel_url) for channel_url in list_tg))
+        logger.info(f'开始解析 {len(sub_tasks)} 个订阅链接，跳过长期无产出的订阅 {skipped} 个')
+        await asyncio.gather(*sub_tasks)
+    bar.close()
+    cache.prune(fetch['cache_max_age'])
+    cache.close()
+    return parsed_count
+
+async def test_connectivity(proxies, cached=(), target_count=None, on_result=None, geoip=None):
+    """先批量解析去重后的主机名，DNS解析失败的节点直接判定失败，其余节点用IP探测
+
+    有离线IP库时解析之后先附加国家/ASN信息，地区不符合 geo 配置的端点不再探测（沿用的历史结果同样筛选）。
+    返回 (探测结果, 延迟最低的 target_count 个节点)；沿用历史结果的节点也参与排名。
+    """
+    dns, probe = config['dns'], config['probe']
+    with STAGE_SECONDS.time(stage='dns'):
+        resolver = DNSCache(ttl=dns['ttl'], negative_ttl=dns['negative_ttl'], concurrency=dns['concurrency'],
+                            timeout=dns['timeout'])
+        # 查地区需要IP，沿用历史结果的节点也一并解析
+        hosts = [proxy.host for proxy in proxies] + ([proxy.host for proxy in cached] if geoip else [])
+        resolved = await resolver.resolve_all(hosts)
+    alive = [proxy for proxy in proxies if resolved[proxy.host]]
+    dead = [(proxy, None) for proxy in proxies if not resolved[proxy.host]]
+    logger.info(f'DNS解析失败 {len(dead)} 个，实际探测 {len(alive)} 个')
+    for proxy, rtt in dead:
+        if on_result:
+            on_result(proxy, rtt)
+    if geoip:
+        with STAGE_SECONDS.time(stage='geo'):
+            alive, cached = locate(geoip, alive, cached, resolved)
+
+    selector = TopKSelector(TCPProber(concurrency=probe['concurrency'], timeout=probe['timeout']),
+                            k=target_count or probe['target_count'])
+    for proxy in cached:
+        selector.offer(proxy, proxy.rtt)
+    with STAGE_SECONDS.time(stage='probe'):
+        results = await selector.select(alive, resolved=resolved, on_result=on_result)
+    return dead + results, selector.top()
+
+def locate(geoip, alive, cached, resolved):
+    """查询离线IP库给节点附加 geo 信息，并按 geo 配置筛掉地区不符的节点，返回 (待探测, 沿用)"""
+    geo = config['geo']
+    found = geoip.enrich(alive, resolved) + geoip.enrich(cached, resolved)
+    logger.info(f'IP库查到 {found}/{len(alive) + len(cached)} 个端点的地区信息')
+    allowed = region_filter(geo['countries'], geo['exclude_countries'], geo['exclude_hosting'])
+    if allowed is None:
+        return alive, cached
+    kept, kept_cached = [proxy for proxy in alive if allowed(proxy.geo)], [proxy for proxy in cached if allowed(proxy.geo)]
+    logger.info(f'按地区筛选后剩余 {len(kept)}/{len(alive)} 个待探测端点，{len(kept_cached)}/{len(cached)} 个沿用端点')
+    return kept, kept_cached
 
 if __name__=='__main__':
-    output_file = pre_check()
+    parser = argparse.ArgumentParser(description='采集、去重并测试订阅中的代理节点')
+    parser.add_argument('--config', default=CONFIG_FILE, help='配置文件，常驻模式下修改后或收到 SIGHUP 时自动重新加载')
+    parser.add_argument('--daemon', action='store_true', help='常驻运行，各阶段按各自节奏持续采集和发布')
+    # 以下参数默认取配置文件中的值，命令行传入时覆盖
+    parser.add_argument('--channel-budget', type=int, help='本轮最多抓取的频道数，按历史产出排序（fetch.channel_budget）')
+    parser.add_argument('--probe-budget', type=int, help='本轮最多探测的端点数，按来源产出排序（probe.budget）')
+    parser.add_argument('--formats', nargs='*', choices=list(EXPORTERS),
+                        help='同时导出的客户端格式，不带参数表示只写 collected_proxies.json（output.formats）')
+    parser.add_argument('--export-dir', help='客户端配置的导出目录（output.export_dir）')
+    parser.add_argument('--delta-dir', help='带序号的增量与快照输出目录，传空字符串表示不输出（output.delta_dir）')
+    parser.add_argument('--api-port', type=int, help='常驻模式下在该端口提供节点池查询接口 /proxies，0 表示不启用（output.api_port）')
+    parser.add_argument('--metrics-port', type=int, help='在该端口提供 /metrics 与 /summary，0 表示不启用（output.metrics_port）')
+    args = parser.parse_args()
+    run_start = time.time()
+
+    pre_check()
+    settings = load_settings(args.config)
+    for section, key, value in (('fetch', 'channel_budget', args.channel_budget), ('probe', 'budget', args.probe_budget),
+                                ('output', 'formats', args.formats), ('output', 'export_dir', args.export_dir),
+                                ('output', 'delta_dir', args.delta_dir),
+                                ('output', 'api_port', args.api_port), ('output', 'metrics_port', args.metrics_port)):
+        if value is not None:
+            settings[section][key] = value
+    config = settings.config
+    output_file = config['output']['file']
     list_tg = get_config()
     logger.info('读取config成功')
-
-    # 循环获取频道订阅链接
-    url_list = []
-    for channel_url in list_tg:
-        temp_list = get_channel_http(channel_url)
-        url_list.extend(temp_list)
-
-    logger.info(f'开始解析 {len(url_list)} 个订阅链接')
-    thread_max_num = threading.Semaphore(32)  # 32线程
-    bar = tqdm(total=len(url_list), desc='解析订阅：')
-    thread_list = []
-
-    for url in url_list:
-        # 为每个订阅URL创建线程
-        t = threading.Thread(target=parse_subscription, args=(url, bar))
-        thread_list.append(t)
-        t.setDaemon(True)
-        t.start()
-
-    for t in thread_list:
-        t.join()
-    bar.close()
-
-    logger.info(f'解析完成，共获得 {len(all_proxies)} 个代理配置')
-
-    # 去重
-    unique_proxies = []
-    seen = set()
-    for proxy in all_proxies:
-        key = f"{proxy.get('host')}:{proxy.get('port')}"
-        if key not in seen:
-            seen.add(key)
-            unique_proxies.append(proxy)
-
-    logger.info(f'去重后剩余 {len(unique_proxies)} 个代理，开始测试连通性...')
-
-    # 多线程测试代理连通性
-    max_workers = 20
-    target_count = min(50, len(unique_proxies))  # 最多测试50个
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 限制测试数量，避免测试时间过长
-        test_proxies = unique_proxies[:100] if len(unique_proxies) > 100 else unique_proxies
-
-        future_to_proxy = {
-            executor.submit(test_proxy_connectivity, proxy): proxy
-            for proxy in test_proxies
-        }
-
-        # 使用进度条显示测试进度
-        test_bar = tqdm(total=len(test_proxies), desc='测试连通性：')
-
-        for future in as_completed(future_to_proxy):
-            proxy = future_to_proxy[future]
-            try:
-                if future.result():
-                    working_proxies.append(proxy)
-                    logger.info(f"✓ 发现可用代理: {proxy['host']}:{proxy['port']} ({proxy['type']})")
-
-                    if len(working_proxies) >= target_count:
-                        # 取消剩余的任务
-                        for remaining_future in future_to_proxy:
-                            if not remaining_future.done():
-                                remaining_future.cancel()
-                        break
-            except Exception as e:
-                logger.debug(f"测试代理失败: {e}")
-            finally:
-                test_bar.update(1)
-
-        test_bar.close()
+    if config['output']['metrics_port']:
+        start_http_server(config['output']['metrics_port'])
+
+    if args.daemon:
+        # 常驻模式下配置文件修改后自动重新加载，命令行覆盖的值只在启动时生效
+        asyncio.run(CollectorDaemon.from_settings(settings, get_channel_http).run())
+        raise SystemExit
+
+    # 按历史产出分配抓取预算：新来源和有产出的来源每轮都抓，长期无产出的来源偶尔抽查
+    scores = SourceScores()
+    planned = scores.plan(list_tg, budget=config['fetch']['channel_budget'])
+    logger.info(f'本轮抓取 {len(planned)}/{len(list_tg)} 个频道')
+
+    # 频道抓取与订阅下载在同一个异步引擎中流水线执行，解析结果边下载边去重
+    with STAGE_SECONDS.time(stage='collect'):
+        parsed_count = asyncio.run(collect(planned, scores))
+
+    logger.info(f'解析完成，共获得 {parsed_count} 个代理配置')
+
+    # 同一 host:port 下的不同节点都保留，但每个端点只探测一次
+    candidates = dedup_index.representatives()
+    udp_count = sum(proxy.transport != 'tcp' for proxy in dedup_index.nodes.values())
+    if udp_count:
+        logger.info(f'跳过 {udp_count} 个基于UDP的节点（hysteria2/tuic），TCP探测无法判断它们是否可用')
+
+    # 根据历史健康记录安排探测：新节点优先，可用节点放慢复测，长期失败的节点指数退避
+    with STAGE_SECONDS.time(stage='schedule'):
+        health = config['health']
+        health_db = HealthDB(good_interval=health['good_interval'], base_backoff=health['base_backoff'],
+                             max_backoff=health['max_backoff'])
+        known = health_db.stats()
+        new_endpoints = {proxy.endpoint for proxy in candidates if proxy.endpoint not in known}
+        health_db.touch(candidates)
+        # 同一档内产出高的来源的端点先探测，Top-K 门槛更快收紧
+        due_proxies, cached_proxies = health_db.schedule(candidates, limit=config['probe']['budget'],
+                                                         priority=scores.endpoint_priority(dedup_index))
+    logger.info(f'去重后剩余 {len(dedup_index)} 个代理（{len(candidates)} 个端点），本轮需测试 {len(due_proxies)} 个，'
+                f'沿用历史结果 {len(cached_proxies)} 个')
+
+    # 异步解析并探测，记录建连耗时
+    test_bar = tqdm(total=len(due_proxies), desc='测试连通性：')
+
+    skipped_proxies = []
+
+    def on_probe(proxy, rtt):
+        test_bar.update(1)
+        record_probe(rtt)
+        if rtt is False:
+            skipped_proxies.append(proxy)
+
+    # 只保留延迟最低的端点，门槛确定后慢节点会被提前放弃；有代理核心时多留一些给端到端验证筛选
+    verifier = CoreVerifier(**config['verify'])
+    target_count = config['probe']['verify_target_count' if verifier.available else 'target_count']
+    geoip = load_geoip(config['geo']['database'])
+    results, top_proxies = asyncio.run(test_connectivity(due_proxies, cached=cached_proxies, target_count=target_count,
+                                                         on_result=on_probe, geoip=geoip))
+    test_bar.close()
+    if geoip:
+        geoip.close()
+    health_db.record(results)
+    health_db.record_skipped(skipped_proxies)
+    health_db.prune(health['max_age'])
+    health_db.close()
+
+    # 记录每个来源本轮贡献的节点、新端点和可用端点，更新评分
+    live_endpoints = {proxy.endpoint for proxy, rtt in results if rtt is not None}
+    live_endpoints.update(proxy.endpoint for proxy in cached_proxies)
+    scores.update(crawled_sources, source_yields(dedup_index, new_endpoints, live_endpoints, channel_links))
+    scores.prune()
+    scores.close()
+
+    working_proxies.extend(dedup_index.expand({proxy.endpoint: proxy.rtt for proxy in top_proxies}))
+    # 同一端点下的节点共用代表节点查到的地区信息
+    endpoint_geo = {proxy.endpoint: proxy.geo for proxy in top_proxies}
+    for proxy in working_proxies:
+        proxy.geo = endpoint_geo.get(proxy.endpoint)
+
+    if verifier.available:
+        # TCP可达只说明端口开放：经本地代理核心对每个节点做一次真实请求，去掉不能转发流量的节点
+        # （核心不支持的协议保留TCP探测结果）
+        with STAGE_SECONDS.time(stage='core_verify'):
+            verified = asyncio.run(verifier.verify(working_proxies))
+        failed = set()
+        for proxy, rtt in verified:
+            if rtt is None:
+                failed.add(proxy)
+            else:
+                proxy.rtt = round(rtt, 1)
+        working_proxies = [proxy for proxy in working_proxies if proxy not in failed]
+    else:
+        logger.info('未找到 xray/v2ray 核心，跳过端到端验证')
+
+    # 按延迟从低到高排序，同一ASN的节点过多时只保留延迟最低的几个
+    working_proxies.sort(key=lambda proxy: proxy.rtt)
+    working_proxies = cap_per_asn(working_proxies, config['geo']['max_per_asn'])
 
     logger.info(f'连通性测试完成，找到 {len(working_proxies)} 个可用代理')
 
     # 保存到JSON文件 - 只保留可用的代理
-    result = {
-        'update_time': time.strftime('%Y-%m-%d %H:%M:%S'),
-        'count': len(working_proxies),
-        'proxies': working_proxies,
-        'source': 'collectSub-tested'
-    }
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    save_proxies(output_file, working_proxies)
+    if config['output']['formats']:
+        export_all(working_proxies, config['output']['export_dir'], config['output']['formats'])
+    if config['output']['delta_dir']:
+        DeltaWriter(config['output']['delta_dir']).publish(working_proxies)
 
     logger.info(f'结果已保存到 {output_file}，共 {len(working_proxies)} 个可用代理')
+
+    # 运行摘要：各阶段耗时、抓取/解析/探测计数与每个订阅的产出，用于跨运行定位瓶颈
+    write_summary(elapsed=round(time.time() - run_start, 1), parsed=parsed_count, unique=len(dedup_index),
+                  endpoints=len(candidates), probed=len(results), working=len(working_proxies),
+                  sources=record_source_yields(dedup_index, {proxy.endpoint for proxy in working_proxies}),
+                  channels=extractor.stats)
@@ -0,0 +1,257 @@
+import bisect
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from output import atomic_write
+
+# 运行摘要文件，每次批量运行结束时写出，便于跨运行对比各阶段耗时
+SUMMARY_FILE = 'run_summary.json'
+
+
+class Counter:
+    """单调递增计数器，按标签值分组"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # 标签值元组 -> 数值
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+    def snapshot(self):
+        return {format_labels(dict(zip(self.labels, key))) or 'total': value
+                for key, value in list(self.values.items())}
+
+
+class Gauge(Counter):
+    """可增可减的当前值（队列深度、存活节点数等）"""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Counter):
+    """固定分桶的直方图，记录分布、总和与次数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文：with STAGE_SECONDS.time(stage='collect'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in list(self.values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield self.name + '_bucket', {**labels, 'le': format_bound(bound)}, cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+    def quantile(self, counts, count, q):
+        """按分桶上界估算分位数"""
+        rank, cumulative = q * count, 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return None  # 落在最大分桶之外
+
+    def snapshot(self):
+        result = {}
+        for key, (counts, total, count) in list(self.values.items()):
+            result[format_labels(dict(zip(self.labels, key))) or 'total'] = {
+                'count': count,
+                'sum': round(total, 3),
+                'mean': round(total / count, 3) if count else None,
+                'p50': self.quantile(counts, count, 0.5),
+                'p90': self.quantile(counts, count, 0.9),
+                'p99': self.quantile(counts, count, 0.99),
+            }
+        return result
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def format_labels(labels):
+    """JSON摘要中的分组键，如 kind=page,result=ok"""
+    return ','.join(f'{name}={value}' for name, value in labels.items())
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), **kwargs):
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                label_text = ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics if metric.values}
+
+    def reset(self):
+        """清空所有指标的取值（基准测试在不同规模之间调用）"""
+        for metric in self.metrics:
+            metric.values.clear()
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('collect_stage_seconds', '各阶段耗时(秒)', ('stage',),
+                                   buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600))
+FETCH_SECONDS = REGISTRY.histogram('collect_fetch_seconds', '单个URL抓取耗时(秒)，订阅含解码时间', ('kind',))
+FETCH_BYTES = REGISTRY.counter('collect_fetch_bytes_total', '下载的字节数', ('kind',))
+FETCH_REQUESTS = REGISTRY.counter('collect_fetch_requests_total', '抓取次数，按结果分类', ('kind', 'result'))
+DECODE_SECONDS = REGISTRY.counter('collect_decode_seconds_total', '订阅解码与解析耗时(秒)，不含网络等待')
+RECORDS = REGISTRY.counter('collect_records_total', '解析出的节点数', ('type',))
+PARSE_FAILURES = REGISTRY.counter('collect_parse_failures_total', '无法解析的节点链接数', ('scheme',))
+EXTRACTED_LINKS = REGISTRY.counter('collect_extracted_links_total', '频道页提取结果：保留的订阅/节点与各拒绝原因', ('result',))
+DNS_LOOKUPS = REGISTRY.counter('collect_dns_lookups_total', '实际发出的DNS解析次数', ('result',))
+PROBES = REGISTRY.counter('collect_probes_total', '连通性探测次数', ('result',))
+PROBE_RTT = REGISTRY.histogram('collect_probe_rtt_ms', '探测成功的建连延迟(毫秒)',
+                               buckets=(25, 50, 100, 200, 300, 500, 1000, 2000, 5000))
+QUEUE_DEPTH = REGISTRY.gauge('collect_queue_depth', '常驻模式各阶段队列深度', ('queue',))
+ALIVE = REGISTRY.gauge('collect_alive_endpoints', '当前可用的端点数')
+SOURCE_NODES = REGISTRY.gauge('collect_source_nodes', '每个订阅贡献的节点数，source 为订阅URL的短哈希', ('source', 'state'))
+# 订阅URL常带访问令牌且数量不定，不直接作为指标标签；短哈希与URL的对应关系及产出只在 /summary 中提供
+SOURCES = {}
+
+
+def source_label(url):
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=6).hexdigest()
+
+
+def record_probe(rtt):
+    """记录一次探测结论：rtt 为 None 表示失败，False 表示因无法入选而提前放弃"""
+    if rtt is None:
+        PROBES.inc(result='failed')
+    elif rtt is False:
+        PROBES.inc(result='skipped')
+    else:
+        PROBES.inc(result='ok')
+        PROBE_RTT.observe(rtt)
+
+
+def record_source_yields(dedup_index, alive_endpoints):
+    """统计每个订阅的产出：贡献的节点数与其中可用的节点数，返回 {订阅URL: {...}}
+
+    指标中的订阅以 source_label 标记；各订阅的URL与产出替换 SOURCES，供 /summary 查看。
+    """
+    global SOURCES
+    nodes = [0] * len(dedup_index.source_urls)
+    alive = [0] * len(dedup_index.source_urls)
+    for digest, source_ids in dedup_index.sources.items():
+        ok = dedup_index.nodes[digest].endpoint in alive_endpoints
+        for source_id in source_ids:
+            nodes[source_id] += 1
+            alive[source_id] += ok
+    SOURCE_NODES.values.clear()
+    yields, sources = {}, {}
+    for url, n, ok in zip(dedup_index.source_urls, nodes, alive):
+        key = source_label(url)
+        SOURCE_NODES.set(n, source=key, state='parsed')
+        SOURCE_NODES.set(ok, source=key, state='alive')
+        yields[url] = {'nodes': n, 'alive': ok}
+        sources[key] = {'url': url, **yields[url]}
+    SOURCES = sources  # 整体替换，/summary 所在的线程不会读到更新了一半的字典
+    return yields
+
+
+def write_summary(path=SUMMARY_FILE, **extra):
+    """写出本次运行的JSON摘要：所有指标的快照加上调用方提供的字段"""
+    summary = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), **extra, 'metrics': REGISTRY.snapshot()}
+    atomic_write(path, json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = REGISTRY.render(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/summary':
+            summary = {**REGISTRY.snapshot(), 'sources': SOURCES}
+            body, content_type = json.dumps(summary, ensure_ascii=False), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """在后台线程中提供 /metrics（Prometheus文本）和 /summary（JSON，含各订阅的URL与产出）"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'指标服务已启动: http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,155 @@
+# 协议类型 -> 记录类
+MODELS = {}
+
+
+class Proxy:
+    """代理节点记录基类：使用 __slots__ 存储，各协议子类在 FIELDS 中声明自己的字段
+
+    identity 为节点的规范身份（协议、地址、端口及协议相关的认证/传输字段），
+    去重和哈希都基于它；name、rtt、geo 等展示或测试结果不参与身份。
+    """
+
+    __slots__ = ('host', 'port', 'name', 'rtt', 'geo', '_identity')
+    type = ''
+    transport = 'tcp'  # 承载协议：udp 的节点（QUIC）无法用TCP建连探测
+    FIELDS = ()      # 协议特有字段：((字段名, 默认值), ...)
+    IDENTITY = ()    # 参与身份的协议特有字段
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.type:
+            MODELS[cls.type] = cls
+
+    def __init__(self, host, port, name='', rtt=None, geo=None, **fields):
+        self.host = host
+        self.port = int(port)
+        self.name = name
+        self.rtt = rtt
+        self.geo = geo  # 离线IP库查到的 {'country', 'asn', 'as_name', 'hosting'}
+        self._identity = None
+        for field, default in self.FIELDS:
+            setattr(self, field, fields.get(field, default))
+
+    @property
+    def identity(self):
+        """首次访问时计算并缓存；修改身份字段（如规范化地址）后须调用 reset_identity"""
+        if self._identity is None:
+            self._identity = (self.type, self.host, self.port) + tuple(getattr(self, f) for f in self.IDENTITY)
+        return self._identity
+
+    def reset_identity(self):
+        self._identity = None
+
+    @property
+    def endpoint(self):
+        return f'{self.host}:{self.port}'
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def __eq__(self, other):
+        return isinstance(other, Proxy) and self.identity == other.identity
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.endpoint} {self.name!r}>'
+
+    def to_dict(self):
+        """按固定字段顺序输出，作为稳定的JSON序列化格式"""
+        data = {'type': self.type, 'host': self.host, 'port': self.port}
+        for field, _ in self.FIELDS:
+            data[field] = getattr(self, field)
+        data['name'] = self.name
+        if self.rtt is not None:
+            data['rtt'] = self.rtt
+        if self.geo is not None:
+            data['geo'] = self.geo
+        return data
+
+    def to_tuple(self):
+        """紧凑的元组形式 (type, host, port, name, 各字段值...)，用于跨进程传输"""
+        return (self.type, self.host, self.port, self.name) + tuple(getattr(self, field) for field, _ in self.FIELDS)
+
+
+class VmessProxy(Proxy):
+    type = 'vmess'
+    FIELDS = (('id', ''), ('aid', 0), ('net', 'tcp'), ('path', ''), ('host_header', ''), ('tls', ''))
+    IDENTITY = ('id', 'net', 'path', 'host_header', 'tls')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class VlessProxy(Proxy):
+    type = 'vless'
+    FIELDS = (('id', ''), ('net', 'tcp'), ('path', ''), ('host_header', ''), ('tls', ''), ('sni', ''), ('flow', ''))
+    IDENTITY = ('id', 'net', 'path', 'host_header', 'tls', 'sni')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class SSProxy(Proxy):
+    type = 'ss'
+    FIELDS = (('method', ''), ('password', ''))
+    IDENTITY = ('method', 'password')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class SSRProxy(Proxy):
+    type = 'ssr'
+    FIELDS = (('protocol', ''), ('method', ''), ('obfs', ''), ('password', ''),
+              ('protocol_param', ''), ('obfs_param', ''))
+    IDENTITY = ('protocol', 'method', 'obfs', 'password', 'protocol_param')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class TrojanProxy(Proxy):
+    type = 'trojan'
+    FIELDS = (('password', ''), ('sni', ''), ('net', 'tcp'), ('path', ''))
+    IDENTITY = ('password', 'sni', 'net', 'path')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class Hysteria2Proxy(Proxy):
+    type = 'hysteria2'
+    transport = 'udp'
+    FIELDS = (('password', ''), ('sni', ''), ('obfs', ''), ('obfs_password', ''), ('insecure', False))
+    IDENTITY = ('password', 'sni', 'obfs', 'obfs_password')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+class TuicProxy(Proxy):
+    type = 'tuic'
+    transport = 'udp'
+    FIELDS = (('id', ''), ('password', ''), ('sni', ''), ('congestion_control', ''), ('alpn', ''))
+    IDENTITY = ('id', 'password', 'sni')
+    __slots__ = tuple(field for field, _ in FIELDS)
+
+
+def from_dict(data):
+    """从 to_dict() 的结果（或旧版 collected_proxies.json 中的字典）还原记录"""
+    cls = MODELS.get(data.get('type'))
+    if cls is None:
+        return None
+    data = dict(data)
+    data.pop('type')
+    # 旧版vmess记录用 ps 保存名称
+    if 'ps' in data:
+        data.setdefault('name', data.pop('ps'))
+    return cls(**data)
+
+
+def from_tuple(record):
+    """从 to_tuple() 的结果还原记录"""
+    cls = MODELS[record[0]]
+    return cls(record[1], record[2], record[3], **{field: value for (field, _), value in zip(cls.FIELDS, record[4:])})
+
+
+def object_hook(data):
+    """json.loads 的 object_hook：带 type 字段的对象还原为记录"""
+    if 'type' in data and data['type'] in MODELS:
+        return from_dict(data)
+    return data
+
+
+def to_json(proxy):
+    """json.dumps 的 default：把记录序列化为字典"""
+    if isinstance(proxy, Proxy):
+        return proxy.to_dict()
+    raise TypeError(f'Object of type {proxy.__class__.__name__} is not JSON serializable')
@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+import time
+
+
+def atomic_write(path, text):
+    """先写入同目录下的临时文件再原子替换，读取方永远不会读到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # mkstemp 创建的文件只有属主可读，沿用原文件的权限（新文件为 0644），其他进程才能读取导出结果
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def save_proxies(path, proxies):
+    """保存可用代理列表（collected_proxies.json 格式）"""
+    result = {
+        'update_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'count': len(proxies),
+        'proxies': [proxy.to_dict() for proxy in proxies],
+        'source': 'collectSub-tested'
+    }
+    atomic_write(path, json.dumps(result, ensure_ascii=False, indent=2))
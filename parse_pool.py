@@ -0,0 +1,78 @@
+import asyncio
+import atexit
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from models import from_tuple
+from metrics import PARSE_FAILURES
+
+# 小于该大小的订阅直接在本进程解码，跨进程传输的开销比解码本身还大
+MIN_BYTES = 256 * 1024
+# 每次交给工作进程的原始数据量，主进程同时最多为一个订阅缓存这么多
+BATCH_BYTES = 1024 * 1024
+
+
+def decode_batch(decoder, chunks, final):
+    """工作进程入口：接着上一批留下的解码器状态解一批数据块
+
+    返回 (解码器, 紧凑记录列表, 解码耗时, 解析失败计数)；解码器随结果传回，下一批接着用。
+    """
+    PARSE_FAILURES.values.clear()
+    start = time.process_time()
+    records = []
+    for chunk in chunks:
+        records.extend(proxy.to_tuple() for proxy in decoder.feed(chunk))
+    if final:
+        records.extend(proxy.to_tuple() for proxy in decoder.close())
+    return decoder, records, time.process_time() - start, dict(PARSE_FAILURES.values)
+
+
+class ParsePool:
+    """多进程解码/解析：Base64解码、vmess 的 json.loads 等CPU密集工作分摊到多个核上
+
+    抓取仍在事件循环中进行，较大的订阅边下载边按 batch_bytes 分批交给工作进程，解码器状态随每批往返，
+    工作进程返回紧凑的元组记录，主进程只负责还原对象，不再与下载争抢GIL，内存占用也不随订阅大小增长。
+    解码器要能被 pickle（stream_parse.StreamDecoder 配合模块级的解析函数即可）。
+    """
+
+    def __init__(self, workers=None, min_bytes=MIN_BYTES, batch_bytes=BATCH_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_bytes = min_bytes
+        self.batch_bytes = batch_bytes
+        # spawn 启动的工作进程不继承父进程的线程和事件循环状态
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    async def decode(self, decoder, chunks, final=False):
+        """在工作进程中接着 decoder 的状态解一批数据块，返回 (接续用的解码器, [proxy], 解码耗时)；final 表示最后一批"""
+        loop = asyncio.get_running_loop()
+        decoder, records, cpu_time, failures = await loop.run_in_executor(self.executor, decode_batch,
+                                                                          decoder, chunks, final)
+        for key, count in failures.items():
+            PARSE_FAILURES.values[key] = PARSE_FAILURES.values.get(key, 0) + count
+        return decoder, [from_tuple(record) for record in records], cpu_time
+
+
+def default_pool():
+    """多核机器上返回 ParsePool，单核时返回 None（跨进程只会增加开销）"""
+    return ParsePool() if (os.cpu_count() or 1) > 1 else None
+
+
+@functools.lru_cache(maxsize=None)
+def shared_pool():
+    """进程内共享的 ParsePool：首次调用时创建，之后多次 collect 复用同一批工作进程，解释器退出时关闭"""
+    pool = default_pool()
+    if pool:
+        atexit.register(pool.close)
+    return pool
@@ -0,0 +1,320 @@
+import base64
+import json
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import yaml
+
+from models import (VmessProxy, VlessProxy, SSProxy, SSRProxy, TrojanProxy,
+                    Hysteria2Proxy, TuicProxy)
+from metrics import PARSE_FAILURES
+
+# 协议解析器注册表：URI scheme -> 解析函数，解析函数接收 "://" 之后的部分
+PARSERS = {}
+# Clash proxies 条目的转换函数：type -> 转换函数
+CLASH_CONVERTERS = {}
+
+# 解析失败时可能抛出的异常（binascii.Error / JSONDecodeError / UnicodeDecodeError 都是 ValueError 子类）
+PARSE_ERRORS = (ValueError, TypeError, AttributeError, KeyError, IndexError)
+
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def register(*schemes):
+    """注册URI解析器，一个解析器可以对应多个 scheme"""
+    def decorator(func):
+        for scheme in schemes:
+            PARSERS[scheme] = func
+        return func
+    return decorator
+
+
+def register_clash(*types):
+    """注册 Clash proxies 条目转换器"""
+    def decorator(func):
+        for proxy_type in types:
+            CLASH_CONVERTERS[proxy_type] = func
+        return func
+    return decorator
+
+
+def parse_line(line):
+    """按 scheme 一次分派解析一行节点链接，无法识别时返回 None"""
+    scheme, sep, rest = line.partition('://')
+    if not sep:
+        return None
+    scheme = scheme.lower()
+    parser = PARSERS.get(scheme)
+    if parser is None:
+        PARSE_FAILURES.inc(scheme='unsupported')
+        return None
+    try:
+        proxy = parser(rest)
+    except PARSE_ERRORS:
+        proxy = None
+    if proxy and proxy.host and proxy.port:
+        return proxy
+    PARSE_FAILURES.inc(scheme=scheme)
+    return None
+
+
+def parse_clash_proxy(item):
+    """转换 Clash 配置中 proxies 下的一个条目"""
+    if not isinstance(item, dict):
+        return None
+    converter = CLASH_CONVERTERS.get(str(item.get('type', '')).lower())
+    if converter is None:
+        return None
+    try:
+        proxy = converter(item)
+    except PARSE_ERRORS:
+        return None
+    if proxy and proxy.host and proxy.port:
+        return proxy
+    return None
+
+
+def parse_clash(text):
+    """解析完整的 Clash YAML 文档（如 clash_config.yaml），返回代理列表"""
+    data = yaml.load(text, Loader=YAML_LOADER)
+    items = data.get('proxies') if isinstance(data, dict) else None
+    return [proxy for proxy in map(parse_clash_proxy, items or []) if proxy]
+
+
+def b64decode_text(data):
+    """宽松的Base64解码：自动补齐填充，兼容URL安全字符"""
+    data = data.strip().replace('-', '+').replace('_', '/')
+    return base64.b64decode(data + '=' * (-len(data) % 4)).decode('utf-8')
+
+
+def split_url(rest):
+    """把 "://" 之后的部分解析为 (url, query, name)"""
+    url = urlsplit('//' + rest)
+    query = {k: v[0] for k, v in parse_qs(url.query).items()}
+    return url, query, unquote(url.fragment)
+
+
+@register('vmess')
+def parse_vmess(rest):
+    """解析vmess链接"""
+    config = json.loads(b64decode_text(rest))
+    return VmessProxy(
+        host=config.get('add', ''),
+        port=int(config.get('port', 0)),
+        id=config.get('id', ''),
+        aid=int(config.get('aid', 0) or 0),
+        net=config.get('net', 'tcp'),
+        path=config.get('path', ''),
+        host_header=config.get('host', ''),
+        tls=config.get('tls', ''),
+        name=config.get('ps', '')
+    )
+
+
+@register('ss')
+def parse_ss(rest):
+    """解析ss链接，支持 SIP002 与整段Base64两种格式"""
+    body, _, name = rest.partition('#')
+    body = body.split('/?', 1)[0].split('?', 1)[0]
+    if '@' not in body:
+        # ss://base64(method:password@host:port)#name
+        body = b64decode_text(body)
+    method_pass, host_port = body.rsplit('@', 1)
+    if ':' not in method_pass:
+        # SIP002: ss://base64(method:password)@host:port#name
+        method_pass = b64decode_text(method_pass)
+    method, password = method_pass.split(':', 1)
+    url = urlsplit('//' + host_port)
+    return SSProxy(
+        host=url.hostname,
+        port=url.port,
+        method=method,
+        password=password,
+        name=unquote(name)
+    )
+
+
+@register('ssr')
+def parse_ssr(rest):
+    """解析ssr链接：ssr://base64(host:port:protocol:method:obfs:base64(password)/?params)"""
+    main_part, _, params = b64decode_text(rest).partition('/?')
+    host, port, protocol, method, obfs, password = main_part.rsplit(':', 5)
+    query = {k: b64decode_text(v[0]) for k, v in parse_qs(params).items()}
+    return SSRProxy(
+        host=host.strip('[]'),
+        port=int(port),
+        protocol=protocol,
+        method=method,
+        obfs=obfs,
+        password=b64decode_text(password),
+        protocol_param=query.get('protoparam', ''),
+        obfs_param=query.get('obfsparam', ''),
+        name=query.get('remarks', '')
+    )
+
+
+@register('trojan')
+def parse_trojan(rest):
+    """解析trojan链接"""
+    url, query, name = split_url(rest)
+    return TrojanProxy(
+        host=url.hostname,
+        port=url.port,
+        password=unquote(url.username or ''),
+        sni=query.get('sni', query.get('peer', '')),
+        net=query.get('type', 'tcp'),
+        path=query.get('path', ''),
+        name=name
+    )
+
+
+@register('vless')
+def parse_vless(rest):
+    """解析vless链接"""
+    url, query, name = split_url(rest)
+    return VlessProxy(
+        host=url.hostname,
+        port=url.port,
+        id=unquote(url.username or ''),
+        net=query.get('type', 'tcp'),
+        path=query.get('path', query.get('serviceName', '')),
+        host_header=query.get('host', ''),
+        tls=query.get('security', ''),
+        sni=query.get('sni', ''),
+        flow=query.get('flow', ''),
+        name=name
+    )
+
+
+@register('hysteria2', 'hy2')
+def parse_hysteria2(rest):
+    """解析hysteria2链接"""
+    url, query, name = split_url(rest)
+    auth = unquote(url.username or '')
+    if url.password:
+        auth += ':' + unquote(url.password)
+    return Hysteria2Proxy(
+        host=url.hostname,
+        port=url.port or 443,
+        password=auth,
+        sni=query.get('sni', ''),
+        obfs=query.get('obfs', ''),
+        obfs_password=query.get('obfs-password', ''),
+        insecure=query.get('insecure', '0') == '1',
+        name=name
+    )
+
+
+@register('tuic')
+def parse_tuic(rest):
+    """解析tuic链接"""
+    url, query, name = split_url(rest)
+    return TuicProxy(
+        host=url.hostname,
+        port=url.port,
+        id=unquote(url.username or ''),
+        password=unquote(url.password or ''),
+        sni=query.get('sni', ''),
+        congestion_control=query.get('congestion_control', ''),
+        alpn=query.get('alpn', ''),
+        name=name
+    )
+
+
+@register_clash('vmess')
+def clash_vmess(item):
+    opts = item.get('ws-opts') or {}
+    return VmessProxy(
+        host=item['server'],
+        port=int(item['port']),
+        id=item.get('uuid', ''),
+        aid=int(item.get('alterId', 0) or 0),
+        net=item.get('network', 'tcp'),
+        path=opts.get('path', ''),
+        host_header=(opts.get('headers') or {}).get('Host', ''),
+        tls='tls' if item.get('tls') else '',
+        name=item.get('name', '')
+    )
+
+
+@register_clash('ss')
+def clash_ss(item):
+    return SSProxy(
+        host=item['server'],
+        port=int(item['port']),
+        method=item.get('cipher', ''),
+        password=str(item.get('password', '')),
+        name=item.get('name', '')
+    )
+
+
+@register_clash('ssr')
+def clash_ssr(item):
+    return SSRProxy(
+        host=item['server'],
+        port=int(item['port']),
+        protocol=item.get('protocol', ''),
+        method=item.get('cipher', ''),
+        obfs=item.get('obfs', ''),
+        password=str(item.get('password', '')),
+        protocol_param=item.get('protocol-param', ''),
+        obfs_param=item.get('obfs-param', ''),
+        name=item.get('name', '')
+    )
+
+
+@register_clash('trojan')
+def clash_trojan(item):
+    return TrojanProxy(
+        host=item['server'],
+        port=int(item['port']),
+        password=str(item.get('password', '')),
+        sni=item.get('sni', ''),
+        net=item.get('network', 'tcp'),
+        path=(item.get('ws-opts') or {}).get('path', ''),
+        name=item.get('name', '')
+    )
+
+
+@register_clash('vless')
+def clash_vless(item):
+    opts = item.get('ws-opts') or {}
+    return VlessProxy(
+        host=item['server'],
+        port=int(item['port']),
+        id=item.get('uuid', ''),
+        net=item.get('network', 'tcp'),
+        path=opts.get('path', ''),
+        host_header=(opts.get('headers') or {}).get('Host', ''),
+        tls='reality' if item.get('reality-opts') else ('tls' if item.get('tls') else ''),
+        sni=item.get('servername', ''),
+        flow=item.get('flow', ''),
+        name=item.get('name', '')
+    )
+
+
+@register_clash('hysteria2')
+def clash_hysteria2(item):
+    return Hysteria2Proxy(
+        host=item['server'],
+        port=int(item['port']),
+        password=str(item.get('password', '')),
+        sni=item.get('sni', ''),
+        obfs=item.get('obfs', ''),
+        obfs_password=item.get('obfs-password', ''),
+        insecure=bool(item.get('skip-cert-verify')),
+        name=item.get('name', '')
+    )
+
+
+@register_clash('tuic')
+def clash_tuic(item):
+    return TuicProxy(
+        host=item['server'],
+        port=int(item['port']),
+        id=item.get('uuid', ''),
+        password=str(item.get('password', '')),
+        sni=item.get('sni', ''),
+        congestion_control=item.get('congestion-controller', ''),
+        alpn=','.join(item.get('alpn') or []),
+        name=item.get('name', '')
+    )
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+
+def raise_nofile_limit(wanted):
+    """尽量把进程可打开的文件数提高到 wanted，返回实际可用的上限"""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft >= wanted:
+        return soft
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        return target
+    except (ValueError, OSError):
+        return soft
+
+
+class TCPProber:
+    """非阻塞TCP连通性探测：成千上万个连接同时在途，并记录建连耗时"""
+
+    def __init__(self, concurrency=1000, timeout=5):
+        # 给日志、抓取等留出余量，避免文件描述符耗尽
+        limit = raise_nofile_limit(concurrency + 256)
+        self.concurrency = max(1, min(concurrency, limit - 256))
+        self.timeout = timeout
+
+    async def connect(self, host, port, timeout=None):
+        """建立连接后立即关闭，返回建连耗时(毫秒)；失败抛出 OSError / asyncio.TimeoutError"""
+        start = time.perf_counter()
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port),
+                                           timeout or self.timeout)
+        rtt = (time.perf_counter() - start) * 1000
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return rtt
+
+    async def probe(self, host, port, timeout=None):
+        """探测单个地址，成功返回建连耗时(毫秒)，失败返回 None"""
+        try:
+            return await self.connect(host, port, timeout)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def probe_all(self, proxies, on_result=None, resolved=None):
+        """并发探测所有代理，返回 [(proxy, rtt)]（按完成顺序），失败的 rtt 为 None
+
+        resolved 为预先解析好的 {主机名: IP}，提供时直接连接IP，探测中不再做DNS查询。
+        """
+        resolved = resolved or {}
+        results = []
+        pending = iter(proxies)
+
+        # 固定数量的worker从同一个迭代器取任务，在途连接数恒定且不会为每个代理预建task
+        async def worker():
+            for proxy in pending:
+                rtt = await self.probe(resolved.get(proxy.host, proxy.host), proxy.port)
+                results.append((proxy, rtt))
+                if on_result:
+                    on_result(proxy, rtt)
+
+        workers = min(self.concurrency, len(proxies))
+        logger.debug(f'探测 {len(proxies)} 个地址，并发 {workers}，超时 {self.timeout}s')
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
@@ -7,6 +7,12 @@ import time
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from models import from_dict
+from output import atomic_write
+
+# 单个代理最多的候选格式数（ss 有4种），共享的格式测试线程池按它确定大小
+MAX_FORMATS = 4
+
 class ProxyToHTTP:
     def __init__(self, input_file='collected_proxies.json'):
         self.input_file = input_file
@@ -21,16 +27,16 @@ class ProxyToHTTP:
         try:
             with open(self.input_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                return data.get('proxies', [])
+                return [proxy for proxy in map(from_dict, data.get('proxies', [])) if proxy]
         except Exception as e:
             print(f"❌ 加载代理文件失败: {e}")
             return []
     
     def convert_to_http_proxy(self, proxy):
         """尝试将代理转换为HTTP代理格式"""
-        host = proxy.get('host')
-        port = proxy.get('port')
-        proxy_type = proxy.get('type', '').lower()
+        host = proxy.host
+        port = proxy.port
+        proxy_type = proxy.type
         
         if not host or not port:
             return None
@@ -42,10 +48,10 @@ class ProxyToHTTP:
         http_formats.append(f"http://{host}:{port}")
         
         # 2. 如果有认证信息，尝试加上
-        if proxy_type == 'ss' and proxy.get('password'):
+        if proxy_type == 'ss' and proxy.password:
             # SS代理有时可以直接当HTTP代理用
-            password = proxy.get('password')
-            method = proxy.get('method', '')
+            password = proxy.password
+            method = proxy.method
             # 尝试用户名:密码格式
             http_formats.append(f"http://{method}:{password}@{host}:{port}")
             http_formats.append(f"http://user:{password}@{host}:{port}")
@@ -54,13 +60,13 @@ class ProxyToHTTP:
         http_formats.append(f"socks5://{host}:{port}")
         
         # 4. 如果是trojan，尝试用密码作为认证
-        if proxy_type == 'trojan' and proxy.get('password'):
-            password = proxy.get('password')
+        if proxy_type == 'trojan' and proxy.password:
+            password = proxy.password
             http_formats.append(f"http://{password}@{host}:{port}")
         
         return http_formats
     
-    def test_http_proxy(self, proxy_url, timeout=10):
+    def test_http_proxy(self, proxy_url, timeout=10, session=None):
         """测试HTTP代理是否可用"""
         try:
             proxies = {
@@ -71,7 +77,7 @@ class ProxyToHTTP:
             # 随机选择测试URL
             test_url = random.choice(self.test_urls)
             
-            response = requests.get(
+            response = (session or requests).get(
                 test_url,
                 proxies=proxies,
                 timeout=timeout,
@@ -97,37 +103,45 @@ class ProxyToHTTP:
         except Exception as e:
             return False, str(e)
     
-    def test_proxy_formats(self, proxy):
-        """测试代理的各种HTTP格式"""
+    def test_proxy_formats(self, proxy, executor, timeout=10):
+        """在共享线程池 executor 中并发尝试代理的各种HTTP格式，第一个成功的格式胜出，其余立即放弃"""
         formats = self.convert_to_http_proxy(proxy)
         if not formats:
             return None
         
-        host = proxy.get('host')
-        port = proxy.get('port')
-        proxy_type = proxy.get('type')
-        
-        print(f"🔍 测试代理: {host}:{port} ({proxy_type})")
-        
-        for i, proxy_url in enumerate(formats, 1):
-            print(f"  [{i}] 尝试格式: {proxy_url}")
-            
-            success, result = self.test_http_proxy(proxy_url)
-            
-            if success:
-                print(f"  ✅ 成功! 代理IP: {result}")
-                return {
-                    'original': proxy,
-                    'http_proxy': proxy_url,
-                    'proxy_ip': result,
-                    'host': host,
-                    'port': port,
-                    'type': proxy_type
-                }
-            else:
-                print(f"  ❌ 失败: {result}")
-        
-        print(f"  💀 所有格式都失败")
+        host = proxy.host
+        port = proxy.port
+        proxy_type = proxy.type
+        
+        # 每个候选格式一个会话，请求结束（或被取消）后才关闭：落败的请求可能仍在使用它的连接
+        start = time.perf_counter()
+        futures = {}
+        for proxy_url in formats:
+            session = requests.Session()
+            future = executor.submit(self.test_http_proxy, proxy_url, timeout, session)
+            future.add_done_callback(lambda _, session=session: session.close())
+            futures[future] = proxy_url
+        try:
+            for future in as_completed(futures):
+                success, result = future.result()
+                if success:
+                    proxy_url = futures[future]
+                    print(f"✅ {host}:{port} ({proxy_type}) 格式 {proxy_url} 可用，代理IP: {result}")
+                    return {
+                        'original': proxy.to_dict(),
+                        'http_proxy': proxy_url,
+                        'proxy_ip': result,
+                        'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+                        'host': host,
+                        'port': port,
+                        'type': proxy_type
+                    }
+        finally:
+            # 尚未开始的候选直接取消，已在运行的由超时结束
+            for future in futures:
+                future.cancel()
+        
+        print(f"❌ {host}:{port} ({proxy_type}) 所有格式都失败")
         return None
     
     def convert_all_to_http(self, max_workers=10, max_test=20):
@@ -146,17 +160,14 @@ class ProxyToHTTP:
         
         working_http_proxies = []
         
-        # 单线程测试（避免并发问题）
-        for i, proxy in enumerate(test_proxies, 1):
-            print(f"\n[{i}/{len(test_proxies)}] " + "="*50)
-            
-            result = self.test_proxy_formats(proxy)
-            if result:
-                working_http_proxies.append(result)
-                print(f"🎉 找到可用HTTP代理: {result['http_proxy']}")
-            
-            # 避免请求过快
-            time.sleep(random.uniform(2, 4))
+        # 多个代理并行测试，每个代理内部的候选格式在同一个共享线程池中同时竞速
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=max_workers * MAX_FORMATS) as format_executor:
+            futures = [executor.submit(self.test_proxy_formats, proxy, format_executor) for proxy in test_proxies]
+            for future in as_completed(futures):
+                result = future.result()
+                if result:
+                    working_http_proxies.append(result)
         
         print("\n" + "="*80)
         print(f"📈 转换结果:")
@@ -170,6 +181,7 @@ class ProxyToHTTP:
                 http_proxy_list.append({
                     'proxy_url': proxy['http_proxy'],
                     'proxy_ip': proxy['proxy_ip'],
+                    'latency_ms': proxy['latency_ms'],  # 经该代理完成一次测试请求的耗时，网关用作初始权重
                     'host': proxy['host'],
                     'port': proxy['port'],
                     'original_type': proxy['type']
@@ -182,15 +194,13 @@ class ProxyToHTTP:
                 'http_proxies': http_proxy_list
             }
             
-            with open('http_proxies.json', 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+            atomic_write('http_proxies.json', json.dumps(result, indent=2, ensure_ascii=False))
             
             print(f"💾 HTTP代理列表已保存到 http_proxies.json")
             
             # 生成简单的代理URL列表
             proxy_urls = [p['proxy_url'] for p in http_proxy_list]
-            with open('proxy_urls.txt', 'w', encoding='utf-8') as f:
-                f.write('\n'.join(proxy_urls))
+            atomic_write('proxy_urls.txt', '\n'.join(proxy_urls))
             
             print(f"📄 代理URL列表已保存到 proxy_urls.txt")
             
@@ -216,5 +226,9 @@ class ProxyToHTTP:
             print("😞 没有找到可用的HTTP代理")
 
 if __name__ == "__main__":
+    from settings import load_settings
+
+    options = load_settings()['tester']
     converter = ProxyToHTTP()
-    converter.convert_all_to_http(max_test=10)  # 测试前10个代理
+    # 并行测试前 convert_max_test 个代理（config.yaml 的 tester 节）
+    converter.convert_all_to_http(max_workers=options['convert_max_workers'], max_test=options['convert_max_test'])
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import bisect
+import heapq
+import json
+import os
+import time
+
+from aiohttp import web
+from loguru import logger
+
+from dedup import identity_digest
+from models import from_dict
+
+# 可过滤的等值字段：字段名 -> 从节点取值的函数；取值都很少，按各字段取值的组合分组建索引
+TLS_TYPES = ('trojan', 'hysteria2', 'tuic')  # 这些协议总是走TLS/QUIC
+INDEXED_FIELDS = {
+    'type': lambda proxy: proxy.type,
+    'net': lambda proxy: getattr(proxy, 'net', 'tcp') or 'tcp',
+    'tls': lambda proxy: '1' if proxy.type in TLS_TYPES or getattr(proxy, 'tls', '') else '0',
+    'country': lambda proxy: proxy.geo['country'] if proxy.geo else '',  # 需要离线IP库，见 geoip.py
+}
+MAX_LIMIT = 1000
+
+
+def group_of(proxy):
+    return tuple(value_of(proxy) for value_of in INDEXED_FIELDS.values())
+
+
+def tail(ranked, start):
+    """从 start 开始惰性遍历有序列表（切片会复制整个尾部）"""
+    return (ranked[i] for i in range(start, len(ranked)))
+
+
+class PoolIndex:
+    """可用节点池的内存索引，节点验证时增量维护，查询只访问命中的部分
+
+    ranked 是按 (延迟, 键) 排序的全局列表；每个 (协议, 传输, TLS, 国家) 组合另有一个同样排序的列表。
+    查询时只取满足等值条件的组合做有序合并，按延迟顺序凑满 limit 条或超过 max_rtt 即停止，
+    条件组合没有任何节点时不需要扫描；游标是上一页最后一条的 (延迟, 键)，翻页用二分直接定位。
+    """
+
+    def __init__(self):
+        self.entries = {}   # 键 -> (延迟, 验证时间, 节点, 所在组合)
+        self.ranked = []    # [(延迟, 键)]
+        self.groups = {}    # (协议, 传输, TLS, 国家) -> [(延迟, 键)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, proxy, rtt, verified=None):
+        """记录一个验证通过的节点（已存在时更新延迟和验证时间）"""
+        key = identity_digest(proxy).hex()
+        self.remove_key(key)
+        item = (rtt, key)
+        group = group_of(proxy)
+        bisect.insort(self.ranked, item)
+        bisect.insort(self.groups.setdefault(group, []), item)
+        # 记下加入时的组合：节点的地区信息可能在之后被更新
+        self.entries[key] = (rtt, verified or time.time(), proxy, group)
+
+    def remove(self, proxy):
+        self.remove_key(identity_digest(proxy).hex())
+
+    def remove_key(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        item = (entry[0], key)
+        group = self.groups[entry[3]]
+        for ranked in (self.ranked, group):
+            del ranked[bisect.bisect_left(ranked, item)]
+
+    def replace(self, proxies, verified=None):
+        """用一批节点（如 collected_proxies.json 的内容）整体重建索引，先追加再统一排序"""
+        verified = verified or time.time()
+        self.entries, self.ranked, self.groups = {}, [], {}
+        for proxy in proxies:
+            if proxy.rtt is not None:
+                self.entries[identity_digest(proxy).hex()] = (proxy.rtt, verified, proxy, group_of(proxy))
+        for key, (rtt, _, _, group) in self.entries.items():
+            self.ranked.append((rtt, key))
+            self.groups.setdefault(group, []).append((rtt, key))
+        for ranked in (self.ranked, *self.groups.values()):
+            ranked.sort()
+
+    def query(self, filters=None, max_rtt=None, max_age=None, limit=50, cursor=None, now=None):
+        """按条件查询，返回 (节点条目列表, 下一页游标)
+
+        filters 为 {字段: 取值集合}（字段见 INDEXED_FIELDS），cursor 为上一页返回的 (延迟, 键)。
+        """
+        wanted = [set(filters.get(field) or ()) for field in INDEXED_FIELDS] if filters else []
+        if any(wanted):
+            lists = [ranked for group, ranked in self.groups.items()
+                     if ranked and all(not values or value in values for value, values in zip(group, wanted))]
+        else:
+            lists = [self.ranked]
+        now = now or time.time()
+        tails = [tail(ranked, bisect.bisect_right(ranked, cursor) if cursor else 0) for ranked in lists]
+        results = []
+        for rtt, key in heapq.merge(*tails) if len(tails) != 1 else tails[0]:
+            if max_rtt is not None and rtt > max_rtt:
+                break
+            _, verified, proxy, _ = self.entries[key]
+            if max_age is not None and now - verified > max_age:
+                continue
+            results.append((key, rtt, verified, proxy))
+            if len(results) >= limit:
+                return results, (rtt, key)
+        return results, None
+
+    def stats(self):
+        """节点总数及各协议/传输/TLS/国家 取值的节点数"""
+        stats = {'count': len(self.entries), **{field: {} for field in INDEXED_FIELDS}}
+        for group, ranked in self.groups.items():
+            for field, value in zip(INDEXED_FIELDS, group):
+                if ranked:
+                    stats[field][value] = stats[field].get(value, 0) + len(ranked)
+        return stats
+
+
+def encode_cursor(cursor):
+    return f'{cursor[0]!r}~{cursor[1]}' if cursor else None
+
+
+def decode_cursor(text):
+    rtt, _, key = text.partition('~')
+    return float(rtt), key
+
+
+def parse_param(params, name, convert, message):
+    """取出并转换一个可选参数，非法时抛出只含参数名的 ValueError（不把内部异常文本返回给调用方）"""
+    if not params.get(name):
+        return None
+    try:
+        return convert(params[name])
+    except ValueError:
+        raise ValueError(f'{name} {message}') from None
+
+
+def parse_query(params):
+    """把URL查询参数转换为 PoolIndex.query 的参数，取值非法时抛出 ValueError"""
+    filters = {field: set(params[field].split(',')) for field in INDEXED_FIELDS if params.get(field)}
+    if 'tls' in filters:
+        filters['tls'] = {'1' if value.lower() in ('1', 'true', 'yes') else '0' for value in filters['tls']}
+    if 'country' in filters:
+        filters['country'] = {value.upper() for value in filters['country']}
+    limit = parse_param(params, 'limit', int, '必须为整数')
+    return {
+        'filters': filters,
+        'max_rtt': parse_param(params, 'max_rtt', float, '必须为数字'),
+        'max_age': parse_param(params, 'max_age', float, '必须为数字'),
+        'limit': 50 if limit is None else max(1, min(limit, MAX_LIMIT)),
+        'cursor': parse_param(params, 'cursor', decode_cursor, '无效'),
+    }
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+class QueryAPI:
+    """节点池查询服务（aiohttp，与采集共用同一个事件循环，索引无需加锁）
+
+    GET /proxies?type=vmess,vless&net=ws&tls=1&country=HK,JP&max_rtt=200&max_age=600&limit=50&cursor=...
+        按延迟从低到高返回，next 为下一页游标（没有更多结果时为 null）
+    GET /stats  各协议/传输/TLS/国家 的节点数
+    """
+
+    def __init__(self, index, reload=None):
+        self.index = index
+        self.reload = reload  # 每次请求前调用，用于从文件加载时检查更新
+        self.app = web.Application()
+        self.app.router.add_get('/proxies', self.proxies)
+        self.app.router.add_get('/stats', self.stats)
+        self.runner = None
+
+    async def proxies(self, request):
+        if self.reload:
+            self.reload()
+        try:
+            query = parse_query(request.query)
+        except ValueError as e:
+            return json_response({'error': f'参数错误: {e}'}, status=400)
+        now = time.time()
+        results, last = self.index.query(now=now, **query)
+        return json_response({
+            'count': len(results),
+            'next': encode_cursor(last),
+            'proxies': [{**proxy.to_dict(), 'rtt': rtt, 'key': key, 'age': round(now - verified, 1)}
+                        for key, rtt, verified, proxy in results],
+        })
+
+    async def stats(self, request):
+        if self.reload:
+            self.reload()
+        return json_response(self.index.stats())
+
+    async def start(self, port, host='127.0.0.1'):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f'节点查询服务已启动: http://{host}:{port}/proxies')
+
+    async def close(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class FileLoader:
+    """独立运行时从 collected_proxies.json 加载节点池，文件变化后自动重建索引"""
+
+    def __init__(self, path, index):
+        self.path = path
+        self.index = index
+        self.mtime = None
+
+    def __call__(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        self.index.replace([proxy for proxy in map(from_dict, data.get('proxies', [])) if proxy], verified=mtime)
+        logger.info(f'已加载 {len(self.index)} 个节点')
+
+
+async def serve_file(path, port, host):
+    index = PoolIndex()
+    loader = FileLoader(path, index)
+    loader()
+    api = QueryAPI(index, reload=loader)
+    await api.start(port, host)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await api.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='节点池查询服务')
+    parser.add_argument('--pool', default='collected_proxies.json', help='节点文件，变化后自动重新加载')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+    asyncio.run(serve_file(args.pool, args.port, args.host))
@@ -0,0 +1,61 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from loguru import logger
+
+from metrics import DNS_LOOKUPS
+
+
+class DNSCache:
+    """带TTL的异步DNS缓存：相同主机名只解析一次，解析失败（NXDOMAIN、超时）也会缓存一段时间"""
+
+    def __init__(self, ttl=300, negative_ttl=60, concurrency=200, timeout=5):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.entries = {}    # 主机名 -> (过期时间, IP 或 None)
+        self.inflight = {}   # 主机名 -> 正在进行的解析
+
+    async def resolve(self, host):
+        """解析为IP字面量，失败返回 None"""
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+        entry = self.entries.get(host)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        future = self.inflight.get(host)
+        if future is None:
+            future = self.inflight[host] = asyncio.ensure_future(self.lookup(host))
+            future.add_done_callback(lambda _: self.inflight.pop(host, None))
+        return await asyncio.shield(future)
+
+    async def lookup(self, host):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, None, type=socket.SOCK_STREAM), self.timeout)
+            ip = infos[0][4][0] if infos else None
+        except (OSError, asyncio.TimeoutError, UnicodeError):
+            ip = None
+        DNS_LOOKUPS.inc(result='ok' if ip else 'failed')
+        self.entries[host] = (time.monotonic() + (self.ttl if ip else self.negative_ttl), ip)
+        return ip
+
+    async def resolve_all(self, hosts):
+        """并发解析一批主机名（自动去重），返回 {主机名: IP 或 None}"""
+        hosts = list(set(hosts))
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def run(host):
+            async with sem:
+                return await self.resolve(host)
+
+        ips = await asyncio.gather(*(run(host) for host in hosts))
+        resolved = dict(zip(hosts, ips))
+        failed = sum(ip is None for ip in ips)
+        logger.debug(f'解析 {len(hosts)} 个主机名，失败 {failed} 个')
+        return resolved
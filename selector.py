@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+from loguru import logger
+
+
+class TopKSelector:
+    """延迟排名的Top-K选择：用有界堆保留延迟最低的K个成功结果
+
+    堆满之后，第K名的延迟就是入选门槛：新探测的超时收紧到该门槛，
+    已经在途且耗时超过门槛的探测会被主动中止，不再等满完整超时。
+    """
+
+    def __init__(self, prober, k=50):
+        self.prober = prober
+        self.k = k
+        self.heap = []        # (-rtt, 序号, proxy)，堆顶是当前入选者中最慢的
+        self.seq = 0
+        self.inflight = {}    # 在途探测 task -> 开始时间
+        self.skipped = []     # 因无法入选而提前放弃的节点（不是失败，不计入健康记录）
+
+    @property
+    def cutoff(self):
+        """当前入选门槛(秒)，堆未满时为探测器的完整超时"""
+        if len(self.heap) < self.k:
+            return self.prober.timeout
+        return min(self.prober.timeout, -self.heap[0][0] / 1000)
+
+    def offer(self, proxy, rtt):
+        """提交一个成功结果(毫秒)，门槛变化时中止已经不可能入选的在途探测"""
+        self.seq += 1
+        item = (-rtt, self.seq, proxy)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+        else:
+            return
+        if len(self.heap) == self.k:
+            self.abort_stragglers()
+
+    def abort_stragglers(self):
+        now = asyncio.get_running_loop().time()
+        cutoff = self.cutoff
+        for task, start in self.inflight.items():
+            if now - start > cutoff:
+                task.cancel()
+
+    def top(self):
+        """按延迟从低到高返回入选的 [proxy]，并写入 rtt"""
+        ranked = sorted(self.heap, key=lambda item: (-item[0], item[1]))
+        for neg_rtt, _, proxy in ranked:
+            proxy.rtt = round(-neg_rtt, 1)
+        return [proxy for _, _, proxy in ranked]
+
+    async def probe(self, proxy, host):
+        """探测一个节点，返回 rtt(毫秒)；失败返回 None；因无法入选而放弃时返回 False"""
+        loop = asyncio.get_running_loop()
+        timeout = self.cutoff
+        task = asyncio.ensure_future(self.prober.connect(host, proxy.port, timeout))
+        self.inflight[task] = loop.time()
+        try:
+            await asyncio.wait({task})
+        finally:
+            del self.inflight[task]
+        if task.cancelled():
+            return False
+        try:
+            return task.result()
+        except asyncio.TimeoutError:
+            # 在收紧后的超时内没连上只说明不够快，不代表节点不可用
+            return False if timeout < self.prober.timeout else None
+        except (OSError, ValueError):
+            return None
+
+    async def select(self, proxies, resolved=None, on_result=None):
+        """探测全部节点，返回实际得出结论的 [(proxy, rtt)]；入选结果通过 top() 获取"""
+        resolved = resolved or {}
+        results = []
+        pending = iter(proxies)
+
+        async def worker():
+            for proxy in pending:
+                rtt = await self.probe(proxy, resolved.get(proxy.host, proxy.host))
+                if rtt is False:
+                    self.skipped.append(proxy)
+                else:
+                    results.append((proxy, rtt))
+                    if rtt is not None:
+                        self.offer(proxy, rtt)
+                if on_result:
+                    on_result(proxy, rtt)
+
+        workers = min(self.prober.concurrency, len(proxies))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        logger.debug(f'Top-{self.k} 门槛 {self.cutoff * 1000:.1f}ms，提前放弃 {len(self.skipped)} 个慢节点')
+        return results
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import signal
+
+import yaml
+from loguru import logger
+
+from pre_check import output_file
+
+CONFIG_FILE = 'config.yaml'
+
+
+class ConfigError(ValueError):
+    """配置文件不符合 SCHEMA"""
+
+
+class Option:
+    """一个配置项：类型、默认值与取值范围；live=False 的配置项修改后需要重启才能生效"""
+
+    __slots__ = ('type', 'default', 'min', 'max', 'choices', 'nullable', 'live')
+
+    def __init__(self, type, default, min=None, max=None, choices=None, nullable=False, live=True):
+        self.type = type
+        self.default = default
+        self.min = min
+        self.max = max
+        self.choices = choices
+        self.nullable = nullable
+        self.live = live
+
+    def check(self, value, path):
+        if value is None:
+            if self.nullable:
+                return None
+            raise ConfigError(f'{path} 不能为空')
+        if self.type is list:
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ConfigError(f'{path} 应为字符串列表')
+            bad = [item for item in value if self.choices and item not in self.choices]
+            if bad:
+                raise ConfigError(f'{path} 含有不支持的取值 {bad}，可选 {list(self.choices)}')
+            return list(value)
+        # bool 是 int 的子类，整数/浮点配置项不接受 true/false；浮点配置项接受整数
+        expected = (int, float) if self.type is float else self.type
+        if isinstance(value, bool) and self.type is not bool or not isinstance(value, expected):
+            raise ConfigError(f'{path} 应为 {self.type.__name__}，实际为 {value!r}')
+        if self.min is not None and value < self.min:
+            raise ConfigError(f'{path} = {value} 不能小于 {self.min}')
+        if self.max is not None and value > self.max:
+            raise ConfigError(f'{path} = {value} 不能大于 {self.max}')
+        if self.choices and value not in self.choices:
+            raise ConfigError(f'{path} = {value!r} 不在可选值 {list(self.choices)} 中')
+        return self.type(value)
+
+
+# 配置结构：顶层的 tgchannel 保持原有格式，其余各节都可省略，省略的项使用默认值
+SCHEMA = {
+    'tgchannel': Option(list, []),
+    'fetch': {
+        'max_in_flight': Option(int, 64, min=1, live=False),  # 连接池上限，建立连接池时确定
+        'per_host': Option(int, 4, min=1, live=False),
+        'timeout': Option(float, 10, min=0.1),
+        'attempts': Option(int, 2, min=1),  # 每个URL的总尝试次数，含第一次请求
+        'channel_budget': Option(int, None, min=1, nullable=True),
+        'cache_max_age': Option(float, 3 * 86400, min=0),
+    },
+    'dns': {
+        'ttl': Option(float, 300, min=0),
+        'negative_ttl': Option(float, 60, min=0),
+        'concurrency': Option(int, 200, min=1),
+        'timeout': Option(float, 5, min=0.1),
+    },
+    'probe': {
+        'concurrency': Option(int, 1000, min=1),
+        'timeout': Option(float, 5, min=0.1),
+        'target_count': Option(int, 50, min=1),
+        'verify_target_count': Option(int, 200, min=1),  # 有代理核心时留给端到端验证筛选的数量
+        'budget': Option(int, None, min=1, nullable=True),
+    },
+    'health': {
+        'good_interval': Option(float, 1800, min=0),
+        'base_backoff': Option(float, 240, min=0),
+        'max_backoff': Option(float, 86400, min=0),
+        'max_age': Option(float, 7 * 86400, min=0),
+    },
+    'verify': {
+        'pool_size': Option(int, 4, min=1),
+        'batch_size': Option(int, 200, min=1),
+        'timeout': Option(float, 10, min=0.1),
+        'concurrency': Option(int, 64, min=1),
+    },
+    'daemon': {
+        'channel_interval': Option(float, 300, min=1),
+        'sub_interval': Option(float, 600, min=1),
+        'probe_interval': Option(float, 60, min=1),
+        'publish_interval': Option(float, 5, min=0.1),
+        'sub_workers': Option(int, 16, min=1),
+        'probe_workers': Option(int, 500, min=1),
+        'queue_size': Option(int, 10000, min=1, live=False),
+        'stale_after': Option(float, 86400, min=60),  # 订阅和节点在这么久没有再出现后从常驻进程中移除
+    },
+    'geo': {
+        'database': Option(str, 'geoip.dat', live=False),  # python geoip.py build 生成的离线IP库，不存在时不查询
+        'countries': Option(list, []),          # 只保留这些国家/地区的节点（ISO 3166 两位代码），空表示不限
+        'exclude_countries': Option(list, []),
+        'exclude_hosting': Option(bool, False),  # 去掉数据中心/云主机网络上的节点
+        'max_per_asn': Option(int, 0, min=0),    # 同一ASN最多保留的节点数，0 表示不限
+    },
+    'output': {
+        'file': Option(str, output_file, live=False),
+        'formats': Option(list, ['clash', 'singbox', 'v2ray', 'base64'],
+                          choices=('clash', 'singbox', 'v2ray', 'base64')),
+        'export_dir': Option(str, 'exports'),
+        'delta_dir': Option(str, 'deltas', live=False),
+        'api_port': Option(int, 0, min=0, max=65535, live=False),
+        'metrics_port': Option(int, 0, min=0, max=65535, live=False),
+    },
+    'tester': {
+        'max_test': Option(int, 200, min=1),
+        'max_workers': Option(int, 32, min=1),
+        'rate_interval': Option(float, 0, min=0),
+        'convert_max_test': Option(int, 100, min=1),
+        'convert_max_workers': Option(int, 20, min=1),
+    },
+}
+
+
+def validate(data, schema=SCHEMA, path=''):
+    """按 SCHEMA 校验配置并补全默认值，返回完整的配置字典；未知的配置项也视为错误（多半是拼写错误）"""
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ConfigError(f'{path or "配置文件"} 应为映射')
+    unknown = set(data) - set(schema)
+    if unknown:
+        raise ConfigError(f'未知的配置项: {", ".join(path + key for key in sorted(unknown))}')
+    config = {}
+    for key, option in schema.items():
+        if isinstance(option, dict):
+            config[key] = validate(data.get(key), option, f'{path}{key}.')
+        elif key in data:
+            config[key] = option.check(data[key], path + key)
+        else:
+            config[key] = list(option.default) if isinstance(option.default, list) else option.default
+    return config
+
+
+def diff(old, new, schema=SCHEMA, path=''):
+    """比较两份配置，返回 [(配置项路径, 是否可热更新)]"""
+    changed = []
+    for key, option in schema.items():
+        if isinstance(option, dict):
+            changed.extend(diff(old[key], new[key], option, f'{path}{key}.'))
+        elif old[key] != new[key]:
+            changed.append((path + key, option.live))
+    return changed
+
+
+def channel_urls(channels):
+    """频道地址统一转换为网页预览地址 https://t.me/s/<频道名>"""
+    return ['https://t.me/s/' + url.rstrip('/').split('/')[-1] for url in channels]
+
+
+class Settings:
+    """配置文件的加载、校验与热更新
+
+    配置文件修改后（watch 按 mtime 检查）或收到 SIGHUP 时重新加载；新配置校验失败时保留旧配置并记录错误，
+    校验通过后依次调用 on_change 注册的回调 callback(config, changed)。
+    """
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.callbacks = []
+        self.mtime = os.stat(path).st_mtime
+        self.config = self.load()
+
+    def __getitem__(self, section):
+        return self.config[section]
+
+    def load(self):
+        with open(self.path, encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+        return validate(data)
+
+    def on_change(self, callback):
+        self.callbacks.append(callback)
+
+    def reload(self):
+        """重新加载配置，返回变化的配置项；配置无效时保留当前配置并返回 None"""
+        try:
+            self.mtime = os.stat(self.path).st_mtime
+            config = self.load()
+        except (OSError, yaml.YAMLError, ConfigError) as e:
+            logger.error(f'重新加载配置失败，继续使用当前配置: {e}')
+            return None
+        changed = diff(self.config, config)
+        if not changed:
+            return changed
+        self.config = config
+        logger.info(f'配置已重新加载，变化的配置项: {", ".join(path for path, _ in changed)}')
+        restart = [path for path, live in changed if not live]
+        if restart:
+            logger.warning(f'以下配置项需要重启后生效: {", ".join(restart)}')
+        for callback in self.callbacks:
+            callback(config, changed)
+        return changed
+
+    async def watch(self, interval=5):
+        """常驻进程中运行：文件修改或收到 SIGHUP 时重新加载"""
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime != self.mtime:
+                self.reload()
+
+
+def load_settings(path=CONFIG_FILE):
+    """读取并校验配置，配置无效时以错误信息退出"""
+    try:
+        return Settings(path)
+    except (OSError, yaml.YAMLError, ConfigError) as e:
+        raise SystemExit(f'配置文件 {path} 无效: {e}')
@@ -0,0 +1,148 @@
+import random
+import sqlite3
+import time
+
+# 来源评分数据库，跨多次运行保留每个频道/订阅的产出历史
+DB_FILE = 'source_scores.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    url          TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    first_seen   REAL NOT NULL,
+    last_crawled REAL,
+    crawls       INTEGER NOT NULL DEFAULT 0,
+    score        REAL NOT NULL DEFAULT 0,
+    updated      REAL,
+    nodes        INTEGER NOT NULL DEFAULT 0,
+    new          INTEGER NOT NULL DEFAULT 0,
+    live         INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# 一次抓取的产出价值：可用节点最重要，其次是从未见过的新端点，去重后的节点数只占很小的权重
+YIELD_WEIGHTS = {'live': 1.0, 'new': 0.3, 'nodes': 0.05}
+
+
+def source_yields(dedup_index, new_endpoints, live_endpoints, channel_links=None):
+    """统计本轮每个来源的产出 {URL: {'nodes', 'new', 'live'}}
+
+    订阅按其贡献的去重后节点计算；频道的产出是它直接贴出的节点加上它列出的所有订阅的产出。
+    """
+    yields = {url: {'nodes': 0, 'new': 0, 'live': 0} for url in dedup_index.source_urls}
+    for digest, source_ids in dedup_index.sources.items():
+        endpoint = dedup_index.nodes[digest].endpoint
+        is_new, is_live = endpoint in new_endpoints, endpoint in live_endpoints
+        for source_id in source_ids:
+            counts = yields[dedup_index.source_urls[source_id]]
+            counts['nodes'] += 1
+            counts['new'] += is_new
+            counts['live'] += is_live
+    for channel, urls in (channel_links or {}).items():
+        total = yields.setdefault(channel, {'nodes': 0, 'new': 0, 'live': 0})
+        for url in urls:
+            for field, value in yields.get(url, {}).items():
+                total[field] += value
+    return yields
+
+
+class SourceScores:
+    """按来源记录历史产出并分配抓取/探测预算
+
+    每次抓取的产出折算为一个价值加到评分上，评分按 half_life 指数衰减；
+    抓取份额 crawl_share 与评分成正比：还在评估期（抓取次数少于 min_crawls）或评分达到 min_score 的来源为1，
+    低于 min_score 时按 评分/min_score 递减，最低为 explore，长期没有产出的来源也不会被永久放弃。
+    单次运行按份额抽样（should_crawl），常驻进程按份额拉长刷新间隔（crawl_interval）。
+    """
+
+    def __init__(self, path=DB_FILE, half_life=3 * 86400, min_crawls=3, min_score=0.5, explore=0.1, rng=None):
+        self.half_life = half_life
+        self.min_crawls = min_crawls
+        self.min_score = min_score
+        self.explore = explore
+        self.rng = rng or random.Random()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+        self.rows = {}
+        self.load()
+
+    def close(self):
+        self.conn.close()
+
+    def load(self):
+        rows = self.conn.execute('SELECT url, crawls, score, updated FROM sources')
+        self.rows = {url: (crawls, score, updated) for url, crawls, score, updated in rows}
+
+    def score(self, url, now=None):
+        """当前（衰减后）评分，未知来源为 None"""
+        row = self.rows.get(url)
+        if row is None:
+            return None
+        _, score, updated = row
+        now = now or time.time()
+        return score * 0.5 ** (max(0.0, now - (updated or now)) / self.half_life)
+
+    def crawl_share(self, url, now=None):
+        """来源应得的抓取份额，取值 [explore, 1]"""
+        row = self.rows.get(url)
+        if row is None or row[0] < self.min_crawls or self.min_score <= 0:
+            return 1.0
+        return max(self.explore, min(1.0, self.score(url, now) / self.min_score))
+
+    def should_crawl(self, url, now=None):
+        share = self.crawl_share(url, now)
+        return share >= 1.0 or self.rng.random() < share
+
+    def crawl_interval(self, url, interval, max_interval=None, now=None):
+        """常驻进程中来源的刷新间隔：基础间隔 interval 除以抓取份额，不超过 max_interval"""
+        interval = interval / self.crawl_share(url, now)
+        return min(interval, max_interval) if max_interval else interval
+
+    def plan(self, urls, budget=None, now=None):
+        """从 urls 中选出本轮要抓取的来源：评估中的在前，其余按评分从高到低，最多 budget 个"""
+        now = now or time.time()
+        chosen = [url for url in urls if self.should_crawl(url, now)]
+        chosen.sort(key=lambda url: (url in self.rows and self.rows[url][0] >= self.min_crawls,
+                                     -(self.score(url, now) or 0)))
+        return chosen[:budget]
+
+    def endpoint_priority(self, dedup_index, now=None):
+        """每个端点的探测优先级：它所属节点的各个来源中最高的评分，未知来源按 min_score 计"""
+        now = now or time.time()
+        source_scores = [self.score(url, now) for url in dedup_index.source_urls]
+        source_scores = [self.min_score if score is None else score for score in source_scores]
+        priority = {}
+        for endpoint, digests in dedup_index.endpoints.items():
+            best = 0.0
+            for digest in digests:
+                for source_id in dedup_index.sources[digest]:
+                    best = max(best, source_scores[source_id])
+            priority[endpoint] = best
+        return priority
+
+    def update(self, crawled, yields, now=None):
+        """记录本轮抓取过的来源 {URL: kind} 及其产出，没有产出的来源价值为0"""
+        now = now or time.time()
+        rows = []
+        for url, kind in crawled.items():
+            counts = yields.get(url, {})
+            value = sum(weight * counts.get(field, 0) for field, weight in YIELD_WEIGHTS.items())
+            score = (self.score(url, now) or 0.0) + value
+            rows.append((url, kind, now, now, score, now,
+                         counts.get('nodes', 0), counts.get('new', 0), counts.get('live', 0)))
+        self.conn.executemany(
+            'INSERT INTO sources (url, kind, first_seen, last_crawled, crawls, score, updated, nodes, new, live) '
+            'VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET last_crawled = excluded.last_crawled, crawls = crawls + 1, '
+            'score = excluded.score, updated = excluded.updated, nodes = excluded.nodes, '
+            'new = excluded.new, live = excluded.live', rows)
+        self.conn.commit()
+        self.load()
+
+    def prune(self, max_age=30 * 86400, now=None):
+        """删除长时间没有再被抓取的来源"""
+        now = now or time.time()
+        self.conn.execute('DELETE FROM sources WHERE last_crawled < ?', (now - max_age,))
+        self.conn.commit()
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import codecs
+import re
+
+import yaml
+
+# 判定订阅是否为Base64编码时查看的开头字节数
+DETECT_SIZE = 256
+# 单行最大长度，超过的行直接丢弃，保证缓冲区有上限
+MAX_LINE = 64 * 1024
+
+BASE64_HEAD = re.compile(rb'[A-Za-z0-9+/=_\-\s]+')
+WHITESPACE = b' \t\r\n'
+URLSAFE = bytes.maketrans(b'-_', b'+/')
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class StreamDecoder:
+    """增量解码订阅内容：自动识别Base64，按行切分并逐行解析，内存占用与订阅大小无关
+
+    feed() 每收到一块响应数据就产出这一块里已经完整的解析结果，close() 产出剩余部分。
+    遇到 Clash YAML 的顶层 proxies: 时，按条目切分并逐条交给 parse_clash_item，同样无需整份文档。
+    """
+
+    def __init__(self, parse_line, parse_clash_item=None, max_line=MAX_LINE):
+        self.parse_line = parse_line
+        self.parse_clash_item = parse_clash_item
+        self.max_line = max_line
+        self.in_proxies = False  # 是否处于 Clash 的 proxies: 列表中
+        self.item_indent = None
+        self.item = []           # 当前 Clash 条目的行
+        self.mode = None        # 'base64' 或 'plain'，读到足够的开头数据后确定
+        self.head = b''
+        self.b64_rest = b''     # 不足4字节、暂时无法解码的Base64尾巴
+        self.text = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self.pending = ''       # 还没遇到换行符的半行
+
+    def feed(self, chunk):
+        if self.mode is None:
+            self.head += chunk
+            if len(self.head) < DETECT_SIZE:
+                return
+            chunk, self.head = self.head, b''
+            self.mode = self.detect(chunk)
+        yield from self.lines(self.decode(chunk))
+
+    def close(self):
+        if self.mode is None:
+            chunk, self.head = self.head, b''
+            self.mode = self.detect(chunk)
+            yield from self.lines(self.decode(chunk))
+        if self.mode == 'base64' and self.b64_rest:
+            rest, self.b64_rest = self.b64_rest, b''
+            yield from self.lines(self.b64decode(rest + b'=' * (-len(rest) % 4)))
+        yield from self.lines(self.text.decode(b'', final=True) + '\n')
+        yield from self.flush_item()
+
+    @staticmethod
+    def detect(data):
+        head = data[:DETECT_SIZE].strip()
+        if head and b'://' not in head and BASE64_HEAD.fullmatch(head):
+            return 'base64'
+        return 'plain'
+
+    def b64decode(self, data):
+        try:
+            return self.text.decode(base64.b64decode(data.translate(URLSAFE)))
+        except binascii.Error:
+            return ''
+
+    def decode(self, chunk):
+        if self.mode == 'plain':
+            return self.text.decode(chunk)
+        data = self.b64_rest + chunk.translate(None, WHITESPACE)
+        cut = len(data) // 4 * 4
+        self.b64_rest = data[cut:]
+        return self.b64decode(data[:cut])
+
+    def lines(self, text):
+        if not text:
+            return
+        parts = (self.pending + text).split('\n')
+        self.pending = parts.pop()
+        if len(self.pending) > self.max_line:
+            self.pending = ''
+        for raw in parts:
+            raw = raw.rstrip()
+            if self.in_proxies:
+                stripped = raw.lstrip()
+                if not stripped or stripped.startswith('#'):
+                    continue
+                indent = len(raw) - len(stripped)
+                if indent or stripped.startswith('-'):
+                    if stripped.startswith('-') and indent == (self.item_indent if self.item_indent is not None else indent):
+                        # 新条目开始，上一个条目已经完整
+                        yield from self.flush_item()
+                        self.item_indent = indent
+                    if self.item_indent is not None:
+                        self.item.append(raw[min(indent, self.item_indent):])
+                    continue
+                # 遇到新的顶层键，proxies 列表结束
+                yield from self.flush_item()
+                self.in_proxies = False
+            if raw == 'proxies:' and self.parse_clash_item:
+                self.in_proxies = True
+                self.item_indent = None
+                continue
+            line = raw.strip()
+            if line:
+                record = self.parse_line(line)
+                if record:
+                    yield record
+
+    def flush_item(self):
+        if not self.item:
+            return
+        text, self.item = '\n'.join(self.item), []
+        try:
+            items = yaml.load(text, Loader=YAML_LOADER)
+        except yaml.YAMLError:
+            return
+        for item in items or []:
+            record = self.parse_clash_item(item)
+            if record:
+                yield record
@@ -5,11 +5,37 @@ import requests
 import json
 import time
 import random
-from urllib.parse import urlparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+from models import from_dict
+
+class ProxyRateLimiter:
+    """按代理端点限速：经同一代理相邻两次请求至少间隔 interval 秒，不同代理互不影响；interval 为 0 时不限速
+
+    测试目标是所有代理共用的，按目标限速会把全部并发串行成每秒 1/interval 个请求。
+    """
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.next_allowed = {}
+        self.lock = threading.Lock()
+
+    def wait(self, endpoint):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_allowed.get(endpoint, now))
+            self.next_allowed[endpoint] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
 
 class ProxyTester:
-    def __init__(self, proxy_file='collected_proxies.json'):
+    def __init__(self, proxy_file='collected_proxies.json', rate_interval=0):
         self.proxy_file = proxy_file
+        self.rate_limiter = ProxyRateLimiter(rate_interval)
         self.test_urls = [
             'http://httpbin.org/ip',
             'http://ip-api.com/json',
@@ -23,26 +49,39 @@ class ProxyTester:
         try:
             with open(self.proxy_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                return data.get('proxies', [])
+                return [proxy for proxy in map(from_dict, data.get('proxies', [])) if proxy]
         except Exception as e:
             print(f"❌ 加载代理文件失败: {e}")
             return []
     
     def format_proxy_url(self, proxy):
         """格式化代理URL"""
-        if proxy['type'] == 'ss':
+        if proxy.type == 'ss':
             # SS代理需要特殊处理，这里简化为HTTP代理格式
-            return f"http://{proxy['host']}:{proxy['port']}"
-        elif proxy['type'] == 'vmess':
+            return f"http://{proxy.host}:{proxy.port}"
+        elif proxy.type == 'vmess':
             # VMess代理也简化为HTTP代理格式
-            return f"http://{proxy['host']}:{proxy['port']}"
-        elif proxy['type'] == 'trojan':
+            return f"http://{proxy.host}:{proxy.port}"
+        elif proxy.type == 'trojan':
             # Trojan代理简化为HTTP代理格式
-            return f"http://{proxy['host']}:{proxy['port']}"
+            return f"http://{proxy.host}:{proxy.port}"
         else:
-            return f"http://{proxy['host']}:{proxy['port']}"
+            return f"http://{proxy.host}:{proxy.port}"
     
-    def test_proxy_basic(self, proxy, timeout=10):
+    def make_session(self, proxy):
+        """为单个代理创建连接池会话，同一代理的各项测试复用连接"""
+        proxy_url = self.format_proxy_url(proxy)
+        session = requests.Session()
+        session.proxies = {
+            'http': proxy_url,
+            'https': proxy_url
+        }
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def test_proxy_basic(self, proxy, timeout=10, session=None):
         """基础代理连通性测试"""
         proxy_url = self.format_proxy_url(proxy)
         proxies = {
@@ -52,7 +91,8 @@ class ProxyTester:
         
         try:
             # 测试获取IP
-            response = requests.get(
+            self.rate_limiter.wait(proxy.endpoint)
+            response = (session or requests).get(
                 self.test_urls[0], 
                 proxies=proxies, 
                 timeout=timeout,
@@ -73,7 +113,7 @@ class ProxyTester:
         except Exception as e:
             return False, str(e)
     
-    def test_baidu_access(self, proxy, timeout=15):
+    def test_baidu_access(self, proxy, timeout=15, session=None):
         """测试访问百度"""
         proxy_url = self.format_proxy_url(proxy)
         proxies = {
@@ -82,7 +122,8 @@ class ProxyTester:
         }
         
         try:
-            response = requests.get(
+            self.rate_limiter.wait(proxy.endpoint)
+            response = (session or requests).get(
                 self.baidu_url,
                 proxies=proxies,
                 timeout=timeout,
@@ -133,7 +174,7 @@ class ProxyTester:
         baidu_count = 0
         
         for i, proxy in enumerate(test_proxies, 1):
-            print(f"[{i}/{len(test_proxies)}] 测试代理: {proxy['host']}:{proxy['port']} ({proxy['type']})")
+            print(f"[{i}/{len(test_proxies)}] 测试代理: {proxy.host}:{proxy.port} ({proxy.type})")
             
             # 基础连通性测试
             is_working, result = self.test_proxy_basic(proxy)
@@ -163,11 +204,73 @@ class ProxyTester:
         print(f"  连通成功: {working_count} ({working_count/len(test_proxies)*100:.1f}%)")
         print(f"  百度可访问: {baidu_count} ({baidu_count/len(test_proxies)*100:.1f}%)")
 
+    def verify_proxy(self, proxy):
+        """用同一个会话依次完成连通性和百度访问测试，返回带各阶段耗时的结果"""
+        result = {'host': proxy.host, 'port': proxy.port, 'type': proxy.type}
+        with self.make_session(proxy) as session:
+            start = time.perf_counter()
+            is_working, detail = self.test_proxy_basic(proxy, session=session)
+            result['basic'] = {'ok': is_working, 'detail': detail,
+                               'ms': round((time.perf_counter() - start) * 1000, 1)}
+            if is_working:
+                start = time.perf_counter()
+                baidu_ok, baidu_detail = self.test_baidu_access(proxy, session=session)
+                result['baidu'] = {'ok': baidu_ok, 'detail': baidu_detail,
+                                   'ms': round((time.perf_counter() - start) * 1000, 1)}
+        return result
+
+    def test_all_proxies_concurrent(self, max_test=200, max_workers=32, report_file='proxy_test_report.json'):
+        """并发测试代理（可按代理限速），结果写入JSON报告"""
+        proxies = self.load_proxies()
+        if not proxies:
+            print("❌ 没有找到代理数据")
+            return None
+
+        test_proxies = proxies[:max_test]
+        print(f"🧪 并发测试 {len(test_proxies)} 个代理（{max_workers} 线程）...\n")
+
+        start = time.perf_counter()
+        results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.verify_proxy, proxy) for proxy in test_proxies]
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                mark = '✅' if result['basic']['ok'] else '❌'
+                print(f"[{i}/{len(test_proxies)}] {mark} {result['host']}:{result['port']} ({result['type']}) "
+                      f"{result['basic']['ms']}ms")
+        elapsed = time.perf_counter() - start
+
+        working = [r for r in results if r['basic']['ok']]
+        report = {
+            'update_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'tested': len(results),
+            'working': len(working),
+            'baidu_ok': sum(1 for r in working if r.get('baidu', {}).get('ok')),
+            'elapsed_s': round(elapsed, 2),
+            'stage_ms': {
+                'basic': round(sum(r['basic']['ms'] for r in results), 1),
+                'baidu': round(sum(r['baidu']['ms'] for r in working if 'baidu' in r), 1)
+            },
+            'results': sorted(results, key=lambda r: (not r['basic']['ok'], r['basic']['ms']))
+        }
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        print("=" * 80)
+        print(f"📈 测试结果统计: 总测试数 {report['tested']}，连通成功 {report['working']}，"
+              f"百度可访问 {report['baidu_ok']}，耗时 {report['elapsed_s']}s")
+        print(f"💾 测试报告已保存到 {report_file}")
+        return report
+
 if __name__ == "__main__":
-    tester = ProxyTester()
+    from settings import load_settings
+
+    options = load_settings()['tester']
+    tester = ProxyTester(rate_interval=options['rate_interval'])
     
     print("🚀 代理测试工具")
     print("=" * 50)
     
-    # 测试前10个代理
-    tester.test_all_proxies(max_test=10)
+    # 并发测试前 max_test 个代理（config.yaml 的 tester 节），可按代理端点限速（rate_interval，默认 0 即不限速），不再全局sleep
+    tester.test_all_proxies_concurrent(max_test=options['max_test'], max_workers=options['max_workers'])
@@ -0,0 +1,30 @@
+import asyncio
+import glob
+import os
+import stat
+import tempfile
+import time
+
+from core_verifier import CoreVerifier
+from models import from_dict
+
+
+def core_files():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), 'core-*.json')))
+
+
+def test_core_that_exits_immediately(tmp_path):
+    # 模拟拒绝配置的核心（如不支持的 ss 加密方式）：启动后立即退出
+    core = tmp_path / 'xray'
+    core.write_text('#!/bin/sh\nexit 23\n')
+    core.chmod(core.stat().st_mode | stat.S_IEXEC)
+    verifier = CoreVerifier(core_path=str(core), batch_size=2, base_port=23400)
+    proxy = from_dict({'type': 'vmess', 'host': '127.0.0.1', 'port': 1, 'id': 'a3482e88-686a-4a58-8126-99c9df64b7bf'})
+    before = core_files()
+
+    start = time.monotonic()
+    results = asyncio.run(verifier.verify([proxy]))
+
+    assert results == []
+    assert time.monotonic() - start < 3  # 不会一直等到 wait_ready 超时
+    assert core_files() - before == set()
@@ -0,0 +1,22 @@
+import asyncio
+
+from gateway import Gateway, UpstreamPool
+
+
+def test_origin_form_request_gets_400(tmp_path):
+    async def run():
+        gateway = Gateway(UpstreamPool(str(tmp_path / 'http_proxies.json')))
+        server = await asyncio.start_server(gateway.handle_http, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET / HTTP/1.1\r\nHost: example.com\r\n\r\n')
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(run()).startswith(b'HTTP/1.1 400 ')